@@ -13,5 +13,11 @@ class AnalyzerConfig(AppConfig):
         if os.environ.get('RUN_MAIN') == 'true' or os.environ.get('RUN_MAIN') is None:
             logger.info("=" * 60)
             logger.info("🚀 Application Analyzer initialisée")
-            logger.info("✅ Utilisation de Gemini API (pas de modèles locaux)")
+            from django.conf import settings
+            if settings.FRAME_CAPTION_BACKEND == 'blip':
+                logger.info("✅ Utilisation de Gemini API + BLIP local pour les vidéos (chargé au premier usage)")
+            elif settings.FRAME_CAPTION_BACKEND == 'hybrid':
+                logger.info("✅ Utilisation de Gemini API + BLIP local pour les frames sans texte")
+            else:
+                logger.info("✅ Utilisation de Gemini API (pas de modèles locaux)")
             logger.info("=" * 60)
\ No newline at end of file
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0003_analysisjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='generation',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
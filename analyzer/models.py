@@ -8,6 +8,8 @@ class ChatSession(models.Model):
     session_id = models.CharField(max_length=100, unique=True, db_index=True)
     created_at = models.DateTimeField(default=timezone.now)
     last_activity = models.DateTimeField(auto_now=True)
+    # Incrémentée à chaque effacement de l'historique (copies des workers périmées)
+    generation = models.PositiveIntegerField(default=0)
     
     def __str__(self):
         return f"Session {self.session_id}"
@@ -42,4 +44,32 @@ class ChatMessage(models.Model):
         return f"{self.role}: {self.content[:50]}"
     
     class Meta:
-        ordering = ['timestamp']
\ No newline at end of file
+        ordering = ['timestamp']
+        indexes = [
+            # Réhydratation / pagination de l'historique d'une session
+            models.Index(fields=['session', 'timestamp'], name='chatmsg_session_ts_idx'),
+        ]
+
+class AnalysisJob(models.Model):
+    """Message traité en arrière-plan (mode job de send-async)"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    job_id = models.CharField(max_length=32, unique=True, db_index=True)
+    session_id = models.CharField(max_length=100, db_index=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    response = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Job {self.job_id} ({self.status})"
+    
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
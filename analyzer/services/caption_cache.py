@@ -0,0 +1,359 @@
+"""
+Cache de descriptions adressé par le contenu des frames.
+
+Chaque image est réduite à une empreinte perceptuelle (dHash 64 bits) et à
+une vignette 32x32 en niveaux de gris. La clé du cache est l'espace de noms
+(nom du modèle + version du prompt) et le dHash; une image quasi identique
+(distance de Hamming <= max_distance) est retrouvée via 4 bandes de 16 bits,
+puis confirmée en comparant les vignettes.
+
+Ni le dHash ni la vignette 32x32 ne voient le texte: deux slides de même
+mise en page mais de texte différent ont la même empreinte. La
+correspondance perceptuelle est donc réservée aux frames vidéo peu
+textuelles; les uploads et les frames textuelles utilisent une empreinte
+exacte (exact_fingerprint, digest du contenu) qui ne retrouve que des
+images identiques.
+
+Deux niveaux: LRU en mémoire, puis SQLite sur disque avec éviction par taille.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+HASH_BANDS = 4
+BAND_BITS = 16
+BAND_MASK = (1 << BAND_BITS) - 1
+THUMBNAIL_SIZE = 32
+
+FrameFingerprint = namedtuple('FrameFingerprint', ['hash', 'thumbnail', 'exact'], defaults=[False])
+
+
+def fingerprint(image):
+    """Calculer le dHash 64 bits et la vignette de vérification d'une image"""
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+
+    # Réduire avant de convertir: la conversion en niveaux de gris se fait sur 64x64
+    small = image.resize((64, 64), Image.BILINEAR, reducing_gap=3.0).convert('L')
+
+    pixels = np.asarray(small.resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    frame_hash = int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+    thumbnail = small.resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.BILINEAR).tobytes()
+    return FrameFingerprint(frame_hash, thumbnail)
+
+
+def exact_fingerprint(digest):
+    """Empreinte d'un digest de contenu (hex): pas de correspondance approchée"""
+    return FrameFingerprint(int(digest[:16], 16), b'', True)
+
+
+def hamming_distance(hash1, hash2):
+
+    return (hash1 ^ hash2).bit_count()
+
+
+def hash_bands(frame_hash):
+
+    return [(frame_hash >> (i * BAND_BITS)) & BAND_MASK for i in range(HASH_BANDS)]
+
+
+def thumbnail_distance(thumb1, thumb2):
+    """Différence absolue moyenne entre deux vignettes (0-255)"""
+    a = np.frombuffer(thumb1, dtype=np.uint8).astype(np.int16)
+    b = np.frombuffer(thumb2, dtype=np.uint8).astype(np.int16)
+    return float(np.mean(np.abs(a - b)))
+
+
+def _to_signed(value):
+    # SQLite stocke des entiers signés 64 bits
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value):
+
+    return value + (1 << 64) if value < 0 else value
+
+
+class CaptionCache:
+
+    def __init__(self, max_entries=2048, max_memory_bytes=8 * 1024 * 1024,
+                 max_distance=3, max_thumbnail_diff=6.0,
+                 db_path=None, max_db_bytes=64 * 1024 * 1024):
+
+        # Le découpage en 4 bandes ne garantit de retrouver que les distances <= 3
+        self.max_distance = min(max_distance, HASH_BANDS - 1)
+        self.max_thumbnail_diff = max_thumbnail_diff
+        self.max_entries = max_entries
+        self.max_memory_bytes = max_memory_bytes
+        self.max_db_bytes = max_db_bytes
+        self.db_path = db_path
+
+        self._entries = OrderedDict()  # (namespace, hash) -> (caption, thumbnail)
+        self._bands = {}  # (namespace, band_index, band_value) -> set(hash)
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'near_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0}
+
+        self._db = None
+        self._db_bytes = 0
+        if db_path:
+            self._open_db(db_path)
+
+        logger.info(f"CaptionCache initialized: max_entries={max_entries}, "
+                    f"max_distance={self.max_distance}, db={db_path or 'disabled'}")
+
+    def get(self, namespace, fp):
+        """Retourner la description mise en cache pour cette empreinte, ou None"""
+        namespace = self._namespace(namespace, fp)
+        with self._lock:
+            key = (namespace, fp.hash)
+            entry = self._entries.get(key)
+            if entry is not None and self._matches(entry[1], fp):
+                self._entries.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return entry[0]
+
+            caption = self._get_near(namespace, fp) if not fp.exact else None
+            if caption is not None:
+                self._counters['near_hits'] += 1
+                return caption
+
+            caption = self._get_from_db(namespace, fp)
+            if caption is not None:
+                self._counters['disk_hits'] += 1
+                self._put_memory(namespace, fp, caption)
+                return caption
+
+            self._counters['misses'] += 1
+            return None
+
+    def put(self, namespace, fp, caption):
+
+        namespace = self._namespace(namespace, fp)
+        with self._lock:
+            self._counters['stores'] += 1
+            self._put_memory(namespace, fp, caption)
+            self._put_db(namespace, fp, caption)
+
+    def stats(self):
+
+        with self._lock:
+            counters = dict(self._counters)
+            counters['entries'] = len(self._entries)
+            counters['memory_bytes'] = self._memory_bytes
+            counters['db_bytes'] = self._db_bytes
+
+        hits = counters['memory_hits'] + counters['near_hits'] + counters['disk_hits']
+        lookups = hits + counters['misses']
+        counters['hit_rate'] = hits / lookups if lookups else 0.0
+        return counters
+
+    def clear(self):
+
+        with self._lock:
+            self._entries.clear()
+            self._bands.clear()
+            self._memory_bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM captions")
+                self._db.commit()
+                self._db_bytes = 0
+
+    @staticmethod
+    def _namespace(namespace, fp):
+
+        # Clés exactes et dHash dans des espaces séparés: jamais comparées entre elles
+        return f"{namespace}:exact" if fp.exact else namespace
+
+    def _matches(self, thumbnail, fp):
+
+        if fp.exact:
+            return True
+        return thumbnail_distance(thumbnail, fp.thumbnail) <= self.max_thumbnail_diff
+
+    def _get_near(self, namespace, fp):
+
+        if self.max_distance == 0:
+            return None
+
+        candidates = set()
+        for index, band in enumerate(hash_bands(fp.hash)):
+            candidates |= self._bands.get((namespace, index, band), set())
+
+        near = sorted(
+            (hamming_distance(candidate, fp.hash), candidate) for candidate in candidates
+        )
+        for distance, candidate in near:
+            if distance > self.max_distance:
+                break
+
+            key = (namespace, candidate)
+            caption, thumbnail = self._entries[key]
+            if self._matches(thumbnail, fp):
+                self._entries.move_to_end(key)
+                return caption
+
+        return None
+
+    def _put_memory(self, namespace, fp, caption):
+
+        key = (namespace, fp.hash)
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous[0])
+
+        self._entries[key] = (caption, fp.thumbnail)
+        self._memory_bytes += len(caption)
+        if not fp.exact:
+            for index, band in enumerate(hash_bands(fp.hash)):
+                self._bands.setdefault((namespace, index, band), set()).add(fp.hash)
+
+        while self._entries and (len(self._entries) > self.max_entries
+                                 or self._memory_bytes > self.max_memory_bytes):
+            (old_namespace, old_hash), (old_caption, _) = self._entries.popitem(last=False)
+            self._memory_bytes -= len(old_caption)
+            for index, band in enumerate(hash_bands(old_hash)):
+                bucket = self._bands.get((old_namespace, index, band))
+                if bucket is not None:
+                    bucket.discard(old_hash)
+                    if not bucket:
+                        del self._bands[(old_namespace, index, band)]
+
+    def _open_db(self, db_path):
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS captions (
+                namespace TEXT NOT NULL,
+                phash INTEGER NOT NULL,
+                band0 INTEGER NOT NULL,
+                band1 INTEGER NOT NULL,
+                band2 INTEGER NOT NULL,
+                band3 INTEGER NOT NULL,
+                thumbnail BLOB NOT NULL,
+                caption TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (namespace, phash)
+            )
+        """)
+        for index in range(HASH_BANDS):
+            self._db.execute(
+                f"CREATE INDEX IF NOT EXISTS captions_band{index}_idx ON captions (namespace, band{index})"
+            )
+        self._db.execute("CREATE INDEX IF NOT EXISTS captions_last_used_idx ON captions (last_used)")
+        self._db.commit()
+        self._db_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM captions").fetchone()[0]
+
+    def _get_from_db(self, namespace, fp):
+
+        if self._db is None:
+            return None
+
+        try:
+            bands = hash_bands(fp.hash)
+            rows = self._db.execute(
+                "SELECT phash, thumbnail, caption FROM captions WHERE namespace = ? AND ("
+                + " OR ".join(f"band{i} = ?" for i in range(HASH_BANDS)) + ")",
+                [namespace, *bands],
+            ).fetchall()
+
+            best = None
+            max_distance = 0 if fp.exact else self.max_distance
+            for phash, thumbnail, caption in rows:
+                distance = hamming_distance(_to_unsigned(phash), fp.hash)
+                if distance <= max_distance and self._matches(thumbnail, fp):
+                    if best is None or distance < best[0]:
+                        best = (distance, phash, caption)
+
+            if best is None:
+                return None
+
+            self._db.execute(
+                "UPDATE captions SET last_used = ? WHERE namespace = ? AND phash = ?",
+                (time.time(), namespace, best[1]),
+            )
+            self._db.commit()
+            return best[2]
+
+        except sqlite3.Error as e:
+            logger.warning(f"Caption cache read error: {e}")
+            return None
+
+    def _put_db(self, namespace, fp, caption):
+
+        if self._db is None:
+            return
+
+        size = len(caption.encode('utf-8')) + len(fp.thumbnail)
+        try:
+            previous = self._db.execute(
+                "SELECT size FROM captions WHERE namespace = ? AND phash = ?",
+                (namespace, _to_signed(fp.hash)),
+            ).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO captions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (namespace, _to_signed(fp.hash), *hash_bands(fp.hash),
+                 fp.thumbnail, caption, size, time.time()),
+            )
+            self._db_bytes += size - (previous[0] if previous else 0)
+
+            if self._db_bytes > self.max_db_bytes:
+                self._evict_db()
+            self._db.commit()
+
+        except sqlite3.Error as e:
+            logger.warning(f"Caption cache write error: {e}")
+
+    def _evict_db(self):
+
+        # Libérer ~10% de marge pour ne pas évincer à chaque insertion
+        target = int(self.max_db_bytes * 0.9)
+        rows = self._db.execute("SELECT rowid, size FROM captions ORDER BY last_used").fetchall()
+
+        evicted = []
+        for rowid, size in rows:
+            if self._db_bytes <= target:
+                break
+            evicted.append((rowid,))
+            self._db_bytes -= size
+
+        self._db.executemany("DELETE FROM captions WHERE rowid = ?", evicted)
+        logger.info(f"Caption cache evicted {len(evicted)} entries from disk")
+
+
+_caption_cache = None
+_caption_cache_lock = threading.Lock()
+
+
+def get_caption_cache():
+    """Cache partagé du process, configuré par les settings Django (None si désactivé)"""
+    global _caption_cache
+
+    from django.conf import settings
+
+    if not getattr(settings, 'CAPTION_CACHE_ENABLED', True):
+        return None
+
+    if _caption_cache is None:
+        with _caption_cache_lock:
+            if _caption_cache is None:
+                _caption_cache = CaptionCache(
+                    max_entries=getattr(settings, 'CAPTION_CACHE_MAX_ENTRIES', 2048),
+                    max_distance=getattr(settings, 'CAPTION_CACHE_MAX_DISTANCE', 3),
+                    db_path=getattr(settings, 'CAPTION_CACHE_DB_PATH', None),
+                    max_db_bytes=getattr(settings, 'CAPTION_CACHE_DB_MAX_BYTES', 64 * 1024 * 1024),
+                )
+    return _caption_cache
@@ -0,0 +1,212 @@
+"""
+Routage des frames entre description locale (BLIP) et extraction distante.
+
+Le prompt d'extraction Gemini sert surtout à transcrire le texte visible.
+CaptionRouter estime d'abord, localement et pour quelques millisecondes,
+si une frame contient des lignes de texte. Les frames sans texte sont
+décrites par le modèle local; seules les frames textuelles, et celles dont
+la description locale est peu sûre, partent vers le modèle distant.
+"""
+import io
+import logging
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from .frame_encoding import EncodedFrame
+
+logger = logging.getLogger(__name__)
+
+# Largeur d'analyse: la détection ne dépend pas de la résolution de la vidéo
+TEXT_ANALYSIS_WIDTH = 640
+# Étagères, feuillages: composantes allongées mais peu de transitions
+MIN_TRANSITIONS_PER_HEIGHT = 3.0
+# Au-delà, la frame est considérée textuelle (transcription distante, cache exact)
+TEXT_HEAVY_COVERAGE = 0.02
+
+
+def _gray(frame):
+
+    if isinstance(frame, EncodedFrame):
+        frame = Image.open(io.BytesIO(frame.data))
+    elif isinstance(frame, bytes):
+        frame = Image.open(io.BytesIO(frame))
+    if isinstance(frame, Image.Image):
+        return np.asarray(frame.convert('L'))
+    return cv2.cvtColor(np.ascontiguousarray(frame, dtype=np.uint8), cv2.COLOR_RGB2GRAY)
+
+
+def text_coverage(frame):
+    """Part de la frame (0-1) couverte par des lignes de texte probables.
+
+    Gradient morphologique binarisé, caractères reliés en lignes par une
+    fermeture horizontale, puis filtrage des composantes qui ont la forme
+    d'une ligne de texte: allongées, de hauteur modérée, remplies en partie
+    et riches en alternances trait / fond.
+    """
+    gray = _gray(frame)
+    height, width = gray.shape
+    if width > TEXT_ANALYSIS_WIDTH:
+        height = max(1, round(height * TEXT_ANALYSIS_WIDTH / width))
+        width = TEXT_ANALYSIS_WIDTH
+        gray = cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA)
+
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, binary = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    lines = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 1)))
+    contours, _ = cv2.findContours(lines, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    text_area = 0
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if h < 6 or h > height * 0.15 or w < 3 * h:
+            continue
+        box = binary[y:y + h, x:x + w]
+        fill = cv2.countNonZero(box) / (w * h)
+        if not 0.25 <= fill <= 0.85:
+            continue
+        # Une ligne de texte alterne trait / fond à chaque caractère: compter
+        # les transitions sur trois rangées, ramenées à la hauteur de ligne
+        rows = box[[h // 3, h // 2, 2 * h // 3]] > 0
+        transitions = np.count_nonzero(rows[:, 1:] != rows[:, :-1]) / 3
+        if transitions * h / w >= MIN_TRANSITIONS_PER_HEIGHT:
+            text_area += w * h
+
+    return text_area / (width * height)
+
+
+def frame_text_coverage(frame):
+    """text_coverage, calculée une seule fois par EncodedFrame"""
+    if not isinstance(frame, EncodedFrame):
+        return text_coverage(frame)
+    if frame.text_coverage is None:
+        frame.text_coverage = text_coverage(frame)
+    return frame.text_coverage
+
+
+class CaptionRouter:
+    """Même interface qu'ImageAnalyzer (extract_image_content,
+    extract_frames_content), utilisable par FrameCaptioner.
+
+    local: VisionCaptioner; remote: ImageAnalyzer. Les descriptions locales
+    acceptées sont mises en cache (cache optionnel); les réponses distantes
+    passent par le cache de l'ImageAnalyzer. Si la réponse groupée du modèle
+    distant est invalide, seules les frames routées vers lui sont reprises
+    une à une: le routage n'est pas refait.
+    """
+
+    ROUTES = ('local', 'remote_text', 'remote_low_confidence', 'cache')
+
+    def __init__(self, local, remote, cache=None, text_threshold=TEXT_HEAVY_COVERAGE, min_confidence=0.3):
+
+        self.local = local
+        self.remote = remote
+        self.cache = cache
+        self.text_threshold = text_threshold
+        self.min_confidence = min_confidence
+        # Un seul lot local à la fois: torch parallélise déjà en interne
+        self._local_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.counters = dict.fromkeys(self.ROUTES, 0)
+        self.remote_calls = 0
+        logger.info(f"CaptionRouter initialized: text_threshold={text_threshold}, "
+                    f"min_confidence={min_confidence}")
+
+    def extract_image_content(self, image_data, raise_errors=False):
+
+        try:
+            return self.extract_frames_content([image_data])[0]
+        except Exception as e:
+            if raise_errors:
+                raise
+            logger.error(f"Error routing frame: {e}")
+            return None
+
+    def extract_frames_content(self, frames, timestamps=None):
+
+        if timestamps is None:
+            timestamps = [None] * len(frames)
+
+        captions = [None] * len(frames)
+        routes = [None] * len(frames)
+        fingerprints = [self._fingerprint(frame) for frame in frames]
+
+        candidates = []
+        for i, frame in enumerate(frames):
+            # Frames textuelles jamais servies par correspondance perceptuelle (voir caption_cache)
+            if frame_text_coverage(frame) >= self.text_threshold:
+                routes[i] = 'remote_text'
+                continue
+            cached = self.cache.get(self._cache_namespace(), fingerprints[i]) if fingerprints[i] else None
+            if cached is not None:
+                captions[i], routes[i] = cached, 'cache'
+            else:
+                candidates.append(i)
+
+        if candidates:
+            with self._local_lock:
+                scored = self.local.caption_batch_scored([frames[i] for i in candidates])
+
+            for i, (caption, confidence) in zip(candidates, scored):
+                if confidence < self.min_confidence:
+                    logger.info(f"Low confidence local caption ({confidence:.2f}), escalating")
+                    routes[i] = 'remote_low_confidence'
+                    continue
+
+                captions[i], routes[i] = caption, 'local'
+                if fingerprints[i]:
+                    self.cache.put(self._cache_namespace(), fingerprints[i], caption)
+
+        remote = [i for i, route in enumerate(routes) if route.startswith('remote')]
+        if len(remote) == 1:
+            captions[remote[0]] = self.remote.extract_image_content(frames[remote[0]], raise_errors=True)
+        elif remote:
+            from .chatbot_orchestrator import BatchResponseError
+            try:
+                contents = self.remote.extract_frames_content(
+                    [frames[i] for i in remote], [timestamps[i] for i in remote]
+                )
+            except BatchResponseError as e:
+                # Routage conservé: seules les frames distantes repartent, une par une
+                logger.warning(f"Malformed batch response ({e}), extracting {len(remote)} frame(s) one by one")
+                contents = [self.remote.extract_image_content(frames[i]) for i in remote]
+            for i, content in zip(remote, contents):
+                captions[i] = content
+
+        with self._lock:
+            for route in routes:
+                self.counters[route] += 1
+            if remote:
+                self.remote_calls += 1
+
+        return captions
+
+    def _fingerprint(self, frame):
+
+        if self.cache is None:
+            return None
+        if isinstance(frame, EncodedFrame):
+            return frame.fingerprint
+
+        from .caption_cache import fingerprint
+        return fingerprint(self.local.to_image(frame))
+
+    def _cache_namespace(self):
+
+        return f"router:{self.local.cache_namespace()}"
+
+    def stats(self):
+
+        with self._lock:
+            frames = sum(self.counters.values())
+            remote_frames = self.counters['remote_text'] + self.counters['remote_low_confidence']
+            return {
+                **self.counters,
+                'frames': frames,
+                'remote_calls': self.remote_calls,
+                # Frames qui seraient toutes parties vers le modèle distant sans routage
+                'remote_frames_saved': frames - remote_frames,
+                'remote_share': remote_frames / frames if frames else 0.0,
+            }
@@ -0,0 +1,247 @@
+"""
+Persistance des échanges du chatbot (ChatSession / ChatMessage).
+
+Les tours de conversation sont mis en file par record_turn, sans accès à
+la base sur le chemin de la requête. Un thread les écrit par lots: une
+transaction et un bulk_create par lot, au plus toutes les flush_interval
+secondes. La lecture de l'historique est paginée par curseur sur
+(timestamp, id), servie par l'index (session, timestamp): le coût d'une
+page ne dépend pas de la longueur de la session.
+"""
+import atexit
+import logging
+import threading
+from collections import namedtuple
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+PendingMessage = namedtuple('PendingMessage', ['session_id', 'role', 'message_type', 'content', 'metadata', 'timestamp'])
+
+
+def encode_cursor(timestamp, message_id):
+
+    return f"{int(timestamp.timestamp()) * 1_000_000 + timestamp.microsecond}-{message_id}"
+
+
+def decode_cursor(cursor):
+    """(timestamp, id) d'un curseur; ValueError s'il est invalide"""
+    micros, message_id = (int(part) for part in cursor.split('-', 1))
+    timestamp = datetime.fromtimestamp(micros // 1_000_000, tz=dt_timezone.utc)
+    return timestamp.replace(microsecond=micros % 1_000_000), message_id
+
+
+class ChatStore:
+
+    def __init__(self, flush_interval=0.5, batch_size=200, max_pending=10000):
+
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._pending = []
+        self._lock = threading.Lock()
+        # Sérialise les écritures (flusher, flush explicite, suppression)
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        atexit.register(self.flush)
+        logger.info(f"ChatStore initialized: flush_interval={flush_interval}s, batch_size={batch_size}")
+
+    def record_turn(self, session_id, user_content, assistant_content, message_type='text', metadata=None):
+        """Mettre en file un échange (message utilisateur + réponse); retourne son horodatage"""
+        now = timezone.now()
+        # Même horodatage: l'ordre d'insertion (id) départage les deux messages
+        messages = [
+            PendingMessage(session_id, 'user', message_type, user_content, metadata or {}, now),
+            PendingMessage(session_id, 'assistant', message_type, assistant_content, {}, now),
+        ]
+
+        with self._lock:
+            self._pending.extend(messages)
+            overflow = len(self._pending) - self.max_pending
+            if overflow > 0:
+                # Base indisponible depuis longtemps: oublier les plus anciens
+                del self._pending[:overflow]
+                self.dropped += overflow
+                logger.warning(f"Chat store backlog full, dropped {overflow} message(s)")
+            full = len(self._pending) >= self.batch_size
+            self._ensure_flusher()
+
+        if full:
+            self._wakeup.set()
+        return now
+
+    def _ensure_flusher(self):
+
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._flush_loop, name='chat-store-flusher', daemon=True)
+            self._thread.start()
+
+    def _flush_loop(self):
+
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Chat store flush failed: {e}", exc_info=True)
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """Écrire tout ce qui est en file; retourne le nombre de messages écrits"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+
+            try:
+                self._write(batch)
+            except DatabaseError as e:
+                logger.error(f"Cannot persist {len(batch)} chat message(s): {e}")
+                with self._lock:
+                    self.dropped += len(batch)
+                return 0
+
+            with self._lock:
+                self.written += len(batch)
+                self.flushes += 1
+            return len(batch)
+
+    def _write(self, batch):
+
+        from ..models import ChatMessage, ChatSession
+
+        session_ids = {message.session_id for message in batch}
+        with transaction.atomic():
+            sessions = dict(
+                ChatSession.objects.filter(session_id__in=session_ids).values_list('session_id', 'id')
+            )
+            missing = session_ids - sessions.keys()
+            if missing:
+                ChatSession.objects.bulk_create(
+                    [ChatSession(session_id=session_id) for session_id in missing], ignore_conflicts=True
+                )
+                sessions.update(
+                    ChatSession.objects.filter(session_id__in=missing).values_list('session_id', 'id')
+                )
+
+            ChatMessage.objects.bulk_create([
+                ChatMessage(
+                    session_id=sessions[message.session_id],
+                    role=message.role,
+                    message_type=message.message_type,
+                    content=message.content,
+                    metadata=message.metadata,
+                    timestamp=message.timestamp,
+                )
+                for message in batch
+            ], batch_size=500)
+            ChatSession.objects.filter(id__in=sessions.values()).update(last_activity=timezone.now())
+
+        logger.info(f"Persisted {len(batch)} chat message(s) for {len(session_ids)} session(s)")
+
+    def history_page(self, session_id, before=None, limit=50):
+        """(messages du plus ancien au plus récent, curseur de la page précédente ou None).
+
+        before: curseur renvoyé par l'appel précédent, pour remonter dans
+        l'historique.
+        """
+        from ..models import ChatMessage, ChatSession
+
+        if before is None:
+            # Première page: inclure les échanges encore en file
+            self.flush()
+
+        session_pk = ChatSession.objects.filter(session_id=session_id).values_list('id', flat=True).first()
+        if session_pk is None:
+            return [], None
+
+        rows = ChatMessage.objects.filter(session_id=session_pk)
+        if before is not None:
+            timestamp, message_id = decode_cursor(before)
+            # timestamp__lte borne le parcours de l'index, le Q départage les ex aequo
+            rows = rows.filter(timestamp__lte=timestamp).filter(Q(timestamp__lt=timestamp) | Q(id__lt=message_id))
+
+        rows = list(
+            rows.order_by('-timestamp', '-id')
+            .values('id', 'role', 'message_type', 'content', 'metadata', 'timestamp')[:limit + 1]
+        )
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        cursor = encode_cursor(rows[-1]['timestamp'], rows[-1]['id']) if has_more else None
+
+        rows.reverse()
+        return rows, cursor
+
+    def session_version(self, session_id):
+        """(génération, horodatage du dernier message) persistés, None si la session est inconnue.
+
+        Une requête indexée: permet à un worker de savoir si sa copie de la
+        session est périmée (historique effacé ou échanges traités ailleurs).
+        """
+        from ..models import ChatSession
+
+        return (
+            ChatSession.objects.filter(session_id=session_id)
+            .annotate(last_message=Max('messages__timestamp'))
+            .values_list('generation', 'last_message')
+            .first()
+        )
+
+    def delete_session(self, session_id):
+        """Supprimer l'historique persisté d'une session (et ce qui est en file).
+
+        La session est gardée et sa génération incrémentée, pour que les
+        autres workers abandonnent leur copie. Retourne la nouvelle génération.
+        """
+        from ..models import ChatMessage, ChatSession
+
+        with self._flush_lock:
+            with self._lock:
+                self._pending = [message for message in self._pending if message.session_id != session_id]
+            with transaction.atomic():
+                ChatSession.objects.get_or_create(session_id=session_id)
+                deleted, _ = ChatMessage.objects.filter(session__session_id=session_id).delete()
+                ChatSession.objects.filter(session_id=session_id).update(generation=F('generation') + 1)
+                generation = ChatSession.objects.filter(session_id=session_id).values_list('generation', flat=True).get()
+        logger.info(f"Deleted persisted history of session {session_id} ({deleted} row(s))")
+        return generation
+
+    def stats(self):
+
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'written': self.written,
+                'dropped': self.dropped,
+                'flushes': self.flushes,
+            }
+
+
+_chat_store = None
+_chat_store_lock = threading.Lock()
+
+
+def get_chat_store():
+
+    global _chat_store
+    if _chat_store is None:
+        from django.conf import settings
+
+        with _chat_store_lock:
+            if _chat_store is None:
+                _chat_store = ChatStore(
+                    flush_interval=getattr(settings, 'CHAT_PERSIST_FLUSH_INTERVAL', 0.5),
+                    batch_size=getattr(settings, 'CHAT_PERSIST_BATCH_SIZE', 200),
+                )
+    return _chat_store
@@ -3,8 +3,23 @@ import logging
 from dotenv import load_dotenv
 import google.generativeai as genai
 from PIL import Image
+import numpy as np
 import io
+import json
 import re
+import threading
+from collections import deque
+
+import xxhash
+
+from .caption_cache import exact_fingerprint
+from .caption_router import TEXT_HEAVY_COVERAGE, frame_text_coverage
+from .frame_encoding import EncodedFrame
+from .model_client import get_model
+from .resilience import REFUSALS, REMOTE_FAILURES, CircuitOpenError, ModelRefusalError, ModelUnavailableError
+from .response_cache import response_key
+from .media_artifacts import MediaArtifacts
+from .single_flight import get_single_flight, request_key
 
 load_dotenv()
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
@@ -14,23 +29,13 @@ if not GOOGLE_API_KEY:
         "Please create a .env file with: GOOGLE_API_KEY=your_key_here"
     )
 
-genai.configure(api_key=GOOGLE_API_KEY)
+# GEMINI_TRANSPORT: 'grpc' (défaut du SDK) ou 'rest'
+genai.configure(api_key=GOOGLE_API_KEY, transport=os.getenv('GEMINI_TRANSPORT') or None)
 logger = logging.getLogger(__name__)
 
 
-class ImageAnalyzer:
-    
-    def __init__(self, model_name='gemini-2.0-flash-exp'):
-        self.model = genai.GenerativeModel(model_name)
-    
-    def extract_image_content(self, image_data):
-        
-        try:
-            # Convertir en PIL Image
-            image = self._load_image(image_data)
-            
-            # Prompt d'extraction précise
-            extraction_prompt = """Analyse cette image et décris EXACTEMENT ce que tu vois.
+# Prompt d'extraction précise
+EXTRACTION_PROMPT = """Analyse cette image et décris EXACTEMENT ce que tu vois.
 
 RÈGLES STRICTES:
 1. Si l'image contient du TEXTE (capture d'écran, document, test, article):
@@ -44,22 +49,254 @@ RÈGLES STRICTES:
    → Explique sa structure et son contenu
 
 NE FAIS AUCUNE INTERPRÉTATION CRÉATIVE. Sois FACTUEL."""
+
+# Prompt d'extraction groupée: plusieurs frames, une réponse JSON
+BATCH_EXTRACTION_PROMPT = """Voici {count} frames extraites d'une vidéo, chacune précédée de son numéro et de son horodatage.
+Pour CHAQUE frame, décris EXACTEMENT ce que tu vois.
+
+RÈGLES STRICTES:
+1. TEXTE visible (slide, document, capture d'écran) → transcris-le mot à mot
+2. PHOTO/SCÈNE sans texte → décris la scène, les objets, les personnes de manière factuelle
+3. GRAPHIQUE/DIAGRAMME → explique sa structure et son contenu
+
+NE FAIS AUCUNE INTERPRÉTATION CRÉATIVE. Sois FACTUEL.
+
+Réponds UNIQUEMENT avec un tableau JSON de {count} objets, dans l'ordre des frames:
+[{{"frame": 1, "content": "..."}}, {{"frame": 2, "content": "..."}}]"""
+
+
+# À incrémenter à chaque modification d'un prompt: invalide le cache de descriptions
+EXTRACTION_PROMPT_VERSION = 'extract-v1'
+BATCH_EXTRACTION_PROMPT_VERSION = 'batch-v1'
+
+
+def _stream_digest(f, chunk_size=1024 * 1024):
+    
+    hasher = xxhash.xxh3_128()
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class BatchResponseError(ValueError):
+    """Réponse groupée illisible ou incomplète"""
+
+
+def _response_text(response):
+    """Texte d'une réponse generate_content, ModelRefusalError si elle n'en a pas"""
+    try:
+        return response.text
+    except ValueError as e:
+        # Aucune partie texte: réponse bloquée (filtre de sécurité) ou vide
+        raise ModelRefusalError(f"Réponse sans texte: {e}") from e
+
+
+def format_timestamp(seconds):
+    
+    seconds = int(seconds)
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+class ImageAnalyzer:
+    
+    def __init__(self, model_name='gemini-2.0-flash-exp', model=None, cache=None, fallback=None,
+                 text_threshold=TEXT_HEAVY_COVERAGE):
+        self.model_name = model_name
+        # Client partagé par le processus (analyzer.services.model_client)
+        self.model = model if model is not None else get_model(model_name)
+        # CaptionCache optionnel (analyzer.services.caption_cache)
+        self.cache = cache
+        # Frames vidéo plus textuelles que ce seuil: cache exact, pas perceptuel
+        self.text_threshold = text_threshold
+        # Descripteur local (VisionCaptioner) utilisé quand le disjoncteur du modèle est ouvert
+        self.fallback = fallback
+        self.fallbacks = 0
+    
+    def extract_image_content(self, image_data, raise_errors=False, digest=None):
+        """digest: empreinte du fichier si l'appelant la connaît déjà (upload)"""
+        try:
+            # Empreinte des octets encodés, avant tout décodage
+            digest = digest or self._digest(image_data)
+            
+            # Convertir en PIL Image
+            image = self._load_image(image_data)
+            
+            fp = None
+            if self.cache is not None:
+                fp = self._cache_fingerprint(image, digest)
+                cached = self.cache.get(self._cache_namespace(EXTRACTION_PROMPT_VERSION), fp)
+                if cached is not None:
+                    return cached
             
-            response = self.model.generate_content([extraction_prompt, image])
-            return response.text
+            def extract():
+                content = _response_text(self.model.generate_content([EXTRACTION_PROMPT, self._to_part(image)]))
+                if fp is not None:
+                    self.cache.put(self._cache_namespace(EXTRACTION_PROMPT_VERSION), fp, content)
+                return content
+            
+            # Même image en cours d'extraction (double envoi, autre onglet): attendre son résultat
+            key = request_key(self._cache_namespace(EXTRACTION_PROMPT_VERSION), digest)
+            try:
+                return get_single_flight().do(key, extract)
+            except CircuitOpenError:
+                if self.fallback is None:
+                    raise
+                self.fallbacks += 1
+                logger.warning(f"{self.model_name} unavailable, captioning image locally")
+                return self.fallback.extract_image_content(image, raise_errors=True)
             
         except Exception as e:
+            if raise_errors:
+                raise
+            # None et non un texte d'erreur: ne doit jamais finir dans un prompt
             logger.error(f"Image extraction error: {e}")
-            return f"❌ Erreur d'extraction: {str(e)}"
+            return None
     
-    def _load_image(self, image_data):
+    def extract_frames_content(self, frames, timestamps=None):
+        """Décrire plusieurs frames en un seul appel au modèle.
+        
+        Les frames déjà présentes dans le cache ne sont pas renvoyées au modèle.
+        Lève BatchResponseError si la réponse JSON est invalide, pour que
+        l'appelant puisse se rabattre sur extract_image_content frame par frame.
+        """
+        if timestamps is None:
+            timestamps = [None] * len(frames)
+        
+        images = [self._load_image(frame) for frame in frames]
+        contents = [None] * len(images)
+        namespace = self._cache_namespace(BATCH_EXTRACTION_PROMPT_VERSION)
+        
+        fps = None
+        if self.cache is not None:
+            fps = [self._cache_fingerprint(image, self._digest(frame)) for image, frame in zip(images, frames)]
+            contents = [self.cache.get(namespace, fp) for fp in fps]
+        
+        missing = [i for i, content in enumerate(contents) if content is None]
+        if not missing:
+            return contents
+        
+        request = [BATCH_EXTRACTION_PROMPT.format(count=len(missing))]
+        for number, i in enumerate(missing, 1):
+            timestamp = timestamps[i]
+            label = f"Frame {number}" if timestamp is None else f"Frame {number} [{format_timestamp(timestamp)}]"
+            request.append(label)
+            request.append(self._to_part(images[i]))
+        
+        try:
+            response = self.model.generate_content(
+                request,
+                generation_config={'response_mime_type': 'application/json'}
+            )
+        except CircuitOpenError:
+            if self.fallback is None:
+                raise
+            self.fallbacks += len(missing)
+            logger.warning(f"{self.model_name} unavailable, captioning {len(missing)} frame(s) locally")
+            # Pas de mise en cache: ce ne sont pas des descriptions du modèle distant
+            for i, content in zip(missing, self.fallback.extract_frames_content([images[i] for i in missing])):
+                contents[i] = content
+            return contents
+        
+        for i, content in zip(missing, self._parse_batch_response(_response_text(response), len(missing))):
+            contents[i] = content
+            if fps is not None:
+                self.cache.put(namespace, fps[i], content)
+        
+        return contents
+    
+    def _cache_namespace(self, prompt_version):
+        
+        return f"{self.model_name}:{prompt_version}"
+    
+    @staticmethod
+    def _parse_batch_response(text, count):
+        
+        # Tolérer un bloc ```json ... ``` autour du tableau
+        cleaned = re.sub(r'^```(?:json)?\s*|\s*```$', '', text.strip())
+        
+        try:
+            data = json.loads(cleaned)
+        except json.JSONDecodeError as e:
+            raise BatchResponseError(f"Invalid JSON batch response: {e}") from e
         
+        if isinstance(data, dict):
+            data = data.get('frames')
+        if not isinstance(data, list) or len(data) != count:
+            raise BatchResponseError(f"Expected {count} frames in batch response")
+        
+        contents = [None] * count
+        for position, item in enumerate(data):
+            if not isinstance(item, dict) or not isinstance(item.get('content'), str):
+                raise BatchResponseError(f"Malformed frame entry: {item!r}")
+            
+            frame_number = item.get('frame', position + 1)
+            if not isinstance(frame_number, int) or not 1 <= frame_number <= count:
+                raise BatchResponseError(f"Invalid frame number: {frame_number!r}")
+            contents[frame_number - 1] = item['content']
+        
+        if any(content is None for content in contents):
+            raise BatchResponseError("Duplicate or missing frame numbers in batch response")
+        
+        return contents
+    
+    def _cache_fingerprint(self, image, digest):
+        """Empreinte perceptuelle pour une frame vidéo peu textuelle, exacte sinon.
+        
+        Deux slides de même mise en page mais de texte différent ont la même
+        empreinte perceptuelle: uploads et frames textuelles ne sont retrouvés
+        que si leur contenu est identique.
+        """
+        if isinstance(image, EncodedFrame) and frame_text_coverage(image) < self.text_threshold:
+            return image.fingerprint
+        return exact_fingerprint(digest)
+    
+    @staticmethod
+    def _digest(image_data):
+        """Empreinte exacte (pas perceptuelle) de l'image telle que reçue.
+        
+        Fichiers, chemins et octets sont hachés encodés (même empreinte que
+        l'upload), sans décoder l'image; seules les images déjà décodées
+        (frames RGB, PIL sans fichier source) sont hachées pixel par pixel.
+        """
+        if isinstance(image_data, EncodedFrame):
+            return image_data.digest
+        if isinstance(image_data, bytes):
+            return xxhash.xxh3_128_hexdigest(image_data)
+        if isinstance(image_data, np.ndarray):
+            return request_key(image_data.shape, image_data.dtype, image_data.tobytes())
         if isinstance(image_data, Image.Image):
+            if not os.path.isfile(getattr(image_data, 'filename', '')):
+                return request_key(image_data.mode, image_data.size, image_data.tobytes())
+            image_data = image_data.filename
+        if isinstance(image_data, str):
+            with open(image_data, 'rb') as f:
+                return _stream_digest(f)
+        position = image_data.tell()
+        try:
+            return _stream_digest(image_data)
+        finally:
+            image_data.seek(position)
+    
+    @staticmethod
+    def _to_part(image):
+        
+        # Frame déjà encodée: envoyer les octets tels quels, sans réencodage par le SDK
+        if isinstance(image, EncodedFrame):
+            return image.as_part()
+        return image
+    
+    def _load_image(self, image_data):
+        
+        if isinstance(image_data, (Image.Image, EncodedFrame)):
             return image_data
+        elif isinstance(image_data, np.ndarray):  # Frame RGB (VideoProcessor)
+            return Image.fromarray(image_data)
         elif isinstance(image_data, bytes):
             return Image.open(io.BytesIO(image_data))
         elif isinstance(image_data, str):  # Chemin de fichier
             return Image.open(image_data)
+        elif hasattr(image_data, 'read'):  # Fichier ouvert (upload en mémoire ou sur disque)
+            return Image.open(image_data)
         else:
             raise ValueError(f"Format d'image non supporté: {type(image_data)}")
 
@@ -69,26 +306,32 @@ class PromptBuilder:
     
     
     @staticmethod
-    def build_video_timeline(frame_captions, duration):
+    def build_video_timeline(frame_captions, duration, timestamps=None, question=None, max_tokens=None):
+        """timestamps: horodatages réels des frames; à défaut, répartis sur la durée.
         
+        max_tokens: chronologie réduite aux frames utiles à question (trim_timeline)
+        """
         if not frame_captions:
             return ""
         
+        if not timestamps or len(timestamps) != len(frame_captions) or None in timestamps:
+            frame_interval = duration / len(frame_captions)
+            timestamps = [i * frame_interval for i in range(len(frame_captions))]
+        
         timeline = []
-        frame_interval = duration / len(frame_captions) if len(frame_captions) > 0 else duration
+        for timestamp, caption in zip(timestamps, frame_captions):
+            timeline.append(f"[{format_timestamp(timestamp)}] {caption}")
         
-        for i, caption in enumerate(frame_captions):
-            timestamp = int(i * frame_interval)
-            minutes, seconds = timestamp // 60, timestamp % 60
-            timeline.append(f"[{minutes:02d}:{seconds:02d}] {caption}")
+        if max_tokens:
+            timeline = trim_timeline(timeline, question or "", max_tokens)
         
         return "\n".join(timeline)
     
     @staticmethod
-    def build_video_analysis_prompt(user_message, frame_captions, video_metadata):
+    def build_video_analysis_prompt(user_message, frame_captions, video_metadata, timestamps=None):
         
         duration = video_metadata.get('duration', 0)
-        timeline = PromptBuilder.build_video_timeline(frame_captions, duration)
+        timeline = PromptBuilder.build_video_timeline(frame_captions, duration, timestamps)
         
         return f"""Tu es un assistant sympathique qui analyse des vidéos. Réponds en FRANÇAIS de manière naturelle et conversationnelle.
 
@@ -111,6 +354,31 @@ COMMENT RÉPONDRE:
 
 Réponds maintenant de façon claire et engageante en FRANÇAIS !"""
 
+    @staticmethod
+    def build_video_followup_prompt(user_message, frame_captions, video_metadata, timestamps=None, max_tokens=None):
+        """Message texte après une vidéo: réponse à partir de sa chronologie déjà décrite"""
+        duration = video_metadata.get('duration', 0)
+        timeline = PromptBuilder.build_video_timeline(frame_captions, duration, timestamps,
+                                                      question=user_message, max_tokens=max_tokens)
+        
+        return f"""Tu es un assistant sympathique. Réponds en FRANÇAIS de manière naturelle et conversationnelle.
+
+L'utilisateur a partagé plus tôt une vidéo ({duration//60}min {duration%60}s). Voici ce qu'on y voit:
+
+{timeline}
+
+Nouveau message de l'utilisateur: "{user_message}"
+
+COMMENT RÉPONDRE:
+✅ Si le message porte sur la vidéo, appuie-toi sur la chronologie ci-dessus (cite les moments [mm:ss] utiles)
+✅ Sinon, réponds simplement au message
+✅ Utilise des paragraphes courts et des émojis si ça aide (🎥 💡 ✨)
+
+❌ Ne commence PAS par "Okay", "Absolutely", "Here's"
+❌ N'invente pas de détails absents de la chronologie
+
+Réponds maintenant !"""
+
     @staticmethod
     def build_image_analysis_prompt(user_message, image_content):
         """Prompt d'analyse d'image conversationnel"""
@@ -190,50 +458,341 @@ Réponds maintenant !"""
 
 
 
+# Estimation grossière pour le budget du prompt: ~4 caractères par token
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _shorten(text, max_tokens):
+    
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rstrip() + "..."
+
+
+def _keywords(text):
+    
+    return {word for word in re.findall(r'\w+', text.lower()) if len(word) > 3}
+
+
+def _spread_order(count):
+    """Indices 0..count-1 du plus grossier au plus fin: début, milieu, quarts..."""
+    order, seen = [], set()
+    step = 1 << max(0, count - 1).bit_length()
+    while step:
+        for i in range(0, count, step):
+            if i not in seen:
+                seen.add(i)
+                order.append(i)
+        step //= 2
+    return order
+
+
+def trim_timeline(lines, question, max_tokens):
+    """Lignes de chronologie tenant dans max_tokens, dans l'ordre chronologique.
+    
+    D'abord les frames dont la description partage des mots avec la
+    question, puis des frames réparties sur toute la vidéo; chaque trou
+    est signalé par une ligne "[...]".
+    """
+    if not max_tokens or sum(estimate_tokens(line) + 1 for line in lines) <= max_tokens:
+        return lines
+    
+    words = _keywords(question)
+    spread = {index: rank for rank, index in enumerate(_spread_order(len(lines)))}
+    ranked = sorted(range(len(lines)), key=lambda i: (-len(words & _keywords(lines[i])), spread[i]))
+    
+    kept, used = set(), 0
+    for i in ranked:
+        cost = estimate_tokens(lines[i]) + 1
+        if used + cost <= max_tokens:
+            kept.add(i)
+            used += cost
+    
+    trimmed = []
+    for i, line in enumerate(lines):
+        if i in kept:
+            trimmed.append(line)
+        elif not trimmed or trimmed[-1] != "[...]":
+            trimmed.append("[...]")
+    return trimmed
+
+
 class ConversationMemory:
+    """Derniers messages de la conversation et leur rendu pour le prompt.
     
+    Les messages sont gardés dans une deque bornée (max_messages échanges).
+    L'historique injecté dans le prompt est limité en tokens estimés:
+    chaque message est tronqué à message_tokens, et seuls les plus récents
+    tenant dans history_tokens sont rendus. Les lignes rendues sont mises
+    en cache et la fenêtre glisse à chaque ajout, sans tout reconstruire.
     
-    def __init__(self, max_messages=10):
-        self.messages = []
+    Avec summary_tokens > 0, les messages utilisateur qui sortent de la
+    fenêtre laissent une trace dans un résumé glissant (début de chaque
+    question, les plus anciennes oubliées en premier).
+    """
+    
+    HEADER = "Historique récent:"
+    SUMMARY_HEADER = "Sujets abordés plus tôt:"
+    
+    def __init__(self, max_messages=10, history_tokens=800, message_tokens=200, summary_tokens=120):
         self.max_messages = max_messages
+        self.history_tokens = history_tokens
+        self.message_tokens = message_tokens
+        self.summary_tokens = summary_tokens
+        self.clear()
     
     def add_message(self, role, content):
         
+        if len(self.messages) == self.messages.maxlen:
+            self._size -= len(self.messages[0]["content"])
         self.messages.append({"role": role, "content": content})
+        self._size += len(content)
+        
+        prefix = "User" if role == "user" else "AI"
+        line = f"{prefix}: {_shorten(content, self.message_tokens)}"
+        self._window.append((role, content, line))
+        self._window_tokens += estimate_tokens(line)
+        
+        # Garder au moins le dernier message, même s'il dépasse le budget seul
+        while len(self._window) > 1 and (
+            self._window_tokens > self.history_tokens or len(self._window) > self.messages.maxlen
+        ):
+            old_role, old_content, old_line = self._window.popleft()
+            self._window_tokens -= estimate_tokens(old_line)
+            if old_role == "user":
+                self._summarize(old_content)
         
-        if len(self.messages) > self.max_messages * 2:
-            self.messages = self.messages[-self.max_messages * 2:]
+        self._rendered = None
     
-    def get_history_context(self):
+    def _summarize(self, content):
+        """Ajouter une question sortie de la fenêtre au résumé glissant"""
+        if self.summary_tokens <= 0:
+            return
         
-        if not self.messages:
-            return ""
+        topic = _shorten(" ".join(content.split()), max(1, self.summary_tokens // 4))
+        self._summary.append(topic)
+        self._summary_tokens += estimate_tokens(topic)
+        while len(self._summary) > 1 and self._summary_tokens > self.summary_tokens:
+            self._summary_tokens -= estimate_tokens(self._summary.popleft())
+    
+    def get_history_context(self):
         
-        history_lines = ["Historique récent:"]
-        for msg in self.messages[-6:]:
-            role = "User" if msg["role"] == "user" else "AI"
-            content = msg["content"][:150]
-            if len(msg["content"]) > 150:
-                content += "..."
-            history_lines.append(f"{role}: {content}")
+        if self._rendered is None:
+            if not self._window:
+                self._rendered = ""
+            else:
+                history_lines = [self.HEADER]
+                if self._summary:
+                    history_lines.append(f"{self.SUMMARY_HEADER} {' | '.join(self._summary)}")
+                history_lines.extend(line for _, _, line in self._window)
+                self._rendered = "\n".join(history_lines) + "\n\n"
         
-        return "\n".join(history_lines) + "\n\n"
+        return self._rendered
+    
+    def load(self, messages):
+        """Recharger l'historique (ex: depuis la base) sans dépasser la limite"""
+        self.clear()
+        for msg in messages:
+            self.add_message(msg["role"], msg["content"])
+    
+    def estimated_size(self):
+        """Taille approximative en octets du contenu mémorisé"""
+        return self._size + sum(len(topic) for topic in self._summary)
     
     def clear(self):
         
-        self.messages = []
+        self.messages = deque(maxlen=self.max_messages * 2)
+        self._size = 0
+        # (rôle, contenu, ligne rendue) des messages inclus dans le prompt
+        self._window = deque()
+        self._window_tokens = 0
+        self._summary = deque()
+        self._summary_tokens = 0
+        self._rendered = None
+
+
+
+# Formules d'introduction retirées en tête de réponse, appliquées dans l'ordre
+UNWANTED_PREFIXES = [
+    r'^(Okay|Absolutely|Certainly|Sure|Of course)[,!.\s]+',
+    r'^(Here\'s|Here is|Let me|I\'ll)[,\s]+',
+    r'^(D\'accord|Très bien|Bien sûr)[,!.\s]+'
+]
+
+
+def strip_unwanted_prefixes(text):
+    
+    for pattern in UNWANTED_PREFIXES:
+        text = re.sub(pattern, '', text, flags=re.IGNORECASE)
+    return text
+
+
+class StreamCleaner:
+    """Version incrémentale de MultimodalChatbot._clean_response.
+    
+    Les premiers caractères sont retenus jusqu'à prefix_window pour pouvoir
+    retirer les formules d'introduction, puis le texte passe au fil de
+    l'eau. Les blancs de fin de morceau sont retenus jusqu'au morceau
+    suivant: les sauts de ligne multiples sont réduits comme en mode bloc et
+    les blancs finaux disparaissent.
+    """
+    
+    def __init__(self, prefix_window=32):
+        
+        self.prefix_window = prefix_window
+        self._prefix = ''
+        self._prefix_done = False
+        self._started = False
+        self._pending = ''
+    
+    def feed(self, chunk):
+        """Retourne la partie nettoyée émissible (éventuellement vide)"""
+        if not self._prefix_done:
+            self._prefix += chunk
+            if len(self._prefix) < self.prefix_window:
+                return ''
+            self._prefix_done = True
+            chunk, self._prefix = strip_unwanted_prefixes(self._prefix), ''
+        
+        return self._emit(chunk)
+    
+    def finish(self):
+        
+        if not self._prefix_done:
+            self._prefix_done = True
+            return self._emit(strip_unwanted_prefixes(self._prefix))
+        return ''
+    
+    def _emit(self, chunk):
+        
+        text = re.sub(r'\n{3,}', '\n\n', self._pending + chunk)
+        if not self._started:
+            text = text.lstrip()
+        
+        body = text.rstrip()
+        self._pending = text[len(body):]
+        if body:
+            self._started = True
+        return body
+
+
+def _chunk_text(chunk):
+    
+    try:
+        return chunk.text
+    except ValueError:
+        # Morceau sans texte (fin de flux, filtre de sécurité)
+        return ''
+
+
+def model_error(error):
+    """Erreur à lever quand le modèle n'a pas produit de réponse.
+    
+    Seules les erreurs transitoires (celles que compte le disjoncteur)
+    deviennent ModelUnavailableError (HTTP 503, à réessayer); un refus du
+    modèle devient ModelRefusalError; les autres sont levées telles quelles.
+    """
+    if isinstance(error, (ModelUnavailableError, ModelRefusalError)):
+        return error
+    if isinstance(error, REMOTE_FAILURES):
+        return ModelUnavailableError(f"Le modèle n'a pas pu répondre: {error}")
+    if isinstance(error, REFUSALS):
+        return ModelRefusalError(f"Réponse bloquée par le modèle: {error}")
+    return error
+
 
+class _StreamTurn:
+    """Un tour de réponse en flux, commun à stream_reply et astream_reply.
+    
+    Seule l'itération sur les morceaux du modèle diffère entre les deux:
+    réponse en cache, nettoyage, mise en cache, erreurs et mémoire sont ici.
+    """
+    
+    def __init__(self, chatbot, prompt, include_history, cache_key, memory_entry, message_type, metadata):
+        
+        self.chatbot = chatbot
+        self.prompt = prompt
+        self.include_history = include_history
+        self.cache_key = cache_key
+        self.memory_entry = memory_entry
+        self.message_type = message_type
+        self.metadata = metadata
+        self.cleaner = StreamCleaner()
+        self.parts = []
+    
+    def cached(self):
+        
+        response_text = self.chatbot._cached_response(self.cache_key)
+        if response_text is not None:
+            self.parts.append(response_text)
+        return response_text
+    
+    def contents(self):
+        
+        return self.chatbot._full_prompt(self.prompt, self.include_history)
+    
+    def feed(self, chunk):
+        
+        return self._keep(self.cleaner.feed(_chunk_text(chunk)))
+    
+    def finish(self):
+        
+        text = self._keep(self.cleaner.finish())
+        if not self.parts:
+            # Tous les morceaux sans texte: réponse bloquée par un filtre de sécurité
+            raise ModelRefusalError("Réponse vide du modèle")
+        if self.cache_key is not None:
+            self.chatbot.response_cache.put(self.cache_key, ''.join(self.parts))
+        return text
+    
+    def fail(self, error):
+        
+        # Les morceaux déjà reçus restent dans la mémoire, pas le message d'erreur
+        logger.error(f"Error streaming response: {error}")
+        return model_error(error)
+    
+    def close(self):
+        
+        if self.parts:
+            self.chatbot._remember(self.memory_entry, ''.join(self.parts), self.message_type, self.metadata)
+            logger.info(f"Streamed response: {len(self.parts)} chunk(s)")
+    
+    def _keep(self, text):
+        
+        if text:
+            self.parts.append(text)
+        return text
 
 
 class MultimodalChatbot:
    
-    def __init__(self, session_id):
+    def __init__(self, session_id, memory_options=None, store=None, response_cache=None, media_options=None):
         
         logger.info(f"Initializing chatbot for session: {session_id}")
         
         self.session_id = session_id
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
-        self.memory = ConversationMemory(max_messages=10)
+        self.model_name = 'gemini-2.0-flash-exp'
+        self.model = get_model(self.model_name)
+        # memory_options: budgets de l'historique (voir ConversationMemory)
+        self.memory = ConversationMemory(**{'max_messages': 10, **(memory_options or {})})
+        # ChatStore optionnel (analyzer.services.chat_store): persistance des échanges
+        self.store = store
+        # ResponseCache optionnel (analyzer.services.response_cache): messages texte seul
+        self.response_cache = response_cache
+        # Vidéos déjà décrites, pour les questions suivantes (voir MediaArtifacts)
+        self.media = MediaArtifacts(**(media_options or {}))
+        # Mémoire partagée par les requêtes et les jobs (threads) de la session
+        self.lock = threading.RLock()
+        # Version de l'historique persisté connue de ce worker (voir SessionRegistry):
+        # génération (incrémentée à chaque effacement) et horodatage du dernier échange
+        self.generation = 0
+        self.last_turn_at = None
         self.prompt_builder = PromptBuilder()
         self.image_analyzer = ImageAnalyzer()
         
@@ -241,30 +800,30 @@ class MultimodalChatbot:
     
     def _clean_response(self, response_text):
         
-        unwanted_patterns = [
-            r'^(Okay|Absolutely|Certainly|Sure|Of course)[,!.\s]+',
-            r'^(Here\'s|Here is|Let me|I\'ll)[,\s]+',
-            r'^(D\'accord|Très bien|Bien sûr)[,!.\s]+'
-        ]
-        
-        for pattern in unwanted_patterns:
-            response_text = re.sub(pattern, '', response_text, flags=re.IGNORECASE)
+        response_text = strip_unwanted_prefixes(response_text)
         
         response_text = re.sub(r'\n{3,}', '\n\n', response_text)
         
         return response_text.strip()
     
+    def _full_prompt(self, prompt, include_history):
+        
+        if include_history:
+            with self.lock:
+                history_context = self.memory.get_history_context()
+            return f"{history_context}{prompt}"
+        return prompt
+    
     def _generate_response(self, prompt, include_history=True):
         
         try:
-            if include_history:
-                history_context = self.memory.get_history_context()
-                full_prompt = f"{history_context}{prompt}"
-            else:
-                full_prompt = prompt
+            full_prompt = self._full_prompt(prompt, include_history)
             
-            response = self.model.generate_content(full_prompt)
-            response_text = response.text
+            # Prompt identique déjà en cours (double envoi): un seul appel au modèle
+            response_text = get_single_flight().do(
+                request_key(self.model_name, full_prompt),
+                lambda: _response_text(self.model.generate_content(full_prompt))
+            )
             
             # Nettoyer la réponse
             response_text = self._clean_response(response_text)
@@ -273,67 +832,127 @@ class MultimodalChatbot:
             
         except Exception as e:
             logger.error(f"Error generating response: {e}")
-            return f"Désolé, une erreur s'est produite: {str(e)}"
+            raise model_error(e)
+    
+    async def _agenerate_response(self, prompt, include_history=True):
+        """Variante awaitable de _generate_response (vues ASGI)"""
+        try:
+            full_prompt = self._full_prompt(prompt, include_history)
+            
+            async def generate():
+                return _response_text(await self.model.generate_content_async(full_prompt))
+            
+            response_text = await get_single_flight().ado(request_key(self.model_name, full_prompt), generate)
+            return self._clean_response(response_text)
+            
+        except Exception as e:
+            logger.error(f"Error generating response: {e}")
+            raise model_error(e)
+    
+    def _response_cache_key(self, user_message, use_cache):
+        """Clé du cache de réponses (calculée avant d'ajouter l'échange à la mémoire), ou None"""
+        if self.response_cache is None or not use_cache:
+            return None
+        # Après une vidéo, la réponse dépend aussi de sa chronologie
+        if self.media.latest_video() is not None:
+            return None
+        
+        # Historique tel qu'injecté dans le prompt: même contexte, même réponse
+        with self.lock:
+            history_context = self.memory.get_history_context()
+        return response_key(self.model_name, user_message, history_context)
+    
+    def _text_prompt(self, user_message):
+        """(prompt, métadonnées de l'échange) d'un message texte seul.
+        
+        Si la session a une vidéo récente, le message est posé sur sa
+        chronologie déjà décrite (ni décodage ni description des frames),
+        réduite à media.timeline_tokens.
+        """
+        video = self.media.latest_video()
+        if video is None:
+            return self.prompt_builder.build_text_only_prompt(user_message), None
+        
+        logger.info(f"Text follow-up on video {video.digest[:12]} ({len(video.captions)} stored captions)")
+        prompt = self.prompt_builder.build_video_followup_prompt(
+            user_message, video.captions, video.metadata, video.timestamps, max_tokens=self.media.timeline_tokens
+        )
+        return prompt, {'video_digest': video.digest}
+    
+    def _store_video(self, frame_captions, video_metadata, timestamps, digest):
+        
+        # Sans empreinte de fichier (appel direct): clé dérivée des descriptions
+        digest = digest or request_key(*frame_captions)
+        self.media.add_video(digest, frame_captions, timestamps, video_metadata)
+        return digest
     
-    def chat_text_only(self, user_message):
+    def _cached_response(self, cache_key):
+        
+        if cache_key is None:
+            return None
+        response_text = self.response_cache.get(cache_key)
+        if response_text is not None:
+            logger.info("Text response served from cache")
+        return response_text
+    
+    def chat_text_only(self, user_message, use_cache=True):
         """Chat texte simple avec prompt amélioré"""
         logger.info(f"Processing text: {user_message[:50]}...")
         
-        prompt = self.prompt_builder.build_text_only_prompt(user_message)
+        cache_key = self._response_cache_key(user_message, use_cache)
+        response_text = self._cached_response(cache_key)
+        metadata = None
         
-        response_text = self._generate_response(prompt)
+        if response_text is None:
+            prompt, metadata = self._text_prompt(user_message)
+            response_text = self._generate_response(prompt)
+            if cache_key is not None:
+                self.response_cache.put(cache_key, response_text)
         
-        self.memory.add_message("user", user_message)
-        self.memory.add_message("assistant", response_text)
+        self._remember(user_message, response_text, metadata=metadata)
         
         logger.info("Text response generated")
         return response_text
     
-    def chat_with_image(self, user_message, image_data):
+    def chat_with_image(self, user_message, image_data=None, image_content=None):
         
         logger.info("Processing image message (improved method)")
         
-        try:
-            
-            image_content = self.image_analyzer.extract_image_content(image_data)
-            logger.info(f"Image content extracted: {len(image_content)} chars")
-            
-            
-            prompt = self.prompt_builder.build_image_analysis_prompt(
-                user_message,
-                image_content
-            )
-            
-            
-            response_text = self._generate_response(prompt)
-            
-            
-            self.memory.add_message("user", f"[Image] {user_message}")
-            self.memory.add_message("assistant", response_text)
-            
-            logger.info("Image response generated")
-            return response_text
-            
-        except Exception as e:
-            logger.error(f"Error in chat_with_image: {e}")
-            return f"❌ Erreur lors de l'analyse de l'image: {str(e)}"
+        # image_content fourni: contenu déjà extrait (cache des fichiers envoyés)
+        if image_content is None:
+            image_content = self.image_analyzer.extract_image_content(image_data, raise_errors=True)
+        logger.info(f"Image content extracted: {len(image_content)} chars")
+        
+        
+        prompt = self.prompt_builder.build_image_analysis_prompt(
+            user_message,
+            image_content
+        )
+        
+        
+        response_text = self._generate_response(prompt)
+        
+        
+        self._remember(f"[Image] {user_message}", response_text, 'image')
+        
+        logger.info("Image response generated")
+        return response_text
     
     def chat_with_image_direct(self, user_message, image_data):
         
         logger.info("Processing image message (direct method)")
         
-        try:
-            
-            if isinstance(image_data, bytes):
-                image = Image.open(io.BytesIO(image_data))
-            elif isinstance(image_data, str):
-                image = Image.open(image_data)
-            else:
-                image = image_data
-            
-            
+        if isinstance(image_data, bytes):
+            image = Image.open(io.BytesIO(image_data))
+        elif isinstance(image_data, str):
+            image = Image.open(image_data)
+        else:
+            image = image_data
+        
+        
+        with self.lock:
             history_context = self.memory.get_history_context()
-            prompt = f"""{history_context}
+        prompt = f"""{history_context}
 L'utilisateur a partagé une image avec ce message: "{user_message}"
 
 Analyse l'image et réponds en FRANÇAIS de manière naturelle:
@@ -343,22 +962,21 @@ Analyse l'image et réponds en FRANÇAIS de manière naturelle:
 - Utilise des émojis pour clarifier
 
 ❌ Ne commence PAS par "Okay", "Absolutely", "Here's" """
-            
-            
+        
+        
+        try:
             response = self.model.generate_content([prompt, image])
-            response_text = self._clean_response(response.text)
-            
-            self.memory.add_message("user", f"[Image] {user_message}")
-            self.memory.add_message("assistant", response_text)
-            
-            logger.info("Direct image response generated")
-            return response_text
-            
+            response_text = self._clean_response(_response_text(response))
         except Exception as e:
-            logger.error(f"Error in chat_with_image_direct: {e}")
-            return f"❌ Erreur: {str(e)}"
+            logger.error(f"Error generating response: {e}")
+            raise model_error(e)
+        
+        self._remember(f"[Image] {user_message}", response_text, 'image')
+        
+        logger.info("Direct image response generated")
+        return response_text
     
-    def chat_with_video(self, user_message, frame_captions, video_metadata):
+    def chat_with_video(self, user_message, frame_captions, video_metadata, timestamps=None, digest=None):
         
         logger.info(f"Processing video: {len(frame_captions)} frames")
         
@@ -368,30 +986,33 @@ Analyse l'image et réponds en FRANÇAIS de manière naturelle:
         prompt = self.prompt_builder.build_video_analysis_prompt(
             user_message,
             frame_captions,
-            video_metadata
+            video_metadata,
+            timestamps
         )
         
         logger.info(f"Prompt preview: {prompt[:300]}...")
         
+        # Gardée pour les questions suivantes, même si le modèle échoue ici
+        digest = self._store_video(frame_captions, video_metadata, timestamps, digest)
         response_text = self._generate_response(prompt, include_history=False)
         
         logger.info(f"Response preview: {response_text[:100]}...")
         
         duration = video_metadata.get('duration', 0)
-        self.memory.add_message("user", f"[Video {duration}s] {user_message}")
-        self.memory.add_message("assistant", response_text)
+        self._remember(f"[Video {duration}s] {user_message}", response_text, 'video',
+                       {**video_metadata, 'frames': len(frame_captions), 'video_digest': digest})
         
         logger.info("Video response generated")
         return response_text
     
-    def chat_with_mixed_media(self, user_message, images=None, videos=None):
+    def chat_with_mixed_media(self, user_message, images=None, videos=None, image_contents=None):
         """Chat avec médias mixtes"""
         logger.info("Processing mixed media")
         
-        processed_images = []
-        if images:
+        processed_images = list(image_contents or [])
+        if images and not processed_images:
             for img_data in images:
-                content = self.image_analyzer.extract_image_content(img_data)
+                content = self.image_analyzer.extract_image_content(img_data, raise_errors=True)
                 processed_images.append(content)
         
         prompt = self.prompt_builder.build_mixed_media_prompt(
@@ -402,13 +1023,180 @@ Analyse l'image et réponds en FRANÇAIS de manière naturelle:
         
         response_text = self._generate_response(prompt, include_history=False)
         
-        self.memory.add_message("user", f"[Mixed media] {user_message}")
-        self.memory.add_message("assistant", response_text)
+        self._remember(f"[Mixed media] {user_message}", response_text, 'mixed')
         
         logger.info("Mixed media response generated")
         return response_text
     
+    # Réponses en flux: les morceaux nettoyés sont produits dès leur arrivée,
+    # l'échange est ajouté à la mémoire une fois le flux terminé (ou coupé)
+    
+    def _prepare_turn(self, user_message, image_contents=None, frame_captions=None, video_metadata=None,
+                      timestamps=None, digest=None):
+        """(prompt, entrée mémoire utilisateur, type de message, include_history, métadonnées) selon les médias"""
+        if image_contents and len(image_contents) == 1:
+            prompt = self.prompt_builder.build_image_analysis_prompt(user_message, image_contents[0])
+            return prompt, f"[Image] {user_message}", 'image', True, None
+        
+        if image_contents:
+            prompt = self.prompt_builder.build_mixed_media_prompt(user_message, images=list(image_contents))
+            return prompt, f"[Mixed media] {user_message}", 'mixed', False, None
+        
+        if frame_captions is not None:
+            video_metadata = video_metadata or {}
+            prompt = self.prompt_builder.build_video_analysis_prompt(
+                user_message, frame_captions, video_metadata, timestamps
+            )
+            digest = self._store_video(frame_captions, video_metadata, timestamps, digest)
+            metadata = {**video_metadata, 'frames': len(frame_captions), 'video_digest': digest}
+            return prompt, f"[Video {video_metadata.get('duration', 0)}s] {user_message}", 'video', False, metadata
+        
+        prompt, metadata = self._text_prompt(user_message)
+        return prompt, user_message, 'text', True, metadata
+    
+    def stream_reply(self, user_message, image_contents=None, frame_captions=None, video_metadata=None,
+                     use_cache=True, timestamps=None, digest=None):
+        """Générateur des morceaux de la réponse"""
+        turn = self._start_stream(user_message, image_contents, frame_captions, video_metadata,
+                                  use_cache, timestamps, digest)
+        
+        try:
+            cached = turn.cached()
+            if cached is not None:
+                yield cached
+                return
+            
+            for chunk in self.model.generate_content(turn.contents(), stream=True):
+                text = turn.feed(chunk)
+                if text:
+                    yield text
+            
+            text = turn.finish()
+            if text:
+                yield text
+        
+        except Exception as e:
+            raise turn.fail(e)
+        
+        finally:
+            turn.close()
+    
+    async def astream_reply(self, user_message, image_contents=None, frame_captions=None, video_metadata=None,
+                            use_cache=True, timestamps=None, digest=None):
+        """Variante async de stream_reply (generate_content_async)"""
+        turn = self._start_stream(user_message, image_contents, frame_captions, video_metadata,
+                                  use_cache, timestamps, digest)
+        
+        try:
+            cached = turn.cached()
+            if cached is not None:
+                yield cached
+                return
+            
+            async for chunk in await self.model.generate_content_async(turn.contents(), stream=True):
+                text = turn.feed(chunk)
+                if text:
+                    yield text
+            
+            text = turn.finish()
+            if text:
+                yield text
+        
+        except Exception as e:
+            raise turn.fail(e)
+        
+        finally:
+            turn.close()
+    
+    def _start_stream(self, user_message, image_contents, frame_captions, video_metadata, use_cache,
+                      timestamps, digest):
+        
+        prompt, memory_entry, message_type, include_history, metadata = self._prepare_turn(
+            user_message, image_contents, frame_captions, video_metadata, timestamps, digest
+        )
+        # Messages texte seul: réponse en cache envoyée en un seul morceau
+        cache_key = self._response_cache_key(user_message, use_cache) if message_type == 'text' else None
+        return _StreamTurn(self, prompt, include_history, cache_key, memory_entry, message_type, metadata)
+    
+    # Variantes async: le contenu des médias est extrait en amont (threads),
+    # seul l'appel final au modèle est attendu sur la boucle d'événements
+    
+    async def achat_text_only(self, user_message, use_cache=True):
+        
+        logger.info(f"Processing text (async): {user_message[:50]}...")
+        
+        cache_key = self._response_cache_key(user_message, use_cache)
+        response_text = self._cached_response(cache_key)
+        metadata = None
+        
+        if response_text is None:
+            prompt, metadata = self._text_prompt(user_message)
+            response_text = await self._agenerate_response(prompt)
+            if cache_key is not None:
+                self.response_cache.put(cache_key, response_text)
+        
+        self._remember(user_message, response_text, metadata=metadata)
+        return response_text
+    
+    async def achat_with_image(self, user_message, image_content):
+        
+        prompt = self.prompt_builder.build_image_analysis_prompt(user_message, image_content)
+        response_text = await self._agenerate_response(prompt)
+        
+        self._remember(f"[Image] {user_message}", response_text, 'image')
+        return response_text
+    
+    async def achat_with_video(self, user_message, frame_captions, video_metadata, timestamps=None, digest=None):
+        
+        logger.info(f"Processing video (async): {len(frame_captions)} frames")
+        
+        prompt = self.prompt_builder.build_video_analysis_prompt(
+            user_message,
+            frame_captions,
+            video_metadata,
+            timestamps
+        )
+        digest = self._store_video(frame_captions, video_metadata, timestamps, digest)
+        response_text = await self._agenerate_response(prompt, include_history=False)
+        
+        duration = video_metadata.get('duration', 0)
+        self._remember(f"[Video {duration}s] {user_message}", response_text, 'video',
+                       {**video_metadata, 'frames': len(frame_captions), 'video_digest': digest})
+        return response_text
+    
+    async def achat_with_mixed_media(self, user_message, image_contents):
+        
+        prompt = self.prompt_builder.build_mixed_media_prompt(
+            user_message,
+            images=list(image_contents),
+            videos=None
+        )
+        response_text = await self._agenerate_response(prompt, include_history=False)
+        
+        self._remember(f"[Mixed media] {user_message}", response_text, 'mixed')
+        return response_text
+    
+    def _remember(self, user_entry, response_text, message_type='text', metadata=None):
+        """Ajouter l'échange à la mémoire et le mettre en file de persistance"""
+        with self.lock:
+            self.memory.add_message("user", user_entry)
+            self.memory.add_message("assistant", response_text)
+            if self.store is not None:
+                self.last_turn_at = self.store.record_turn(
+                    self.session_id, user_entry, response_text, message_type, metadata
+                )
+    
+    def forget(self, generation=0):
+        """Oublier l'état local de la session (historique effacé, ici ou ailleurs)"""
+        with self.lock:
+            self.memory.clear()
+            self.media.clear()
+            self.generation = generation
+            self.last_turn_at = None
+    
     def clear_history(self):
-        """Effacer l'historique"""
-        self.memory.clear()
+        """Effacer l'historique (mémoire et base)"""
+        with self.lock:
+            generation = self.store.delete_session(self.session_id) if self.store is not None else 0
+            self.forget(generation)
         logger.info(f"History cleared for session {self.session_id}")
\ No newline at end of file
@@ -0,0 +1,157 @@
+"""
+Client Gemini factice pour les benchmarks et les essais hors-ligne.
+
+FakeGenerativeModel expose la même surface que genai.GenerativeModel
+(generate_content / generate_content_async -> objet avec .text, ou flux de
+morceaux avec stream=True) avec une latence et un taux d'erreur
+configurables, sans aucun appel réseau. Un responder personnalisé
+reçoit (contents, **kwargs) et retourne le texte de la réponse.
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+
+from PIL import Image
+
+try:
+    from google.api_core.exceptions import ServiceUnavailable as FakeTransientError
+except ImportError:  # google-api-core absent: erreur réseau générique
+    FakeTransientError = ConnectionError
+
+
+def _is_image_part(part):
+
+    return isinstance(part, Image.Image) or (isinstance(part, dict) and 'data' in part)
+
+
+def _describe_part(part):
+
+    if isinstance(part, Image.Image):
+        return f"{part.width}x{part.height}"
+    return f"{part.get('mime_type', 'blob')} {len(part['data'])} bytes"
+
+
+class FakeResponse:
+
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGenerativeModel:
+
+    def __init__(self, model_name='fake-gemini', latency=0.0, jitter=0.0,
+                 failure_rate=0.0, responder=None, seed=None, chunk_chars=16, chunk_latency=0.0):
+
+        self.model_name = model_name
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.responder = responder or self._default_responder
+        # Réponses en flux (stream=True): taille et intervalle des morceaux
+        self.chunk_chars = chunk_chars
+        self.chunk_latency = chunk_latency
+        self.calls = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _start_call(self):
+
+        with self._lock:
+            self.calls += 1
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            should_fail = self._random.random() < self.failure_rate
+            return self.calls, delay, should_fail
+
+    def _end_call(self):
+
+        with self._lock:
+            self._in_flight -= 1
+
+    def generate_content(self, contents, stream=False, **kwargs):
+
+        call_number, delay, should_fail = self._start_call()
+        if stream:
+            return self._stream(call_number, delay, should_fail, contents, kwargs)
+        try:
+            time.sleep(delay)
+            if should_fail:
+                raise FakeTransientError(f"Fake transient failure (call {call_number})")
+            return FakeResponse(self.responder(contents, **kwargs))
+        finally:
+            self._end_call()
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+
+        call_number, delay, should_fail = self._start_call()
+        if stream:
+            return self._astream(call_number, delay, should_fail, contents, kwargs)
+        try:
+            await asyncio.sleep(delay)
+            if should_fail:
+                raise FakeTransientError(f"Fake transient failure (call {call_number})")
+            return FakeResponse(self.responder(contents, **kwargs))
+        finally:
+            self._end_call()
+
+    def _chunks(self, text):
+
+        return [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)]
+
+    def _stream(self, call_number, delay, should_fail, contents, kwargs):
+
+        try:
+            # latency = délai avant le premier morceau
+            time.sleep(delay)
+            if should_fail:
+                raise FakeTransientError(f"Fake transient failure (call {call_number})")
+            for i, chunk in enumerate(self._chunks(self.responder(contents, **kwargs))):
+                if i:
+                    time.sleep(self.chunk_latency)
+                yield FakeResponse(chunk)
+        finally:
+            self._end_call()
+
+    async def _astream(self, call_number, delay, should_fail, contents, kwargs):
+
+        try:
+            await asyncio.sleep(delay)
+            if should_fail:
+                raise FakeTransientError(f"Fake transient failure (call {call_number})")
+            for i, chunk in enumerate(self._chunks(self.responder(contents, **kwargs))):
+                if i:
+                    await asyncio.sleep(self.chunk_latency)
+                yield FakeResponse(chunk)
+        finally:
+            self._end_call()
+
+    def reset(self):
+
+        with self._lock:
+            self.calls = 0
+            self.max_in_flight = 0
+
+    @staticmethod
+    def _default_responder(contents, generation_config=None, **kwargs):
+
+        if isinstance(contents, (str, Image.Image)):
+            contents = [contents]
+
+        # Images PIL ou blobs inline {'mime_type', 'data'} (frames encodées)
+        images = [_describe_part(part) for part in contents if _is_image_part(part)]
+
+        if (generation_config or {}).get('response_mime_type') == 'application/json':
+            return json.dumps([
+                {"frame": i, "content": f"Description factice de la frame {i} ({size})"}
+                for i, size in enumerate(images, 1)
+            ], ensure_ascii=False)
+
+        if images:
+            return f"Description factice de {len(images)} image(s) ({', '.join(images)})"
+
+        return "Réponse factice du modèle."
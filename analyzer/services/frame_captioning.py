@@ -0,0 +1,235 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .chatbot_orchestrator import BatchResponseError
+from .resilience import REMOTE_FAILURES
+
+logger = logging.getLogger(__name__)
+
+
+class FrameCaptioner:
+    """Description des frames d'une vidéo avec un nombre borné d'appels en vol.
+
+    L'ordre des frames est préservé, les erreurs transitoires sont réessayées
+    avec un backoff exponentiel, et une frame en échec reçoit None (à
+    écarter de la chronologie) au lieu de faire échouer toute la vidéo. Avec batch_size > 1,
+    les frames sont envoyées par lots dans un seul appel; un lot dont la
+    réponse est illisible est redécrit frame par frame.
+
+    Avec un encoder (analyzer.services.frame_encoding), chaque frame est
+    réduite et encodée une seule fois avant envoi; les réessais et les
+    caches réutilisent ces octets.
+    """
+
+    def __init__(self, analyzer, max_in_flight=4, max_retries=2,
+                 retry_backoff=0.5, max_backoff=8.0, batch_size=1, encoder=None):
+
+        self.analyzer = analyzer
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_retries = max(0, max_retries)
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self.batch_size = max(1, batch_size)
+        self.encoder = encoder
+        logger.info(f"FrameCaptioner initialized: max_in_flight={self.max_in_flight}, "
+                    f"max_retries={self.max_retries}, batch_size={self.batch_size}")
+
+    def caption_frames(self, frames, timestamps=None):
+        """Retourner une description par frame, dans l'ordre des frames"""
+        if not frames:
+            return []
+
+        if timestamps is None:
+            timestamps = [None] * len(frames)
+
+        start = time.perf_counter()
+        frames = [self._encode(frame) for frame in frames]
+        self._log_encoding(frames)
+        batches = [
+            (offset, frames[offset:offset + self.batch_size], timestamps[offset:offset + self.batch_size])
+            for offset in range(0, len(frames), self.batch_size)
+        ]
+        workers = min(self.max_in_flight, len(batches))
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='frame-caption') as executor:
+            futures = [
+                executor.submit(self._caption_batch, offset, batch, batch_timestamps, len(frames))
+                for offset, batch, batch_timestamps in batches
+            ]
+            captions = [caption for future in futures for caption in future.result()]
+
+        logger.info(f"Captioned {len(frames)} frames in {time.perf_counter() - start:.2f}s "
+                    f"({len(batches)} request(s), {workers} in flight)")
+        return captions
+
+    def caption_stream(self, frame_stream, max_buffered=None):
+        """Décrire les frames pendant que le décodage continue.
+
+        frame_stream produit des (timestamp, frame). Au plus max_buffered
+        frames sont en attente ou en cours de description: au-delà, la
+        lecture du flux est suspendue (backpressure), la mémoire reste donc
+        bornée à quelques frames. Retourne (timestamps, captions) dans l'ordre.
+        """
+        if max_buffered is None:
+            max_buffered = self.max_in_flight * self.batch_size
+        # Un lot complet doit pouvoir être en attente, sinon blocage
+        max_buffered = max(max_buffered, self.batch_size)
+
+        slots = threading.BoundedSemaphore(max_buffered)
+        start = time.perf_counter()
+        timestamps = []
+        futures = []
+        batch = []
+        encoding = {'source': 0, 'encoded': 0}
+
+        def release_slots(future, count):
+            for _ in range(count):
+                slots.release()
+
+        def submit(executor, batch):
+            offset = len(timestamps) - len(batch)
+            frames = [frame for _, frame in batch]
+            batch_timestamps = [timestamp for timestamp, _ in batch]
+            future = executor.submit(self._caption_batch, offset, frames, batch_timestamps, None)
+            future.add_done_callback(lambda f, count=len(batch): release_slots(f, count))
+            futures.append(future)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='frame-caption') as executor:
+                for timestamp, frame in self._bounded(frame_stream, slots):
+                    # Encoder tout de suite: la frame pleine résolution est libérée
+                    frame = self._encode(frame)
+                    if self.encoder is not None:
+                        encoding['source'] += frame.source_bytes
+                        encoding['encoded'] += len(frame.data)
+                    timestamps.append(timestamp)
+                    batch.append((timestamp, frame))
+                    if len(batch) == self.batch_size:
+                        submit(executor, batch)
+                        batch = []
+
+                if batch:
+                    submit(executor, batch)
+
+                captions = [caption for future in futures for caption in future.result()]
+        finally:
+            # Description interrompue par une erreur: fermer le générateur de
+            # VideoProcessor.stream_video pour libérer la vidéo tout de suite
+            close = getattr(frame_stream, 'close', None)
+            if close is not None:
+                close()
+
+        if self.encoder is not None:
+            self._report_encoding(len(captions), encoding['source'], encoding['encoded'])
+        logger.info(f"Streamed {len(captions)} frames in {time.perf_counter() - start:.2f}s "
+                    f"({len(futures)} request(s), max {max_buffered} buffered)")
+        return timestamps, captions
+
+    def _encode(self, frame):
+
+        return self.encoder.encode(frame) if self.encoder is not None else frame
+
+    def _log_encoding(self, frames):
+
+        if self.encoder is not None and frames:
+            self._report_encoding(
+                len(frames),
+                sum(frame.source_bytes for frame in frames),
+                sum(len(frame.data) for frame in frames),
+            )
+
+    @staticmethod
+    def _report_encoding(count, source_bytes, encoded_bytes):
+
+        saved = max(0, source_bytes - encoded_bytes)
+        logger.info(f"Encoded {count} frames: {source_bytes / 1e6:.1f} MB raw -> "
+                    f"{encoded_bytes / 1e6:.2f} MB sent ({saved / 1e6:.1f} MB saved)")
+
+    @staticmethod
+    def _bounded(frame_stream, slots):
+
+        iterator = iter(frame_stream)
+        while True:
+            # Réserver une place avant de décoder la frame suivante
+            slots.acquire()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                slots.release()
+                return
+            except BaseException:
+                slots.release()
+                raise
+            yield item
+
+    def _caption_batch(self, offset, frames, timestamps, total):
+
+        if len(frames) == 1:
+            return [self._caption_frame(offset, frames[0], total)]
+
+        label = self._label(f"Frames {offset + 1}-{offset + len(frames)}", total)
+        try:
+            captions = self._with_retries(
+                lambda: self.analyzer.extract_frames_content(frames, timestamps), label
+            )
+            logger.info(f"{label} analyzed in one request")
+            return captions
+
+        except BatchResponseError as e:
+            # Réponse JSON inexploitable: retomber sur un appel par frame
+            logger.warning(f"{label} malformed batch response ({e}), falling back to per-frame calls")
+            return [
+                self._caption_frame(offset + i, frame, total)
+                for i, frame in enumerate(frames)
+            ]
+
+        except Exception as e:
+            logger.error(f"{label} extraction error: {e}")
+            return [None] * len(frames)
+
+    def _caption_frame(self, index, frame, total):
+
+        label = self._label(f"Frame {index + 1}", total)
+        try:
+            caption = self._with_retries(
+                lambda: self.analyzer.extract_image_content(frame, raise_errors=True), label
+            )
+            logger.info(f"{label} analyzed")
+            return caption
+
+        except Exception as e:
+            logger.error(f"{label} extraction error: {e}")
+            return None
+
+    @staticmethod
+    def _label(prefix, total):
+
+        # total inconnu en mode streaming
+        return f"{prefix}/{total}" if total else prefix
+
+    def _with_retries(self, call, label):
+
+        attempt = 0
+        while True:
+            try:
+                return call()
+
+            # Mêmes erreurs transitoires que celles comptées par le disjoncteur
+            except REMOTE_FAILURES as e:
+                if attempt >= self.max_retries:
+                    logger.error(f"{label} failed after {attempt + 1} attempts")
+                    raise
+
+                delay = self._backoff_delay(attempt)
+                logger.warning(f"{label} transient error ({e}), retry in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+
+    def _backoff_delay(self, attempt):
+
+        delay = min(self.max_backoff, self.retry_backoff * (2 ** attempt))
+        # Full jitter pour ne pas resynchroniser les frames en échec
+        return random.uniform(delay / 2, delay)
@@ -0,0 +1,127 @@
+"""
+Préparation des frames avant envoi au modèle de vision.
+
+Sans préparation, une frame numpy pleine résolution est convertie en PIL
+puis sérialisée par le SDK Gemini en WebP sans perte: une frame 4K pèse
+plusieurs Mo. FrameEncoder réduit la frame (plus grand côté borné), l'encode
+une seule fois (JPEG par défaut), et garde avec les octets encodés
+l'empreinte perceptuelle et le digest utilisés par les caches.
+"""
+import io
+import logging
+import threading
+
+import cv2
+import numpy as np
+import xxhash
+from PIL import Image
+
+from .caption_cache import fingerprint
+
+logger = logging.getLogger(__name__)
+
+MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+    'PNG': 'image/png',
+}
+
+
+class EncodedFrame:
+    """Frame réduite et encodée, prête à être envoyée telle quelle au modèle"""
+
+    def __init__(self, data, mime_type, width, height, source_bytes, fingerprint):
+
+        self.data = data
+        self.mime_type = mime_type
+        self.width = width
+        self.height = height
+        # Taille brute (RGB non compressé) de la frame d'origine
+        self.source_bytes = source_bytes
+        self.fingerprint = fingerprint
+        # Part couverte par du texte, calculée à la demande (caption_router.frame_text_coverage)
+        self.text_coverage = None
+        self._digest = None
+
+    @property
+    def digest(self):
+
+        if self._digest is None:
+            self._digest = xxhash.xxh3_128_hexdigest(self.data)
+        return self._digest
+
+    @property
+    def bytes_saved(self):
+
+        return max(0, self.source_bytes - len(self.data))
+
+    def as_part(self):
+        """Blob inline au format attendu par generate_content"""
+        return {'mime_type': self.mime_type, 'data': self.data}
+
+    def __repr__(self):
+        return f"<EncodedFrame {self.width}x{self.height} {self.mime_type} {len(self.data)} bytes>"
+
+
+class FrameEncoder:
+
+    def __init__(self, max_long_edge=1024, quality=80, image_format='JPEG'):
+
+        image_format = image_format.upper()
+        if image_format not in MIME_TYPES:
+            raise ValueError(f"Unsupported frame format: {image_format}")
+
+        self.max_long_edge = max_long_edge
+        self.quality = quality
+        self.image_format = image_format
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.source_bytes = 0
+        self.encoded_bytes = 0
+        logger.info(f"FrameEncoder initialized: max_long_edge={max_long_edge}, "
+                    f"quality={quality}, format={image_format}")
+
+    def encode(self, frame):
+        """Réduire et encoder une frame RGB (numpy ou PIL)"""
+        if isinstance(frame, Image.Image):
+            frame = np.asarray(frame.convert('RGB'))
+
+        height, width = frame.shape[:2]
+        source_bytes = frame.nbytes
+
+        scale = self.max_long_edge / max(width, height) if self.max_long_edge else 1.0
+        if scale < 1.0:
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+        image = Image.fromarray(frame)
+        buffer = io.BytesIO()
+        if self.image_format == 'PNG':
+            image.save(buffer, format='PNG')
+        else:
+            image.save(buffer, format=self.image_format, quality=self.quality)
+        data = buffer.getvalue()
+
+        with self._lock:
+            self.frames += 1
+            self.source_bytes += source_bytes
+            self.encoded_bytes += len(data)
+
+        return EncodedFrame(
+            data=data,
+            mime_type=MIME_TYPES[self.image_format],
+            width=image.width,
+            height=image.height,
+            source_bytes=source_bytes,
+            fingerprint=fingerprint(image),
+        )
+
+    def stats(self):
+
+        with self._lock:
+            return {
+                'frames': self.frames,
+                'source_bytes': self.source_bytes,
+                'encoded_bytes': self.encoded_bytes,
+                'bytes_saved': max(0, self.source_bytes - self.encoded_bytes),
+            }
@@ -0,0 +1,102 @@
+"""
+Exécution en arrière-plan des messages lourds (mode job).
+
+La requête crée un AnalysisJob et rend la main tout de suite; le traitement
+tourne sur un pool de threads du processus. L'état est stocké en base: le
+client peut interroger le job depuis n'importe quel worker.
+"""
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+# Message stocké pour un job en échec, faute de describe_error
+JOB_FAILED_ERROR = "Impossible de générer une réponse"
+
+
+class JobRunner:
+
+    def __init__(self, max_workers=2):
+
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='analysis-job')
+        self._futures = {}  # job_id -> Future, jobs lancés par ce processus
+        self._lock = threading.Lock()
+        logger.info(f"JobRunner initialized: max_workers={max_workers}")
+
+    def submit(self, session_id, fn, *args, cleanup=None, describe_error=None):
+        """Créer le job et planifier fn(*args); retourne le job_id.
+
+        fn retourne le texte de la réponse. cleanup (optionnel) est appelé
+        à la fin du job, qu'il réussisse ou non (fichiers temporaires...).
+        describe_error(exception) donne le message stocké et montré au
+        client en cas d'échec; le détail de l'exception reste dans les logs.
+        """
+        from ..models import AnalysisJob
+
+        job = AnalysisJob.objects.create(job_id=uuid.uuid4().hex, session_id=session_id)
+        future = self._executor.submit(self._run, job.job_id, fn, args, cleanup, describe_error)
+
+        with self._lock:
+            self._futures[job.job_id] = future
+        future.add_done_callback(lambda _: self._forget(job.job_id))
+
+        logger.info(f"Job {job.job_id} queued for session {session_id}")
+        return job.job_id
+
+    def _run(self, job_id, fn, args, cleanup, describe_error=None):
+
+        from ..models import AnalysisJob
+
+        close_old_connections()
+        jobs = AnalysisJob.objects.filter(job_id=job_id)
+        try:
+            jobs.update(status='running')
+            response = fn(*args)
+            jobs.update(status='done', response=response or '')
+            logger.info(f"Job {job_id} done")
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}", exc_info=True)
+            jobs.update(status='failed', error=describe_error(e) if describe_error else JOB_FAILED_ERROR)
+        finally:
+            if cleanup is not None:
+                try:
+                    cleanup()
+                except Exception as e:
+                    logger.warning(f"Job {job_id} cleanup failed: {e}")
+            close_old_connections()
+
+    def _forget(self, job_id):
+
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+    def future(self, job_id):
+        """Future du job s'il tourne dans ce processus, sinon None"""
+        with self._lock:
+            return self._futures.get(job_id)
+
+    def stats(self):
+
+        with self._lock:
+            return {'max_workers': self.max_workers, 'in_progress': len(self._futures)}
+
+
+_job_runner = None
+_job_runner_lock = threading.Lock()
+
+
+def get_job_runner():
+
+    global _job_runner
+    if _job_runner is None:
+        from django.conf import settings
+
+        with _job_runner_lock:
+            if _job_runner is None:
+                _job_runner = JobRunner(max_workers=getattr(settings, 'CHAT_JOB_WORKERS', 2))
+    return _job_runner
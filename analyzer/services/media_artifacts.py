@@ -0,0 +1,75 @@
+"""
+Médias déjà analysés d'une session.
+
+Après une vidéo, les descriptions horodatées de ses frames, ses métadonnées
+et l'empreinte du fichier restent attachées à la session: les messages
+texte suivants sont posés sur cette chronologie, sans nouvel envoi, ni
+décodage, ni description des frames. Un artefact expire après ttl secondes
+et la session en garde au plus max_bytes (les plus anciens partent d'abord,
+le plus récent est toujours gardé). Dans le prompt d'une question suivante,
+la chronologie est limitée à timeline_tokens tokens estimés (0 = complète).
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+VideoArtifact = namedtuple('VideoArtifact', ['digest', 'captions', 'timestamps', 'metadata', 'stored_at', 'size'])
+
+
+class MediaArtifacts:
+
+    def __init__(self, ttl=3600, max_bytes=256 * 1024, timeline_tokens=1200):
+
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.timeline_tokens = timeline_tokens
+        self._videos = OrderedDict()  # digest -> VideoArtifact
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def add_video(self, digest, captions, timestamps, metadata):
+
+        # Texte des descriptions + horodatages et métadonnées (ordre de grandeur)
+        size = sum(len(caption) for caption in captions) + 16 * len(captions) + 256
+        artifact = VideoArtifact(digest, list(captions), list(timestamps or []), dict(metadata),
+                                 time.monotonic(), size)
+
+        with self._lock:
+            previous = self._videos.pop(digest, None)
+            if previous is not None:
+                self._size -= previous.size
+            self._videos[digest] = artifact
+            self._size += size
+
+            while len(self._videos) > 1 and self._size > self.max_bytes:
+                _, evicted = self._videos.popitem(last=False)
+                self._size -= evicted.size
+        return artifact
+
+    def latest_video(self):
+        """Vidéo la plus récente de la session, None si aucune (ou expirée)"""
+        with self._lock:
+            self._evict_expired()
+            if not self._videos:
+                return None
+            return next(reversed(self._videos.values()))
+
+    def _evict_expired(self):
+
+        deadline = time.monotonic() - self.ttl
+        while self._videos:
+            digest, artifact = next(iter(self._videos.items()))
+            if artifact.stored_at >= deadline:
+                break
+            del self._videos[digest]
+            self._size -= artifact.size
+
+    def estimated_size(self):
+
+        return self._size
+
+    def clear(self):
+
+        with self._lock:
+            self._videos.clear()
+            self._size = 0
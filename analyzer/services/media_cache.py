@@ -0,0 +1,84 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class MediaResultCache:
+    """Résultats d'analyse par empreinte de fichier envoyé (LRU + TTL).
+
+    Clés: (kind, digest), avec kind = 'image' (contenu extrait) ou 'video'
+    (descriptions des frames + métadonnées). Un fichier identique renvoyé
+    par l'utilisateur ne repasse ni par le décodage ni par le modèle.
+    """
+
+    def __init__(self, max_entries=512, ttl=3600):
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (kind, digest) -> (value, stored_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind, digest):
+
+        if not digest:
+            return None
+
+        key = (kind, digest)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        logger.info(f"Media cache hit: {kind} {digest[:12]}")
+        return entry[0]
+
+    def put(self, kind, digest, value):
+
+        if not digest:
+            return
+
+        with self._lock:
+            self._entries[(kind, digest)] = (value, time.monotonic())
+            self._entries.move_to_end((kind, digest))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+_media_cache = None
+_media_cache_lock = threading.Lock()
+
+
+def get_media_cache():
+
+    global _media_cache
+    if _media_cache is None:
+        from django.conf import settings
+
+        with _media_cache_lock:
+            if _media_cache is None:
+                _media_cache = MediaResultCache(
+                    max_entries=getattr(settings, 'MEDIA_CACHE_MAX_ENTRIES', 512),
+                    ttl=getattr(settings, 'MEDIA_CACHE_TTL', 3600),
+                )
+    return _media_cache
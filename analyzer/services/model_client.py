@@ -0,0 +1,492 @@
+"""
+Clients Gemini partagés par tout le processus.
+
+Un seul client par nom de modèle, partagé par les sessions, les
+ImageAnalyzer et les vues. google.generativeai garde déjà un transport
+(canal gRPC ou session REST) par processus: avec des clients partagés, la
+connexion reste ouverte d'une requête à l'autre au lieu d'être rétablie par
+chaque nouveau GenerativeModel. Un plafond global (GEMINI_MAX_CONCURRENCY)
+borne les appels simultanés, threads et coroutines confondus, et la latence
+de chaque appel est mesurée (stats()). Doublement des appels lents et
+disjoncteur par modèle: analyzer.services.resilience.
+
+GEMINI_FAKE=true remplace le transport par FakeGenerativeModel (hors-ligne).
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+from .resilience import CircuitBreaker, HedgePolicy
+
+logger = logging.getLogger(__name__)
+
+# Latences gardées par modèle pour les percentiles
+LATENCY_WINDOW = 512
+
+
+class ConcurrencyLimiter:
+    """Sémaphore commun aux threads et à la boucle d'événements.
+
+    Les threads attendent sur la condition; chaque coroutine en attente
+    dépose un Future de sa boucle, résolu par release() via
+    call_soon_threadsafe.
+    """
+
+    def __init__(self, limit):
+
+        self.limit = max(1, limit)
+        self.in_use = 0
+        self.max_in_use = 0
+        self._condition = threading.Condition()
+        self._async_waiters = deque()
+
+    def try_acquire(self):
+
+        with self._condition:
+            return self._take()
+
+    def _take(self):
+
+        if self.in_use >= self.limit:
+            return False
+        self.in_use += 1
+        self.max_in_use = max(self.max_in_use, self.in_use)
+        return True
+
+    def acquire(self):
+
+        with self._condition:
+            while not self._take():
+                self._condition.wait()
+
+    async def acquire_async(self):
+
+        # Attente sans bloquer la boucle (ni un thread): annulable à tout moment
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self._take():
+                    return
+                waiter = (loop, loop.create_future())
+                self._async_waiters.append(waiter)
+            try:
+                await waiter[1]
+            except asyncio.CancelledError:
+                with self._condition:
+                    try:
+                        self._async_waiters.remove(waiter)
+                    except ValueError:
+                        # Déjà réveillée: le créneau libéré revient au suivant
+                        self._wake_async_waiter()
+                raise
+
+    def release(self):
+
+        with self._condition:
+            self.in_use -= 1
+            self._condition.notify()
+            self._wake_async_waiter()
+
+    def _wake_async_waiter(self):
+        """Réveille la plus ancienne coroutine en attente (verrou tenu)"""
+        while self._async_waiters:
+            loop, future = self._async_waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+                return
+            except RuntimeError:
+                # Boucle fermée entre-temps
+                continue
+
+
+def _resolve(future):
+
+    if not future.done():
+        future.set_result(None)
+
+
+class PooledModel:
+    """Même surface que genai.GenerativeModel, appels plafonnés et mesurés.
+
+    Avec un CircuitBreaker, les appels échouent immédiatement
+    (CircuitOpenError) tant que le modèle est dégradé. Avec une HedgePolicy,
+    un appel (hors flux) plus lent que le p95 récent est doublé: la première
+    réponse est retournée. Voir analyzer.services.resilience.
+    """
+
+    def __init__(self, model, limiter, breaker=None, hedge=None, executor=None):
+
+        self.model = model
+        self.limiter = limiter
+        self.breaker = breaker
+        self.hedge = hedge
+        # Threads des appels synchrones doublés (chacun tient un créneau du limiteur)
+        self.executor = executor
+        self.calls = 0
+        self.errors = 0
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._waits = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+
+        return getattr(self.model, name)
+
+    def generate_content(self, contents, **kwargs):
+
+        if kwargs.get('stream'):
+            return self._stream(contents, kwargs)
+
+        self._before_request()
+        try:
+            delay = self._hedge_delay() if self.executor is not None else None
+            queued = time.perf_counter()
+            self.limiter.acquire()
+            if delay is None:
+                response = self._call(contents, kwargs, queued)
+            else:
+                response = self._hedged(contents, kwargs, queued, delay)
+        except Exception as e:
+            self._after_request(e)
+            raise
+        self._after_request()
+        return response
+
+    def _call(self, contents, kwargs, queued):
+        """Un essai, créneau du limiteur déjà pris (rendu à la fin)"""
+        start = time.perf_counter()
+        try:
+            response = self.model.generate_content(contents, **kwargs)
+        except Exception:
+            self._record(queued, start, failed=True)
+            raise
+        finally:
+            self.limiter.release()
+        self._record(queued, start)
+        return response
+
+    def _hedged(self, contents, kwargs, queued, delay):
+
+        primary = self.executor.submit(self._call, contents, kwargs, queued)
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
+
+        if not self._start_hedge():
+            return primary.result()
+        # Le perdant va au bout (un appel synchrone ne s'interrompt pas), hors du chemin de la requête
+        hedge = self.executor.submit(self._call, contents, kwargs, time.perf_counter())
+
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count_hedge_win()
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def _stream(self, contents, kwargs):
+
+        # Créneau pris à la première lecture et tenu jusqu'à la fin du flux
+        # (ou son abandon): un flux jamais lu ne bloque rien. Jamais doublé:
+        # les morceaux déjà envoyés ne peuvent pas changer de source
+        self._before_request()
+        queued = time.perf_counter()
+        self.limiter.acquire()
+        start = time.perf_counter()
+        failed = True
+        try:
+            yield from self.model.generate_content(contents, **kwargs)
+            failed = False
+        except GeneratorExit:
+            # Flux abandonné par l'appelant: pas une erreur du modèle
+            failed = False
+            self._release_breaker()
+            raise
+        except Exception as e:
+            self._after_request(e)
+            raise
+        finally:
+            self.limiter.release()
+            self._record(queued, start, failed)
+        self._after_request()
+
+    async def generate_content_async(self, contents, **kwargs):
+
+        if kwargs.get('stream'):
+            return self._astream(contents, kwargs)
+
+        self._before_request()
+        try:
+            delay = self._hedge_delay()
+            queued = time.perf_counter()
+            await self.limiter.acquire_async()
+            if delay is None:
+                response = await self._acall(contents, kwargs, queued)
+            else:
+                response = await self._ahedged(contents, kwargs, queued, delay)
+        except Exception as e:
+            self._after_request(e)
+            raise
+        except BaseException:
+            # Requête annulée: ni succès ni échec du modèle
+            self._release_breaker()
+            raise
+        self._after_request()
+        return response
+
+    async def _acall(self, contents, kwargs, queued):
+
+        start = time.perf_counter()
+        try:
+            response = await self.model.generate_content_async(contents, **kwargs)
+        except Exception:
+            self._record(queued, start, failed=True)
+            raise
+        finally:
+            # Aussi pour un essai annulé (perdant d'un doublement, client parti)
+            self.limiter.release()
+        self._record(queued, start)
+        return response
+
+    async def _ahedged(self, contents, kwargs, queued, delay):
+
+        primary = asyncio.ensure_future(self._acall(contents, kwargs, queued))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self._start_hedge():
+                tasks.add(asyncio.ensure_future(self._acall(contents, kwargs, time.perf_counter())))
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._count_hedge_win()
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            # Le perdant est annulé: son créneau est rendu aussitôt
+            for task in tasks:
+                task.cancel()
+
+    async def _astream(self, contents, kwargs):
+
+        self._before_request()
+        queued = time.perf_counter()
+        try:
+            await self.limiter.acquire_async()
+        except BaseException:
+            self._release_breaker()
+            raise
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = await self.model.generate_content_async(contents, **kwargs)
+            async for chunk in response:
+                yield chunk
+            failed = False
+        except Exception as e:
+            self._after_request(e)
+            raise
+        except BaseException:
+            failed = False
+            self._release_breaker()
+            raise
+        finally:
+            self.limiter.release()
+            self._record(queued, start, failed)
+        self._after_request()
+
+    def _before_request(self):
+
+        if self.breaker is not None:
+            self.breaker.before_call()
+        with self._lock:
+            self.requests += 1
+
+    def _after_request(self, error=None):
+
+        if self.breaker is not None:
+            self.breaker.record(error)
+
+    def _release_breaker(self):
+
+        if self.breaker is not None:
+            self.breaker.release()
+
+    def _hedge_delay(self):
+        """Délai avant doublement (p95 des latences récentes), None sans doublement"""
+        if self.hedge is None:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.hedge.min_samples:
+                return None
+            latencies = list(self._latencies)
+        return max(self.hedge.min_delay, float(np.percentile(latencies, self.hedge.percentile)))
+
+    def _start_hedge(self):
+
+        with self._lock:
+            if not self.hedge.allows(self.requests, self.hedges):
+                return False
+            # Seulement sur un créneau libre: pas de doublement quand le plafond est atteint
+            if not self.limiter.try_acquire():
+                return False
+            self.hedges += 1
+        return True
+
+    def _count_hedge_win(self):
+
+        with self._lock:
+            self.hedge_wins += 1
+
+    def _record(self, queued, start, failed=False):
+
+        with self._lock:
+            self.calls += 1
+            self.errors += failed
+            self._latencies.append(time.perf_counter() - start)
+            self._waits.append(start - queued)
+
+    def stats(self):
+
+        with self._lock:
+            latencies = list(self._latencies)
+            waits = list(self._waits)
+            stats = {
+                'requests': self.requests,
+                'calls': self.calls,
+                'errors': self.errors,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+            }
+
+        if self.breaker is not None:
+            stats['breaker'] = self.breaker.stats()
+        if latencies:
+            stats.update(
+                latency_p50=round(float(np.percentile(latencies, 50)), 3),
+                latency_p95=round(float(np.percentile(latencies, 95)), 3),
+                queue_wait_mean=round(float(np.mean(waits)), 3),
+            )
+        return stats
+
+
+def default_factory(model_name):
+
+    import google.generativeai as genai
+
+    return genai.GenerativeModel(model_name)
+
+
+class ModelClientPool:
+
+    def __init__(self, max_concurrency=8, factory=default_factory, hedge=None, breaker_options=None):
+
+        self.factory = factory
+        self.limiter = ConcurrencyLimiter(max_concurrency)
+        # HedgePolicy optionnelle; breaker_options: arguments de CircuitBreaker (un par modèle)
+        self.hedge = hedge
+        self.breaker_options = breaker_options
+        self._executor = None
+        if hedge is not None:
+            self._executor = ThreadPoolExecutor(max_workers=self.limiter.limit, thread_name_prefix='gemini-call')
+        self._models = {}
+        self._lock = threading.Lock()
+        logger.info(f"ModelClientPool initialized: max_concurrency={self.limiter.limit}, "
+                    f"hedging={hedge is not None}, breaker={breaker_options is not None}")
+
+    def model(self, model_name):
+        """Client partagé pour ce modèle (créé au premier appel)"""
+        pooled = self._models.get(model_name)
+        if pooled is None:
+            with self._lock:
+                pooled = self._models.get(model_name)
+                if pooled is None:
+                    start = time.perf_counter()
+                    breaker = None
+                    if self.breaker_options is not None:
+                        breaker = CircuitBreaker(model_name, **self.breaker_options)
+                    pooled = PooledModel(self.factory(model_name), self.limiter,
+                                         breaker=breaker, hedge=self.hedge, executor=self._executor)
+                    self._models[model_name] = pooled
+                    logger.info(f"Created shared client for {model_name} in "
+                                f"{(time.perf_counter() - start) * 1000:.1f}ms")
+        return pooled
+
+    def stats(self):
+
+        return {
+            'max_concurrency': self.limiter.limit,
+            'in_flight': self.limiter.in_use,
+            'max_in_flight': self.limiter.max_in_use,
+            'models': {name: pooled.stats() for name, pooled in list(self._models.items())},
+        }
+
+
+_model_client_pool = None
+_model_client_pool_lock = threading.Lock()
+
+
+def get_model_client_pool():
+
+    global _model_client_pool
+    if _model_client_pool is None:
+        from django.conf import settings
+
+        # Hors Django (benchmarks, scripts): transport réel, plafond par défaut
+        configured = settings.configured
+        factory = default_factory
+        if configured and getattr(settings, 'GEMINI_FAKE', False):
+            from .fake_gemini import FakeGenerativeModel
+
+            latency = getattr(settings, 'GEMINI_FAKE_LATENCY', 0.0)
+            factory = lambda model_name: FakeGenerativeModel(model_name=model_name, latency=latency)
+
+        hedge = breaker_options = None
+        if configured and getattr(settings, 'GEMINI_HEDGE_ENABLED', False):
+            hedge = HedgePolicy(
+                percentile=settings.GEMINI_HEDGE_PERCENTILE,
+                min_samples=settings.GEMINI_HEDGE_MIN_SAMPLES,
+                min_delay=settings.GEMINI_HEDGE_MIN_DELAY,
+                max_ratio=settings.GEMINI_HEDGE_MAX_RATIO,
+            )
+        if configured and getattr(settings, 'GEMINI_BREAKER_ENABLED', False):
+            breaker_options = {
+                'failure_threshold': settings.GEMINI_BREAKER_FAILURES,
+                'reset_timeout': settings.GEMINI_BREAKER_RESET_TIMEOUT,
+            }
+
+        with _model_client_pool_lock:
+            if _model_client_pool is None:
+                _model_client_pool = ModelClientPool(
+                    max_concurrency=getattr(settings, 'GEMINI_MAX_CONCURRENCY', 8) if configured else 8,
+                    factory=factory,
+                    hedge=hedge,
+                    breaker_options=breaker_options,
+                )
+    return _model_client_pool
+
+
+def get_model(model_name):
+
+    return get_model_client_pool().model(model_name)
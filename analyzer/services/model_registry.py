@@ -0,0 +1,182 @@
+"""
+Modèles locaux (BLIP) chargés une seule fois par processus.
+
+Le registre charge chaque modèle au premier get() (ou à l'avance avec
+preload_models), depuis BLIP_CACHE_DIR, sans accès réseau si BLIP_OFFLINE.
+Avec gunicorn --preload (gunicorn.conf.py), le chargement a lieu dans le
+processus maître avant le fork: les workers partagent les poids en
+lecture seule (copy-on-write) au lieu d'en garder chacun une copie.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+LoadedModel = namedtuple('LoadedModel', ['processor', 'model', 'device', 'precision', 'load_seconds', 'rss_mb'])
+
+# 'fp32' (référence), 'int8' (quantification dynamique des couches linéaires,
+# CPU) ou 'bf16' (poids et activations en bfloat16)
+PRECISIONS = ('fp32', 'int8', 'bf16')
+
+
+def resident_memory_mb():
+    """Mémoire résidente du processus (Mo)"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    import resource
+    # Pic de mémoire résidente, faute de mieux (Ko sous Linux, octets sous macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if peak > 1 << 30 else peak / 1024
+
+
+def load_blip(model_name, cache_dir=None, offline=False):
+
+    import torch
+    from transformers import BlipProcessor, BlipForConditionalGeneration
+
+    processor = BlipProcessor.from_pretrained(model_name, cache_dir=cache_dir, local_files_only=offline)
+    model = BlipForConditionalGeneration.from_pretrained(model_name, cache_dir=cache_dir, local_files_only=offline)
+    model.eval()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model.to(device)
+    return processor, model, device
+
+
+def apply_precision(model, precision, device):
+    """Convertir un modèle fp32 chargé; retourne (modèle, précision effective)"""
+    import torch
+
+    if precision == 'int8':
+        if device != 'cpu':
+            logger.warning("int8 dynamic quantization is CPU-only, keeping fp32")
+            return model, 'fp32'
+        from torch.ao.quantization import quantize_dynamic
+
+        return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8), 'int8'
+
+    if precision == 'bf16':
+        return model.to(torch.bfloat16), 'bf16'
+
+    return model, 'fp32'
+
+
+class ModelRegistry:
+
+    def __init__(self, cache_dir=None, offline=False, loader=load_blip):
+
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.loader = loader
+        self._models = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name, precision='fp32'):
+        """Modèle chargé (une seule fois, même en cas d'appels concurrents)"""
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision}")
+
+        key = (model_name, precision)
+        loaded = self._models.get(key)
+        if loaded is not None:
+            return loaded
+
+        with self._lock:
+            model_lock = self._locks.setdefault(key, threading.Lock())
+
+        with model_lock:
+            loaded = self._models.get(key)
+            if loaded is None:
+                loaded = self._load(model_name, precision)
+                self._models[key] = loaded
+        return loaded
+
+    def _load(self, model_name, precision):
+
+        logger.info(f"Loading {model_name} (precision={precision}, cache_dir={self.cache_dir}, "
+                    f"offline={self.offline})")
+        rss_before = resident_memory_mb()
+        start = time.perf_counter()
+
+        processor, model, device = self.loader(model_name, cache_dir=self.cache_dir, offline=self.offline)
+        model, precision = apply_precision(model, precision, device)
+
+        load_seconds = time.perf_counter() - start
+        rss_mb = resident_memory_mb()
+        logger.info(f"Loaded {model_name} ({precision}) on {device} in {load_seconds:.1f}s, "
+                    f"RSS {rss_before:.0f} -> {rss_mb:.0f} MB")
+        return LoadedModel(processor, model, device, precision, load_seconds, rss_mb)
+
+    def warm_up(self, model_name, precision='fp32'):
+        """Charger le modèle et faire une inférence à blanc (allocations, pages des poids)"""
+        import torch
+        from PIL import Image
+
+        loaded = self.get(model_name, precision)
+        start = time.perf_counter()
+        with torch.inference_mode():
+            inputs = loaded.processor(images=Image.new('RGB', (64, 64)), return_tensors="pt").to(loaded.device)
+            if loaded.precision == 'bf16':
+                inputs['pixel_values'] = inputs['pixel_values'].to(torch.bfloat16)
+            loaded.model.generate(**inputs, max_length=5)
+        logger.info(f"Warmed up {model_name} in {time.perf_counter() - start:.2f}s, "
+                    f"RSS {resident_memory_mb():.0f} MB")
+        return loaded
+
+    def is_loaded(self, model_name, precision='fp32'):
+
+        return (model_name, precision) in self._models
+
+    def stats(self):
+
+        return {
+            'models': {
+                f"{name}:{precision}": {'device': loaded.device, 'load_seconds': round(loaded.load_seconds, 2)}
+                for (name, precision), loaded in self._models.items()
+            },
+            'rss_mb': round(resident_memory_mb(), 1),
+        }
+
+
+_model_registry = None
+_model_registry_lock = threading.Lock()
+
+
+def get_model_registry():
+
+    global _model_registry
+    if _model_registry is None:
+        from django.conf import settings
+
+        # Hors Django (benchmarks, scripts): cache Hugging Face par défaut
+        configured = settings.configured
+        with _model_registry_lock:
+            if _model_registry is None:
+                _model_registry = ModelRegistry(
+                    cache_dir=getattr(settings, 'BLIP_CACHE_DIR', None) if configured else None,
+                    offline=getattr(settings, 'BLIP_OFFLINE', False) if configured else False,
+                )
+    return _model_registry
+
+
+def preload_models(warm_up=False):
+    """Charger à l'avance les modèles locaux utilisés (backends 'blip' et 'hybrid')"""
+    from django.conf import settings
+
+    if settings.FRAME_CAPTION_BACKEND not in ('blip', 'hybrid'):
+        return
+
+    registry = get_model_registry()
+    if warm_up:
+        registry.warm_up(settings.BLIP_MODEL_NAME, settings.BLIP_PRECISION)
+    else:
+        registry.get(settings.BLIP_MODEL_NAME, settings.BLIP_PRECISION)
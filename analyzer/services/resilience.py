@@ -0,0 +1,150 @@
+"""
+Résilience des appels au modèle distant: requêtes doublées et disjoncteur.
+
+HedgePolicy: un appel qui dépasse le p95 des latences récentes est doublé
+par un second appel identique, et la première réponse l'emporte. Un budget
+(max_ratio des appels) et les créneaux libres du plafond de concurrence
+bornent la charge ajoutée.
+
+CircuitBreaker: après failure_threshold échecs consécutifs (erreurs
+transitoires: indisponibilité, quota, délai dépassé), le modèle est
+considéré dégradé. Les appels échouent immédiatement (CircuitOpenError)
+pendant reset_timeout secondes, puis un seul appel d'essai décide de la
+réouverture.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+try:
+    from google.api_core import exceptions as google_exceptions
+
+    REMOTE_FAILURES = (
+        ConnectionError,
+        TimeoutError,
+        google_exceptions.ResourceExhausted,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.DeadlineExceeded,
+        google_exceptions.InternalServerError,
+    )
+except ImportError:
+    REMOTE_FAILURES = (ConnectionError, TimeoutError)
+
+try:
+    from google.generativeai.types import BlockedPromptException, StopCandidateException
+
+    # Le modèle a répondu, mais a refusé de produire le texte demandé
+    REFUSALS = (BlockedPromptException, StopCandidateException)
+except ImportError:
+    REFUSALS = ()
+
+
+class ModelUnavailableError(RuntimeError):
+    """Le modèle distant n'a pas pu répondre"""
+
+    def __init__(self, message, retry_after=None):
+
+        super().__init__(message)
+        # Secondes avant qu'un nouvel essai ait une chance d'aboutir (en-tête Retry-After)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(ModelUnavailableError):
+    """Disjoncteur ouvert: appel refusé sans contacter le modèle"""
+
+
+class ModelRefusalError(RuntimeError):
+    """Le modèle a répondu sans texte (filtre de sécurité, réponse vide): réessayer n'y changera rien"""
+
+
+class CircuitBreaker:
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        # Horloge en secondes (remplaçable dans les tests)
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.opened = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Lève CircuitOpenError si l'appel doit échouer sans contacter le modèle"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+
+            retry_after = self.opened_at + self.reset_timeout - self.clock()
+            if self.state == self.OPEN and retry_after <= 0:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                # Un seul appel d'essai à la fois
+                self._probe_in_flight = True
+                return
+
+            self.rejected += 1
+            raise CircuitOpenError(f"{self.name} indisponible (disjoncteur ouvert)",
+                                   retry_after=max(1, round(retry_after)))
+
+    def record(self, error=None):
+        """Issue d'un appel: seules les erreurs transitoires comptent comme échecs"""
+        with self._lock:
+            self._probe_in_flight = False
+            if error is None or not isinstance(error, REMOTE_FAILURES):
+                # Le modèle a répondu (même une erreur 4xx): il n'est pas dégradé
+                if self.state != self.CLOSED:
+                    logger.info(f"Circuit breaker for {self.name} closed")
+                self.state = self.CLOSED
+                self.failures = 0
+                return
+
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opened += 1
+                    logger.warning(f"Circuit breaker for {self.name} opened after "
+                                   f"{self.failures} failure(s): {error}")
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+
+    def release(self):
+        """Appel abandonné (annulation) sans issue connue"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def stats(self):
+
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'opened': self.opened,
+                'rejected': self.rejected,
+            }
+
+
+class HedgePolicy:
+
+    def __init__(self, percentile=95, min_samples=20, min_delay=0.2, max_ratio=0.1):
+
+        self.percentile = percentile
+        # Pas de doublement tant que la distribution des latences est inconnue
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_ratio = max_ratio
+
+    def allows(self, requests, hedges):
+        """Budget: au plus max_ratio des requêtes doublées"""
+        return hedges < self.max_ratio * requests
@@ -0,0 +1,222 @@
+"""
+Cache des réponses du chatbot aux messages texte seul (opt-in).
+
+La clé réunit le modèle, la version du prompt, le message normalisé
+(casse, espaces, ponctuation finale) et l'historique rendu tel qu'il est
+injecté dans le prompt (questions et réponses précédentes). Une réponse
+n'est donc resservie que si le prompt envoyé au modèle serait le même: en
+pratique le premier message d'une conversation, ou celui qui suit un
+effacement de l'historique. Une relance n'est servie que si toute la
+conversation qui la précède, réponses comprises, est identique (le champ
+cache=off contourne le cache).
+
+Deux niveaux comme CaptionCache: LRU + TTL en mémoire, puis SQLite sur
+disque (partagé par les workers) avec TTL et éviction par taille.
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from .single_flight import request_key
+
+logger = logging.getLogger(__name__)
+
+# À incrémenter si build_text_only_prompt change: invalide les réponses en cache
+TEXT_PROMPT_VERSION = 'text-v1'
+
+
+def normalize_message(message):
+
+    message = unicodedata.normalize('NFKC', message).casefold()
+    message = ' '.join(message.split())
+    return re.sub(r'[\s.!?…]+$', '', message)
+
+
+def response_key(model_name, message, history_context=""):
+    """history_context: historique rendu (ConversationMemory.get_history_context)"""
+    return request_key(model_name, TEXT_PROMPT_VERSION, normalize_message(message), history_context)
+
+
+class ResponseCache:
+
+    def __init__(self, max_entries=1024, ttl=21600, db_path=None, max_db_bytes=32 * 1024 * 1024):
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.max_db_bytes = max_db_bytes
+        self._entries = OrderedDict()  # key -> (response, stored_at)
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0}
+
+        self._db = None
+        self._db_bytes = 0
+        if db_path:
+            self._open_db(db_path)
+
+        logger.info(f"ResponseCache initialized: max_entries={max_entries}, ttl={ttl}s, "
+                    f"db={db_path or 'disabled'}")
+
+    def get(self, key):
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] <= self.ttl:
+                self._entries.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return entry[0]
+            self._entries.pop(key, None)
+
+            entry = self._get_from_db(key, now)
+            if entry is not None:
+                self._counters['disk_hits'] += 1
+                self._put_memory(key, *entry)
+                return entry[0]
+
+            self._counters['misses'] += 1
+            return None
+
+    def put(self, key, response):
+
+        now = time.time()
+        with self._lock:
+            self._counters['stores'] += 1
+            self._put_memory(key, response, now)
+            self._put_db(key, response, now)
+
+    def stats(self):
+
+        with self._lock:
+            counters = dict(self._counters)
+            counters['entries'] = len(self._entries)
+            counters['db_bytes'] = self._db_bytes
+
+        hits = counters['memory_hits'] + counters['disk_hits']
+        lookups = hits + counters['misses']
+        counters['hit_rate'] = hits / lookups if lookups else 0.0
+        return counters
+
+    def clear(self):
+
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+                self._db_bytes = 0
+
+    def _put_memory(self, key, response, stored_at):
+
+        self._entries[key] = (response, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _open_db(self, db_path):
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used_idx ON responses (last_used)")
+        self._db.commit()
+        self._db_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def _get_from_db(self, key, now):
+
+        if self._db is None:
+            return None
+
+        try:
+            row = self._db.execute(
+                "SELECT response, stored_at FROM responses WHERE key = ? AND stored_at >= ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+
+            self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            return row
+
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache read error: {e}")
+            return None
+
+    def _put_db(self, key, response, now):
+
+        if self._db is None:
+            return
+
+        size = len(response.encode('utf-8')) + len(key)
+        try:
+            previous = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now),
+            )
+            self._db_bytes += size - (previous[0] if previous else 0)
+
+            if self._db_bytes > self.max_db_bytes:
+                self._evict_db(now)
+            self._db.commit()
+
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache write error: {e}")
+
+    def _evict_db(self, now):
+
+        # Réponses expirées d'abord, puis les moins récemment servies jusqu'à ~90% du budget
+        self._db.execute("DELETE FROM responses WHERE stored_at < ?", (now - self.ttl,))
+        self._db_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+        target = int(self.max_db_bytes * 0.9)
+        rows = self._db.execute("SELECT rowid, size FROM responses ORDER BY last_used").fetchall()
+        evicted = []
+        for rowid, size in rows:
+            if self._db_bytes <= target:
+                break
+            evicted.append((rowid,))
+            self._db_bytes -= size
+
+        self._db.executemany("DELETE FROM responses WHERE rowid = ?", evicted)
+        logger.info(f"Response cache evicted {len(evicted)} entries from disk")
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Cache partagé du process (None si désactivé, c'est le défaut)"""
+    global _response_cache
+
+    from django.conf import settings
+
+    if not getattr(settings, 'RESPONSE_CACHE_ENABLED', False):
+        return None
+
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(
+                    max_entries=getattr(settings, 'RESPONSE_CACHE_MAX_ENTRIES', 1024),
+                    ttl=getattr(settings, 'RESPONSE_CACHE_TTL', 21600),
+                    db_path=getattr(settings, 'RESPONSE_CACHE_DB_PATH', None),
+                    max_db_bytes=getattr(settings, 'RESPONSE_CACHE_DB_MAX_BYTES', 32 * 1024 * 1024),
+                )
+    return _response_cache
@@ -0,0 +1,171 @@
+"""
+Détection de changements de scène sur des vignettes réduites.
+
+Les détecteurs comparent des vignettes en niveaux de gris (64x36 par défaut)
+au lieu des frames pleine résolution: le coût par comparaison devient
+indépendant de la résolution de la vidéo. Ils sont sans état; l'appelant
+garde la vignette de référence (la dernière frame retenue).
+
+find_shots() parcourt toute la vidéo en une passe pour découper les plans
+et choisir pour chacun la frame la plus représentative.
+"""
+import logging
+from abc import ABC, abstractmethod
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = (64, 36)
+
+
+class SceneDetector(ABC):
+    """Base: score(a, b) vaut 0 pour deux vignettes identiques"""
+
+    default_threshold = 0.0
+
+    def __init__(self, threshold=None, thumbnail_size=THUMBNAIL_SIZE):
+
+        self.threshold = self.default_threshold if threshold is None else threshold
+        self.thumbnail_size = thumbnail_size
+
+    def thumbnail(self, frame):
+        """Vignette en niveaux de gris d'une frame BGR"""
+        small = cv2.resize(frame, self.thumbnail_size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    @abstractmethod
+    def score(self, reference, thumbnail):
+        """Distance entre la vignette de référence et la vignette courante"""
+
+    def is_change(self, reference, thumbnail):
+
+        return self.score(reference, thumbnail) > self.threshold
+
+
+class MeanDiffDetector(SceneDetector):
+    """Différence absolue moyenne des pixels (0-255), comme l'ancien détecteur"""
+
+    default_threshold = 30.0
+
+    def score(self, reference, thumbnail):
+
+        return float(np.mean(cv2.absdiff(reference, thumbnail)))
+
+
+class HistogramDetector(SceneDetector):
+    """Distance de Bhattacharyya entre histogrammes de luminance (0-1)"""
+
+    default_threshold = 0.3
+
+    def __init__(self, threshold=None, thumbnail_size=THUMBNAIL_SIZE, bins=32):
+
+        super().__init__(threshold, thumbnail_size)
+        self.bins = bins
+
+    def _histogram(self, thumbnail):
+
+        hist = cv2.calcHist([thumbnail], [0], None, [self.bins], [0, 256])
+        return cv2.normalize(hist, hist).flatten()
+
+    def score(self, reference, thumbnail):
+
+        return float(cv2.compareHist(
+            self._histogram(reference), self._histogram(thumbnail), cv2.HISTCMP_BHATTACHARYYA
+        ))
+
+
+class SSIMLiteDetector(SceneDetector):
+    """1 - SSIM moyen calculé par blocs de 4x4 pixels sur la vignette (0-2)"""
+
+    default_threshold = 0.35
+    block = 4
+    C1 = (0.01 * 255) ** 2
+    C2 = (0.03 * 255) ** 2
+
+    def _blocks(self, thumbnail):
+
+        h, w = thumbnail.shape
+        h, w = h - h % self.block, w - w % self.block
+        blocks = thumbnail[:h, :w].astype(np.float32)
+        return blocks.reshape(h // self.block, self.block, w // self.block, self.block).swapaxes(1, 2)
+
+    def score(self, reference, thumbnail):
+
+        a = self._blocks(reference)
+        b = self._blocks(thumbnail)
+
+        mu_a = a.mean(axis=(2, 3))
+        mu_b = b.mean(axis=(2, 3))
+        var_a = a.var(axis=(2, 3))
+        var_b = b.var(axis=(2, 3))
+        cov = ((a - mu_a[..., None, None]) * (b - mu_b[..., None, None])).mean(axis=(2, 3))
+
+        ssim = ((2 * mu_a * mu_b + self.C1) * (2 * cov + self.C2)) / (
+            (mu_a ** 2 + mu_b ** 2 + self.C1) * (var_a + var_b + self.C2)
+        )
+        return float(1.0 - ssim.mean())
+
+
+SCENE_DETECTORS = {
+    'mean_diff': MeanDiffDetector,
+    'histogram': HistogramDetector,
+    'ssim': SSIMLiteDetector,
+}
+
+
+def get_scene_detector(name='mean_diff', threshold=None):
+
+    try:
+        return SCENE_DETECTORS[name](threshold=threshold)
+    except KeyError:
+        raise ValueError(f"Unknown scene detector: {name}") from None
+
+
+def find_shots(cap, detector, fps, analysis_fps=2.0, min_shot_seconds=1.0):
+    """Découper la vidéo en plans en une seule passe.
+
+    Seule une frame sur round(fps / analysis_fps) est décodée en vignette.
+    Retourne une liste de (start_frame, end_frame, representative_frame):
+    la frame représentative est celle dont la vignette est la plus proche de
+    la vignette moyenne du plan.
+    """
+    step = max(1, int(round(fps / analysis_fps)))
+    min_shot_frames = int(min_shot_seconds * fps)
+
+    shots = []
+    candidates = []  # (frame_index, thumbnail) du plan en cours
+    reference = None
+    shot_start = 0
+    frame_index = 0
+
+    def close_shot(end_frame):
+        if not candidates:
+            return
+        stack = np.stack([thumb.astype(np.float32) for _, thumb in candidates])
+        distances = np.abs(stack - stack.mean(axis=0)).mean(axis=(1, 2))
+        representative = candidates[int(np.argmin(distances))][0]
+        shots.append((shot_start, end_frame, representative))
+
+    while cap.grab():
+        if frame_index % step == 0:
+            ret, frame = cap.retrieve()
+            if not ret:
+                break
+
+            thumbnail = detector.thumbnail(frame)
+            if reference is not None and detector.is_change(reference, thumbnail) \
+                    and frame_index - shot_start >= min_shot_frames:
+                close_shot(frame_index - 1)
+                shot_start = frame_index
+                candidates = []
+
+            candidates.append((frame_index, thumbnail))
+            reference = thumbnail
+
+        frame_index += 1
+
+    close_shot(max(shot_start, frame_index - 1))
+    logger.info(f"Detected {len(shots)} shot(s) over {frame_index} frames")
+    return shots
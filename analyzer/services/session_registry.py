@@ -0,0 +1,230 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from .chat_store import get_chat_store
+from .chatbot_orchestrator import MultimodalChatbot
+from .media_cache import get_media_cache
+from .response_cache import get_response_cache
+
+logger = logging.getLogger(__name__)
+
+# Coût fixe estimé d'un chatbot en mémoire (clients Gemini, analyseur, prompt builder)
+CHATBOT_BASE_SIZE = 64 * 1024
+
+
+class SessionRegistry:
+    """Pool process-wide de MultimodalChatbot, réutilisés d'un tour à l'autre.
+
+    Les sessions sont évincées par LRU (nombre max), par TTL d'inactivité et
+    par budget mémoire global. Une session absente du pool (worker froid,
+    session évincée) est réhydratée depuis ChatMessage en une seule requête.
+
+    Chaque worker a sa propre copie d'une session: à chaque get(), une
+    requête indexée compare la génération persistée (incrémentée par un
+    effacement) et l'horodatage du dernier échange à ceux que connaît le
+    chatbot. Effacée ailleurs, la copie locale est oubliée; en retard
+    (échanges traités par un autre worker), elle est réhydratée.
+
+    La chronologie de la dernière vidéo (video_digest des métadonnées) est
+    reconstruite depuis le cache des médias. Ce cache est propre au
+    processus: si la vidéo a été décrite par un autre worker (ou est sortie
+    du cache), la suite de la conversation est traitée sans la vidéo.
+    """
+
+    def __init__(self, max_sessions=256, ttl=1800, memory_budget=16 * 1024 * 1024,
+                 factory=MultimodalChatbot):
+
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.memory_budget = memory_budget
+        self.factory = factory
+        self._entries = OrderedDict()  # session_id -> [chatbot, last_used]
+        self._lock = threading.Lock()
+        logger.info(f"SessionRegistry initialized: max_sessions={max_sessions}, "
+                    f"ttl={ttl}s, memory_budget={memory_budget} bytes")
+
+    def get(self, session_id):
+        """Retourner le chatbot de la session, en le créant si besoin"""
+        now = time.monotonic()
+
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                entry[1] = now
+                self._entries.move_to_end(session_id)
+                chatbot = entry[0]
+            else:
+                chatbot = None
+
+        if chatbot is not None:
+            self._sync(chatbot)
+            return chatbot
+
+        # Construction hors verrou: elle crée les clients Gemini et interroge la base
+        chatbot = self.factory(session_id=session_id)
+        self._sync(chatbot)
+
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                # Une requête concurrente a déjà enregistré cette session
+                entry[1] = now
+                self._entries.move_to_end(session_id)
+                return entry[0]
+
+            self._entries[session_id] = [chatbot, now]
+            self._enforce_limits()
+
+        return chatbot
+
+    def discard(self, session_id):
+        """Retirer une session du pool"""
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def clear(self):
+
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, session_id):
+        return session_id in self._entries
+
+    def stats(self):
+
+        with self._lock:
+            return {
+                'sessions': len(self._entries),
+                'memory_bytes': self._memory_usage(),
+                'max_sessions': self.max_sessions,
+                'memory_budget': self.memory_budget,
+            }
+
+    def _sync(self, chatbot):
+        """Aligner le chatbot sur l'historique persisté s'il est périmé"""
+        try:
+            version = get_chat_store().session_version(chatbot.session_id)
+        except DatabaseError as e:
+            logger.warning(f"Cannot check session {chatbot.session_id}: {e}")
+            return
+
+        if version is None:
+            # Rien de persisté (session nouvelle ou échanges encore en file)
+            return
+
+        generation, last_message = version
+        with chatbot.lock:
+            if generation != chatbot.generation:
+                if chatbot.last_turn_at is not None:
+                    logger.info(f"Session {chatbot.session_id} cleared by another worker")
+                chatbot.forget(generation)
+            if last_message is None or (chatbot.last_turn_at is not None and last_message <= chatbot.last_turn_at):
+                return
+
+        self._rehydrate(chatbot)
+
+    def _rehydrate(self, chatbot):
+        """Recharger les derniers messages de la session (une page indexée)"""
+        limit = chatbot.memory.max_messages * 2
+
+        try:
+            rows, _ = get_chat_store().history_page(chatbot.session_id, limit=limit)
+        except DatabaseError as e:
+            logger.warning(f"Cannot rehydrate session {chatbot.session_id}: {e}")
+            return
+
+        digests = [row['metadata'].get('video_digest') for row in rows if row['metadata']]
+        digests = [digest for digest in digests if digest]
+        # Vidéo décrite par un autre worker (ou session évincée): chronologie
+        # reconstruite depuis le cache des médias s'il l'a encore
+        cached = get_media_cache().get('video', digests[-1]) if digests else None
+
+        with chatbot.lock:
+            chatbot.memory.load(rows)
+            chatbot.last_turn_at = rows[-1]['timestamp'] if rows else None
+
+            video = chatbot.media.latest_video()
+            if digests and (video is None or video.digest != digests[-1]):
+                # Chronologie locale périmée; sans entrée en cache, la suite est traitée sans la vidéo
+                chatbot.media.clear()
+                if cached is not None:
+                    chatbot.media.add_video(digests[-1], cached['captions'], cached.get('timestamps'),
+                                            cached['metadata'])
+
+        if rows:
+            logger.info(f"Session {chatbot.session_id} rehydrated with {len(rows)} messages")
+
+    def _evict_expired(self, now):
+
+        expired = [
+            session_id for session_id, (_, last_used) in self._entries.items()
+            if now - last_used > self.ttl
+        ]
+        for session_id in expired:
+            del self._entries[session_id]
+
+        if expired:
+            logger.info(f"Evicted {len(expired)} expired session(s)")
+
+    def _memory_usage(self):
+
+        return sum(
+            CHATBOT_BASE_SIZE + chatbot.memory.estimated_size() + chatbot.media.estimated_size()
+            for chatbot, _ in self._entries.values()
+        )
+
+    def _enforce_limits(self):
+
+        while len(self._entries) > self.max_sessions:
+            session_id, _ = self._entries.popitem(last=False)
+            logger.info(f"Evicted LRU session {session_id}")
+
+        # Toujours garder au moins la session la plus récente
+        while len(self._entries) > 1 and self._memory_usage() > self.memory_budget:
+            session_id, _ = self._entries.popitem(last=False)
+            logger.info(f"Evicted session {session_id} (memory budget)")
+
+
+_session_registry = None
+_session_registry_lock = threading.Lock()
+
+
+def get_session_registry():
+
+    global _session_registry
+    if _session_registry is None:
+        with _session_registry_lock:
+            if _session_registry is None:
+                memory_options = {
+                    'history_tokens': getattr(settings, 'CHATBOT_HISTORY_TOKENS', 800),
+                    'message_tokens': getattr(settings, 'CHATBOT_HISTORY_MESSAGE_TOKENS', 200),
+                    'summary_tokens': getattr(settings, 'CHATBOT_HISTORY_SUMMARY_TOKENS', 120),
+                }
+                media_options = {
+                    'ttl': getattr(settings, 'CHATBOT_MEDIA_TTL', 3600),
+                    'max_bytes': getattr(settings, 'CHATBOT_MEDIA_MAX_BYTES', 256 * 1024),
+                    'timeline_tokens': getattr(settings, 'CHATBOT_MEDIA_TIMELINE_TOKENS', 1200),
+                }
+                _session_registry = SessionRegistry(
+                    max_sessions=getattr(settings, 'CHATBOT_SESSION_MAX', 256),
+                    ttl=getattr(settings, 'CHATBOT_SESSION_TTL', 1800),
+                    memory_budget=getattr(settings, 'CHATBOT_SESSION_MEMORY_BUDGET', 16 * 1024 * 1024),
+                    factory=partial(
+                        MultimodalChatbot,
+                        memory_options=memory_options,
+                        store=get_chat_store(),
+                        response_cache=get_response_cache(),
+                        media_options=media_options,
+                    ),
+                )
+    return _session_registry
@@ -0,0 +1,142 @@
+"""
+Regroupement des appels identiques en cours (single-flight).
+
+Un double envoi, ou le même média envoyé depuis plusieurs onglets, produit
+des appels generate_content identiques au même moment. SingleFlight les
+regroupe par clé (empreinte du modèle, du prompt et des médias): le premier
+appelant fait l'appel, ceux qui arrivent pendant qu'il est en cours
+attendent et reçoivent le même résultat, ou la même exception. Rien n'est
+gardé une fois l'appel terminé: ce n'est pas un cache.
+
+do() sert les appels faits depuis des threads, ado() ceux faits sur une
+boucle d'événements; les deux partagent les mêmes clés.
+"""
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+
+import xxhash
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(*parts):
+    """Empreinte d'une requête: textes, octets ou digests des médias"""
+    digest = xxhash.xxh3_128()
+    for part in parts:
+        data = part if isinstance(part, bytes) else str(part).encode('utf-8')
+        # Longueur en préfixe: ('ab', 'c') et ('a', 'bc') donnent des clés différentes
+        digest.update(len(data).to_bytes(8, 'little'))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class _Call:
+
+    def __init__(self):
+
+        # Future partagé par les threads et les boucles d'événements
+        self.future = Future()
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Un seul espace de clés pour do() et ado(): un appelant async attend
+    le résultat d'un appel synchrone en cours (asyncio.wrap_future), et
+    inversement.
+    """
+
+    def __init__(self):
+
+        self._calls = {}
+        # Tâches des appelants async en tête: la boucle n'en garde qu'une référence faible
+        self._tasks = set()
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _join(self, key):
+        """(_Call, True si l'appelant doit faire l'appel)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                return call, True
+            call.waiters += 1
+            self.coalesced += 1
+            return call, False
+
+    def _finish(self, key, call):
+
+        with self._lock:
+            del self._calls[key]
+        if call.waiters:
+            logger.info(f"Single-flight: {call.waiters} duplicate call(s) served by one request")
+
+    def do(self, key, fn):
+        """Résultat de fn(), partagé avec les appels de même clé en cours"""
+        call, leader = self._join(key)
+        if not leader:
+            return call.future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, call)
+            call.future.set_exception(e)
+            raise
+        self._finish(key, call)
+        call.future.set_result(result)
+        return result
+
+    async def ado(self, key, coroutine_fn):
+        """Variante async de do(): l'appel est une tâche de la boucle du premier appelant"""
+        call, leader = self._join(key)
+        if leader:
+            task = asyncio.get_running_loop().create_task(coroutine_fn())
+            with self._lock:
+                self._tasks.add(task)
+            task.add_done_callback(lambda done: self._task_done(key, call, done))
+
+        result = asyncio.wrap_future(call.future)
+        # Appelant parti: l'exception ne sera jamais lue
+        result.add_done_callback(lambda done: done.cancelled() or done.exception())
+        # Un appelant annulé (client déconnecté) n'annule pas l'appel des autres
+        return await asyncio.shield(result)
+
+    def _task_done(self, key, call, task):
+
+        with self._lock:
+            self._tasks.discard(task)
+        self._finish(key, call)
+        if task.cancelled():
+            call.future.cancel()
+        elif task.exception() is not None:
+            call.future.set_exception(task.exception())
+        else:
+            call.future.set_result(task.result())
+
+    def stats(self):
+
+        with self._lock:
+            return {
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._calls),
+            }
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+    return _single_flight
@@ -1,34 +1,109 @@
 import cv2
 import numpy as np
 import logging
+from collections import namedtuple
+
+from .scene_detection import MeanDiffDetector, find_shots
 
 logger = logging.getLogger(__name__)
 
+# Résultat d'une lecture unique de la vidéo
+VideoSample = namedtuple('VideoSample', ['frames', 'timestamps', 'metadata'])
+
+
+# FPS supposé quand le conteneur ne le renseigne pas
+DEFAULT_FPS = 25.0
+
+SAMPLING_STRATEGIES = ('sequential', 'seek', 'shots')
+
 
 class VideoProcessor:
+    """Échantillonnage de frames d'une vidéo.
+    
+    sampling='sequential' parcourt toutes les frames (grab) et garde une frame
+    sur frame_interval; sampling='seek' se positionne directement sur chaque
+    horodatage cible (CAP_PROP_POS_MSEC), le coût de décodage ne dépend alors
+    plus de la longueur de la vidéo mais du nombre de frames retenues;
+    sampling='shots' découpe la vidéo en plans et garde la frame la plus
+    représentative de chaque plan.
     
+    scene_detector (analyzer.services.scene_detection) décide si une frame
+    candidate diffère assez de la dernière frame retenue.
+    """
     
-    def __init__(self, interval=5, max_frames=50):
+    def __init__(self, interval=5, max_frames=50, sampling='sequential', scene_detector=None):
+        
+        if sampling not in SAMPLING_STRATEGIES:
+            raise ValueError(f"Unknown sampling strategy: {sampling}")
         
         self.interval = interval
         self.max_frames = max_frames
-        logger.info(f"VideoProcessor initialized: interval={interval}s, max_frames={max_frames}")
+        self.sampling = sampling
+        self.scene_detector = scene_detector or MeanDiffDetector()
+        logger.info(f"VideoProcessor initialized: interval={interval}s, max_frames={max_frames}, "
+                    f"sampling={sampling}, scene_detector={type(self.scene_detector).__name__}")
     
-    def extract_frames(self, video_path):
-        
+    def stream_video(self, video_path):
+        """Ouvrir la vidéo et retourner (métadonnées, générateur de frames).
+        
+        Le générateur produit des tuples (timestamp, frame_rgb) au fur et à
+        mesure du décodage, pour que la description des frames puisse
+        commencer avant la fin de la lecture. La vidéo est fermée quand le
+        générateur est épuisé ou fermé.
+        """
         logger.info(f"Processing video: {video_path}")
         
         cap = cv2.VideoCapture(video_path)
         
         if not cap.isOpened():
             logger.error(f"Cannot open video: {video_path}")
-            return []
+            return {}, iter(())
         
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        duration = total_frames / fps
+        metadata = self._read_metadata(cap)
+        return metadata, self._iter_frames(cap, metadata)
+    
+    def _iter_frames(self, cap, metadata):
+        
+        if self.sampling == 'seek':
+            frames = self._seek_frames(cap, metadata)
+        elif self.sampling == 'shots':
+            frames = self._shot_frames(cap, metadata)
+        else:
+            frames = self._sample_frames(cap, metadata)
+        
+        count = 0
+        try:
+            for timestamp, frame in frames:
+                count += 1
+                yield timestamp, frame
+        finally:
+            cap.release()
+            logger.info(f"Total frames extracted: {count}")
+            logger.info(f"Coverage: {count * self.interval}s of {metadata['duration']}s video")
+    
+    def process_video(self, video_path):
+        """Ouvrir la vidéo une seule fois et retourner frames, horodatages et métadonnées"""
+        metadata, frame_stream = self.stream_video(video_path)
         
-        logger.info(f"Video duration: {int(duration)} seconds")
+        frames = []
+        timestamps = []
+        for timestamp, frame in frame_stream:
+            timestamps.append(timestamp)
+            frames.append(frame)
+        
+        return VideoSample(frames, timestamps, metadata)
+    
+    def extract_frames(self, video_path):
+        
+        return self.process_video(video_path).frames
+    
+    def _sample_frames(self, cap, metadata):
+        
+        fps = metadata['fps'] or DEFAULT_FPS
+        total_frames = metadata['total_frames']
+        duration = metadata['duration']
+        
+        logger.info(f"Video duration: {duration} seconds")
         logger.info(f"Total frames in video: {total_frames}, FPS: {fps}")
         
         frame_interval = int(fps * self.interval)
@@ -38,48 +113,97 @@ class VideoProcessor:
             frame_interval = int(total_frames / self.max_frames)
             logger.info(f"Adjusted interval to extract max {self.max_frames} frames")
         
-        frames = []
-        current_frame = 0
+        # Vidéo très courte ou FPS très bas: ne jamais descendre sous une frame
+        frame_interval = max(1, frame_interval)
+        
         extracted_count = 0
+        current_frame = 0
         
-        prev_frame = None
+        reference = None
         
-        while cap.isOpened() and extracted_count < self.max_frames:
-            ret, frame = cap.read()
-            
-            if not ret:
+        while extracted_count < self.max_frames:
+            # grab() avance sans convertir la frame: seules les frames échantillonnées sont récupérées
+            if not cap.grab():
                 break
             
             if current_frame % frame_interval == 0:
+                ret, frame = cap.retrieve()
+                
+                if not ret:
+                    break
+                
                 timestamp = current_frame / fps
+                thumbnail = self.scene_detector.thumbnail(frame)
                 
-                if prev_frame is None or self._is_scene_change(prev_frame, frame):
+                if reference is None or self.scene_detector.is_change(reference, thumbnail):
                     logger.info(f"Extracted frame at {int(timestamp)}s (frame {current_frame})")
                     
                     frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    frames.append(frame_rgb)
                     extracted_count += 1
+                    reference = thumbnail
                     
-                    prev_frame = frame.copy()
+                    yield timestamp, frame_rgb
             
             current_frame += 1
+    
+    def _seek_frames(self, cap, metadata):
         
-        cap.release()
+        duration = metadata['duration']
+        
+        if duration > 0:
+            step = max(self.interval, duration / self.max_frames)
+            targets = [i * step for i in range(self.max_frames) if i * step < duration]
+        else:
+            # Durée inconnue (FPS ou nombre de frames non renseignés): avancer
+            # de interval en interval jusqu'à ce que la lecture échoue
+            logger.warning("Video duration unknown, probing by seeking until end of stream")
+            targets = [i * self.interval for i in range(self.max_frames)]
         
-        logger.info(f"Total frames extracted: {len(frames)}")
-        logger.info(f"Coverage: {len(frames) * self.interval}s of {int(duration)}s video")
+        reference = None
+        last_position = -1.0
         
-        return frames
+        for target in targets:
+            cap.set(cv2.CAP_PROP_POS_MSEC, target * 1000)
+            ret, frame = cap.read()
+            
+            if not ret:
+                break
+            
+            # Position réelle après le seek (peut être arrondie à une keyframe)
+            position = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            if position <= last_position:
+                # Le conteneur ignore le seek: inutile de relire la même frame
+                logger.warning("Seek not supported by container, stopping seek sampling")
+                break
+            last_position = position
+            
+            thumbnail = self.scene_detector.thumbnail(frame)
+            if reference is None or self.scene_detector.is_change(reference, thumbnail):
+                logger.info(f"Extracted frame at {int(target)}s (seek)")
+                
+                reference = thumbnail
+                
+                yield target, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
     
-    def _is_scene_change(self, frame1, frame2, threshold=30.0):
+    def _shot_frames(self, cap, metadata):
         
-        gray1 = cv2.cvtColor(frame1, cv2.COLOR_BGR2GRAY)
-        gray2 = cv2.cvtColor(frame2, cv2.COLOR_BGR2GRAY)
+        fps = metadata['fps'] or DEFAULT_FPS
+        shots = find_shots(cap, self.scene_detector, fps)
         
-        diff = cv2.absdiff(gray1, gray2)
-        mean_diff = np.mean(diff)
+        if len(shots) > self.max_frames:
+            # Garder les plans les plus longs, puis revenir à l'ordre chronologique
+            shots = sorted(shots, key=lambda shot: shot[1] - shot[0], reverse=True)[:self.max_frames]
+            shots.sort()
         
-        return mean_diff > threshold
+        for _, _, representative in shots:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, representative)
+            ret, frame = cap.read()
+            
+            if not ret:
+                continue
+            
+            logger.info(f"Extracted frame at {int(representative / fps)}s (shot representative)")
+            yield representative / fps, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
     
     def get_video_metadata(self, video_path):
         
@@ -89,14 +213,25 @@ class VideoProcessor:
             logger.error(f"Cannot open video for metadata: {video_path}")
             return {}
         
+        metadata = self._read_metadata(cap)
+        cap.release()
+        
+        return metadata
+    
+    def _read_metadata(self, cap):
+        
         fps = cap.get(cv2.CAP_PROP_FPS)
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        
+        # Certains conteneurs (webm, flux) renvoient 0, NaN ou des valeurs négatives
+        if not np.isfinite(fps) or fps <= 0 or fps > 1000:
+            logger.warning(f"Unreported or invalid FPS ({fps})")
+            fps = 0
+        total_frames = max(0, total_frames)
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         duration = total_frames / fps if fps > 0 else 0
         
-        cap.release()
-        
         metadata = {
             'duration': int(duration),
             'fps': fps,
@@ -1,54 +1,182 @@
 from PIL import Image
 import torch
-from transformers import BlipProcessor, BlipForConditionalGeneration
 import numpy as np
-from typing import List
+from typing import List, Optional, Tuple
+import io
 import logging
+import os
+
+from .caption_cache import fingerprint
+from .frame_encoding import EncodedFrame
+from .model_registry import get_model_registry
 
 logger = logging.getLogger(__name__)
 
+BLIP_MODEL_NAME = "Salesforce/blip-image-captioning-base"
+# À incrémenter si les paramètres de génération changent: invalide le cache
+CAPTION_PROMPT_VERSION = "caption-v1"
+
+
+def default_num_threads() -> int:
+    """Cœurs réellement disponibles pour le processus (cgroups / affinité)"""
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:
+        return max(1, os.cpu_count() or 1)
+
 
 class VisionCaptioner:
+    """Backend local de description des frames (BLIP, hors-ligne).
     
+    Les frames sont décrites par lots de batch_size: un seul appel au
+    processor et à generate par lot, sous torch.inference_mode. Expose
+    extract_image_content / extract_frames_content comme ImageAnalyzer pour
+    être utilisé par FrameCaptioner.
     
-    def __init__(self):
-        logger.info("Loading BLIP model...")
-        self.processor = BlipProcessor.from_pretrained(
-            "Salesforce/blip-image-captioning-base"
-        )
-        self.model = BlipForConditionalGeneration.from_pretrained(
-            "Salesforce/blip-image-captioning-base"
-        )
-        
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model.to(self.device)
-        logger.info(f"BLIP model loaded on {self.device}")
+    precision='int8' ou 'bf16' et un max_length réduit accélèrent
+    l'inférence CPU au prix de descriptions moins fidèles
+    (benchmarks/bench_blip_inference.py).
+    """
     
-    def caption_frame(self, frame: np.ndarray) -> str:
+    def __init__(self, cache=None, model_name=BLIP_MODEL_NAME, batch_size=8,
+                 num_threads=None, max_length=50, precision='fp32'):
+        self.model_name = model_name
+        # Poids partagés par tout le processus (analyzer.services.model_registry)
+        loaded = get_model_registry().get(model_name, precision)
+        self.processor = loaded.processor
+        self.model = loaded.model
+        self.device = loaded.device
+        # Précision effective (int8 retombe en fp32 hors CPU)
+        self.precision = loaded.precision
+        # CaptionCache optionnel (analyzer.services.caption_cache)
+        self.cache = cache
+        self.batch_size = max(1, batch_size)
+        self.max_length = max_length
         
+        if self.device == "cpu":
+            # Réglage global au processus: un thread intra-op par cœur disponible
+            torch.set_num_threads(num_threads or default_num_threads())
+        
+        logger.info(f"VisionCaptioner ready on {self.device} "
+                    f"(precision={self.precision}, max_length={max_length}, "
+                    f"batch_size={self.batch_size}, threads={torch.get_num_threads()})")
+    
+    def caption_frame(self, frame: np.ndarray) -> Optional[str]:
+        """Description de la frame, None en cas d'échec (à écarter, comme FrameCaptioner)"""
         try:
-            
-            image = Image.fromarray(frame.astype('uint8'), 'RGB')
-            
-            inputs = self.processor(images=image, return_tensors="pt").to(self.device)
-            out = self.model.generate(**inputs, max_length=50)
-            caption = self.processor.decode(out[0], skip_special_tokens=True)
-            
-            logger.info(f"Generated caption: {caption}")
-            return caption
-            
+            return self.caption_batch([frame])[0]
+        
         except Exception as e:
             logger.error(f"Error generating caption: {str(e)}")
-            return "Unable to generate caption"
+            return None
+    
+    def caption_batch(self, frames: list) -> List[str]:
+        """Une description par frame; seules les frames absentes du cache passent par le modèle"""
+        images = [self.to_image(frame) for frame in frames]
+        captions: List[Optional[str]] = [None] * len(images)
+        fingerprints = [None] * len(images)
+        
+        if self.cache is not None:
+            namespace = self.cache_namespace()
+            for i, image in enumerate(images):
+                fingerprints[i] = getattr(frames[i], 'fingerprint', None) or fingerprint(image)
+                captions[i] = self.cache.get(namespace, fingerprints[i])
+        
+        missing = [i for i, caption in enumerate(captions) if caption is None]
+        for start in range(0, len(missing), self.batch_size):
+            chunk = missing[start:start + self.batch_size]
+            generated = self._generate([images[i] for i in chunk])
+            
+            for i, caption in zip(chunk, generated):
+                captions[i] = caption
+                if fingerprints[i] is not None:
+                    self.cache.put(self.cache_namespace(), fingerprints[i], caption)
+        
+        if missing:
+            logger.info(f"Generated {len(missing)} caption(s), {len(images) - len(missing)} from cache")
+        return captions
     
-    def caption_frames(self, frames: List[np.ndarray]) -> List[dict]:
+    def caption_batch_scored(self, frames: list) -> List[Tuple[str, float]]:
+        """(description, confiance) par frame, sans cache.
         
-        captions = []
-        for idx, frame in enumerate(frames):
-            caption = self.caption_frame(frame)
-            captions.append({
+        La confiance est la probabilité moyenne (géométrique) des tokens
+        générés, entre 0 et 1.
+        """
+        images = [self.to_image(frame) for frame in frames]
+        results = []
+        for start in range(0, len(images), self.batch_size):
+            results.extend(self._generate(images[start:start + self.batch_size], with_scores=True))
+        return results
+    
+    def _generate(self, images: List[Image.Image], with_scores=False) -> list:
+        
+        with torch.inference_mode():
+            inputs = self.processor(images=images, return_tensors="pt").to(self.device)
+            if self.precision == 'bf16':
+                inputs['pixel_values'] = inputs['pixel_values'].to(torch.bfloat16)
+            # Décodage glouton: pas de beam search ni d'échantillonnage
+            out = self.model.generate(
+                **inputs, max_length=self.max_length, num_beams=1, do_sample=False,
+                output_scores=with_scores, return_dict_in_generate=with_scores,
+            )
+            if not with_scores:
+                return self.processor.batch_decode(out, skip_special_tokens=True)
+            
+            log_probs = self.model.text_decoder.compute_transition_scores(
+                out.sequences, out.scores, normalize_logits=True
+            ).float()
+            # Ignorer le padding des séquences terminées avant les autres
+            generated = out.sequences[:, -log_probs.shape[1]:]
+            mask = generated != self.model.config.text_config.pad_token_id
+            mean_log_probs = log_probs.masked_fill(~mask, 0).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+            confidences = mean_log_probs.exp().tolist()
+        
+        captions = self.processor.batch_decode(out.sequences, skip_special_tokens=True)
+        return list(zip(captions, confidences))
+    
+    @staticmethod
+    def to_image(frame) -> Image.Image:
+        """Frame (tableau RGB, octets encodés, EncodedFrame ou PIL) en image PIL RGB"""
+        if isinstance(frame, EncodedFrame):
+            return Image.open(io.BytesIO(frame.data)).convert('RGB')
+        if isinstance(frame, bytes):
+            return Image.open(io.BytesIO(frame)).convert('RGB')
+        if isinstance(frame, Image.Image):
+            return frame.convert('RGB')
+        return Image.fromarray(frame.astype('uint8'), 'RGB')
+    
+    def cache_namespace(self) -> str:
+        """Espace de noms des descriptions dans le CaptionCache"""
+        # Les descriptions dépendent de la précision et de la longueur maximale
+        return f"{self.model_name}:{self.precision}:{self.max_length}:{CAPTION_PROMPT_VERSION}"
+    
+    def caption_frames(self, frames: List[np.ndarray], timestamps: Optional[List[float]] = None) -> List[dict]:
+        
+        if timestamps is None:
+            timestamps = [None] * len(frames)
+        
+        captions = self.caption_batch(frames)
+        return [
+            {
                 'frame_index': idx,
-                'timestamp': f"{idx * 5}s",  
+                'timestamp': timestamp,
                 'caption': caption
-            })
-        return captions
\ No newline at end of file
+            }
+            for idx, (timestamp, caption) in enumerate(zip(timestamps, captions))
+        ]
+    
+    # Interface ImageAnalyzer (FrameCaptioner)
+    
+    def extract_image_content(self, image_data, raise_errors=False):
+        
+        try:
+            return self.caption_batch([image_data])[0]
+        except Exception as e:
+            if raise_errors:
+                raise
+            logger.error(f"Error generating caption: {str(e)}")
+            return None
+    
+    def extract_frames_content(self, frames, timestamps=None):
+        
+        return self.caption_batch(frames)
@@ -1,3 +1,855 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import xxhash
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+os.environ.setdefault('GOOGLE_API_KEY', 'test')
+
+from . import views  # noqa: E402
+from .uploads import DigestUploadHandler, SpooledUploadedFile, SpooledUploadHandler, file_digest  # noqa: E402
+from .services.chat_store import ChatStore  # noqa: E402
+from .services.chatbot_orchestrator import BatchResponseError, ImageAnalyzer, MultimodalChatbot, StreamCleaner  # noqa: E402
+from .services.fake_gemini import FakeGenerativeModel, FakeResponse  # noqa: E402
+from .models import AnalysisJob  # noqa: E402
+from .services.frame_captioning import FrameCaptioner  # noqa: E402
+from .services.jobs import JOB_FAILED_ERROR, JobRunner  # noqa: E402
+from .services.media_cache import MediaResultCache  # noqa: E402
+from .services.model_client import ConcurrencyLimiter, PooledModel  # noqa: E402
+from .services.resilience import (  # noqa: E402
+    CircuitBreaker, CircuitOpenError, HedgePolicy, ModelRefusalError, ModelUnavailableError,
+)
+from .services.response_cache import ResponseCache  # noqa: E402
+from .services.session_registry import SessionRegistry  # noqa: E402
+from .services.single_flight import SingleFlight  # noqa: E402
+
+
+def make_chatbot(session_id, reply, model_options=None, **options):
+    """Chatbot hors-ligne: chaque appel au modèle factice répond reply"""
+    chatbot = MultimodalChatbot(session_id, **options)
+    chatbot.model = FakeGenerativeModel(responder=lambda contents, **kwargs: reply, **(model_options or {}))
+    return chatbot
+
+
+class ResponseCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = ResponseCache()
+
+    def converse(self, chatbot, messages):
+        return [chatbot.chat_text_only(message) for message in messages]
+
+    def test_first_message_served_from_cache(self):
+        first = make_chatbot('a', "Réponse A", response_cache=self.cache)
+        first.chat_text_only("Tu connais Python ?")
+
+        second = make_chatbot('b', "Réponse B", response_cache=self.cache)
+        self.assertEqual(second.chat_text_only("tu connais python"), "Réponse A")
+        self.assertEqual(second.model.calls, 0)
+
+    def test_same_follow_up_on_other_topic_misses(self):
+        first = make_chatbot('a', "Réponse A", response_cache=self.cache)
+        self.converse(first, ["Parle-moi de Paris", "Combien d'habitants ?", "Et en 1900 ?"])
+
+        second = make_chatbot('b', "Réponse B", response_cache=self.cache)
+        answers = self.converse(second, ["Parle-moi de Lyon", "Combien d'habitants ?", "Et en 1900 ?"])
+
+        self.assertEqual(answers, ["Réponse B"] * 3)
+        self.assertEqual(second.model.calls, 3)
+
+    def test_previous_reply_is_part_of_key(self):
+        first = make_chatbot('a', "Réponse A", response_cache=self.cache)
+        self.converse(first, ["Bonjour", "Et ensuite ?"])
+
+        # Même question d'ouverture, réponse différente (cache contourné)
+        second = make_chatbot('b', "Réponse B", response_cache=self.cache)
+        second.chat_text_only("Bonjour", use_cache=False)
+        self.assertEqual(second.chat_text_only("Et ensuite ?"), "Réponse B")
+        self.assertEqual(second.model.calls, 2)
+
+    def test_identical_conversation_served_from_cache(self):
+        first = make_chatbot('a', "Réponse", response_cache=self.cache)
+        self.converse(first, ["Bonjour", "Et ensuite ?"])
+
+        second = make_chatbot('b', "Réponse", response_cache=self.cache)
+        self.converse(second, ["Bonjour", "Et ensuite ?"])
+        self.assertEqual(second.model.calls, 0)
+
+    def test_served_again_after_clear(self):
+        first = make_chatbot('a', "Réponse A", response_cache=self.cache)
+        first.chat_text_only("Bonjour")
+
+        second = make_chatbot('b', "Réponse B", response_cache=self.cache)
+        second.chat_text_only("Parle-moi de Lyon")
+        second.clear_history()
+        self.assertEqual(second.chat_text_only("Bonjour"), "Réponse A")
+        self.assertEqual(second.model.calls, 1)
+
+    def test_bypass(self):
+        first = make_chatbot('a', "Réponse A", response_cache=self.cache)
+        first.chat_text_only("Bonjour")
+
+        second = make_chatbot('b', "Réponse B", response_cache=self.cache)
+        self.assertEqual(second.chat_text_only("Bonjour", use_cache=False), "Réponse B")
+
+
+class SessionRegistryTests(TestCase):
+    """Deux registres sur la même base: deux workers qui servent la même session"""
+
+    def setUp(self):
+        # Écritures déclenchées explicitement par flush()
+        self.store = ChatStore(flush_interval=3600)
+        self.addCleanup(self.store.flush)
+        factory = partial(make_chatbot, reply="Réponse", store=self.store)
+        self.first = SessionRegistry(factory=factory)
+        self.second = SessionRegistry(factory=factory)
+
+    def contents(self, chatbot):
+        return [message["content"] for message in chatbot.memory.messages]
+
+    def test_turn_handled_by_other_worker(self):
+        self.first.get('s').chat_text_only("un")
+        self.store.flush()
+        self.second.get('s').chat_text_only("deux")
+        self.store.flush()
+
+        self.assertEqual(self.contents(self.first.get('s')), ["un", "Réponse", "deux", "Réponse"])
+
+    def test_clear_by_other_worker(self):
+        chatbot = self.first.get('s')
+        chatbot.chat_text_only("un")
+        chatbot.chat_with_video("vidéo ?", ["un chat"], {'duration': 5}, [0.0], 'digest')
+        self.store.flush()
+
+        self.second.get('s').clear_history()
+
+        chatbot = self.first.get('s')
+        self.assertEqual(self.contents(chatbot), [])
+        self.assertIsNone(chatbot.media.latest_video())
+
+    def test_own_turns_not_reloaded(self):
+        chatbot = self.first.get('s')
+        chatbot.chat_text_only("un")
+        self.store.flush()
+
+        self.assertIs(self.first.get('s'), chatbot)
+        self.assertEqual(self.contents(chatbot), ["un", "Réponse"])
+
+    def video_turn(self, media_cache):
+        media_cache.put('video', 'digest', {'captions': ["un chat", "un chien"], 'timestamps': [0.0, 2.0],
+                                            'metadata': {'duration': 4}})
+        self.first.get('s').chat_with_video("vidéo ?", ["un chat", "un chien"], {'duration': 4}, [0.0, 2.0], 'digest')
+        self.store.flush()
+
+    def test_video_timeline_rebuilt_from_media_cache(self):
+        media_cache = MediaResultCache()
+        with mock.patch('analyzer.services.session_registry.get_media_cache', return_value=media_cache):
+            self.video_turn(media_cache)
+            video = self.second.get('s').media.latest_video()
+
+            # Session évincée puis recréée dans le même worker
+            self.first.discard('s')
+            evicted = self.first.get('s').media.latest_video()
+
+        for artifact in (video, evicted):
+            self.assertEqual(artifact.digest, 'digest')
+            self.assertEqual(artifact.captions, ["un chat", "un chien"])
+            self.assertEqual(artifact.timestamps, [0.0, 2.0])
+
+    def test_video_timeline_lost_without_media_cache(self):
+        # Vidéo décrite par un autre worker: absente du cache des médias de celui-ci
+        with mock.patch('analyzer.services.session_registry.get_media_cache', return_value=MediaResultCache()):
+            self.video_turn(MediaResultCache())
+            chatbot = self.second.get('s')
+
+            self.assertIsNone(chatbot.media.latest_video())
+            self.assertEqual(chatbot.chat_text_only("et ensuite ?"), "Réponse")
+
+
+class StreamCleanerTests(SimpleTestCase):
+
+    def clean(self, chunks):
+        cleaner = StreamCleaner(prefix_window=32)
+        return [cleaner.feed(chunk) for chunk in chunks], cleaner.finish()
+
+    def test_prefix_held_back_until_window(self):
+        emitted, rest = self.clean(["Sure! ", "Voici la ", "réponse", " demandée, en détail", " et la suite"])
+
+        # Rien avant 32 caractères: la formule d'introduction peut encore être retirée
+        self.assertEqual(emitted[:3], ['', '', ''])
+        self.assertEqual(emitted[3], "Voici la réponse demandée, en détail")
+        self.assertEqual(''.join(emitted) + rest, "Voici la réponse demandée, en détail et la suite")
+
+    def test_short_response_released_by_finish(self):
+        emitted, rest = self.clean(["Bien sûr, ", "oui."])
+
+        self.assertEqual(emitted, ['', ''])
+        self.assertEqual(rest, "oui.")
+
+    def test_newlines_collapsed_across_chunks(self):
+        emitted, rest = self.clean(["x" * 32 + "\n", "\n", "\n\nSuite\n\n", "\n"])
+
+        self.assertEqual(''.join(emitted) + rest, "x" * 32 + "\n\nSuite")
+
+    def test_matches_clean_response(self):
+        chatbot = make_chatbot('s', "Réponse")
+        samples = [
+            "Okay, Here's   ma réponse\n\n\n\n sur plusieurs lignes.\n\n\n Fin   \n\n",
+            "  \n\n\n\nD'accord, bien",
+            "Of course.   Here is " + "x" * 100 + "\n\n\n\ny  ",
+            "Certainly" * 20,
+            "Bonjour",
+            "",
+        ]
+        for text in samples:
+            for size in (1, 3, 7, 40):
+                with self.subTest(text=text[:20], size=size):
+                    emitted, rest = self.clean([text[i:i + size] for i in range(0, len(text), size)])
+                    self.assertEqual(''.join(emitted) + rest, chatbot._clean_response(text))
+
+
+class SendMessageStreamTests(TestCase):
+
+    async def post(self, reply, **model_options):
+        store = ChatStore(flush_interval=3600)
+        self.addCleanup(store.flush)
+        registry = SessionRegistry(factory=partial(
+            make_chatbot, reply=reply, model_options={'chunk_chars': 5, **model_options},
+            store=store, response_cache=ResponseCache(),
+        ))
+        with mock.patch.object(views, 'get_session_registry', return_value=registry):
+            response = await self.async_client.post('/send-stream/', {'message': 'Bonjour'})
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            return self.events(b''.join([part async for part in response.streaming_content]).decode())
+
+    @staticmethod
+    def events(body):
+        """(événement, données) de chaque message SSE"""
+        events = []
+        for message in body.strip().split('\n\n'):
+            fields = dict(line.split(': ', 1) for line in message.splitlines())
+            events.append((fields.get('event', 'message'), json.loads(fields['data'])))
+        return events
+
+    async def test_deltas_then_done(self):
+        events = await self.post("D'accord, voici une réponse envoyée en plusieurs morceaux.")
+
+        self.assertEqual([name for name, _ in events[:-1]], ['message'] * (len(events) - 1))
+        self.assertGreater(len(events), 2)
+        name, done = events[-1]
+        self.assertEqual(name, 'done')
+        self.assertEqual(done['response'], "voici une réponse envoyée en plusieurs morceaux.")
+        self.assertEqual(''.join(data['delta'] for _, data in events[:-1]), done['response'])
+
+    async def test_model_unavailable(self):
+        events = await self.post("Réponse", failure_rate=1.0)
+
+        self.assertEqual(events, [('error', {'error': views.MODEL_UNAVAILABLE_ERROR, 'retry_after': None})])
+
+    async def test_empty_response(self):
+        events = await self.post("")
+
+        self.assertEqual(events, [('error', {'error': views.MODEL_REFUSAL_ERROR})])
+
+
+class VideoFollowupTests(SimpleTestCase):
+
+    def setUp(self):
+        self.prompts = []
+        self.chatbot = make_chatbot('s', "Réponse", media_options={'timeline_tokens': 120})
+        self.chatbot.model.responder = lambda contents, **kwargs: self.prompts.append(contents) or "Réponse"
+        captions = [f"Une route de campagne sous la pluie, plan {i}" for i in range(60)]
+        captions[42] = "Un chien roux traverse la route devant la voiture"
+        self.chatbot.chat_with_video("Décris", captions, {'duration': 60}, [float(i) for i in range(60)], 'digest')
+
+    def timeline(self):
+        prompt = self.prompts[-1]
+        return [line for line in prompt.splitlines() if line.startswith('[')]
+
+    def test_timeline_trimmed_to_budget(self):
+        self.chatbot.chat_text_only("Que se passe-t-il ensuite ?")
+
+        lines = self.timeline()
+        self.assertLess(len(lines), 60)
+        self.assertIn("[...]", lines)
+        self.assertLessEqual(sum(len(line) for line in lines if line != "[...]"), 120 * 4)
+        # Frames réparties depuis le début de la vidéo
+        self.assertTrue(lines[0].startswith("[00:00]"))
+
+    def test_frames_matching_question_kept(self):
+        self.chatbot.chat_text_only("Quand voit-on le chien ?")
+
+        self.assertIn("[00:42] Un chien roux traverse la route devant la voiture", self.timeline())
+
+
+class FakeFrameAnalyzer:
+    """Interface ImageAnalyzer; les frames sont des entiers, décrits 'cap N'"""
+
+    def __init__(self, delay=lambda frame: 0, failures=0, error=ConnectionError):
+        self.delay = delay
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def extract_image_content(self, frame, raise_errors=False):
+        with self._lock:
+            self.calls += 1
+            fail = self.calls <= self.failures
+        time.sleep(self.delay(frame))
+        if fail:
+            raise self.error("échec transitoire")
+        return f"cap {frame}"
+
+    def extract_frames_content(self, frames, timestamps=None):
+        with self._lock:
+            self.batches.append(list(frames))
+        return [self.extract_image_content(frame) for frame in frames]
+
+
+class FrameCaptionerTests(SimpleTestCase):
+
+    def test_order_kept_when_calls_finish_out_of_order(self):
+        # Les premières frames répondent en dernier
+        analyzer = FakeFrameAnalyzer(delay=lambda frame: (8 - frame) * 0.005)
+        captioner = FrameCaptioner(analyzer, max_in_flight=8)
+
+        self.assertEqual(captioner.caption_frames(list(range(8))), [f"cap {i}" for i in range(8)])
+
+        timestamps, captions = captioner.caption_stream((float(i), i) for i in range(8))
+        self.assertEqual(timestamps, [float(i) for i in range(8)])
+        self.assertEqual(captions, [f"cap {i}" for i in range(8)])
+
+    def test_transient_errors_retried(self):
+        analyzer = FakeFrameAnalyzer(failures=2)
+        captioner = FrameCaptioner(analyzer, max_retries=2, retry_backoff=0)
+
+        self.assertEqual(captioner.caption_frames([1]), ["cap 1"])
+        self.assertEqual(analyzer.calls, 3)
+
+    def test_frame_dropped_after_max_retries(self):
+        analyzer = FakeFrameAnalyzer(failures=100)
+        captioner = FrameCaptioner(analyzer, max_retries=2, retry_backoff=0)
+
+        self.assertEqual(captioner.caption_frames([1, 2]), [None, None])
+        self.assertEqual(analyzer.calls, 6)
+
+    def test_other_errors_not_retried(self):
+        analyzer = FakeFrameAnalyzer(failures=100, error=ValueError)
+        captioner = FrameCaptioner(analyzer, max_retries=2, retry_backoff=0)
+
+        self.assertEqual(captioner.caption_frames([1]), [None])
+        self.assertEqual(analyzer.calls, 1)
+
+    def test_stream_batch_larger_than_buffer(self):
+        analyzer = FakeFrameAnalyzer()
+        captioner = FrameCaptioner(analyzer, max_in_flight=1, batch_size=4)
+        result = []
+
+        worker = threading.Thread(target=lambda: result.append(
+            captioner.caption_stream(((float(i), i) for i in range(10)), max_buffered=2)
+        ))
+        worker.start()
+        worker.join(timeout=5)
+
+        self.assertFalse(worker.is_alive(), "caption_stream bloqué")
+        self.assertEqual(result[0][1], [f"cap {i}" for i in range(10)])
+        self.assertEqual([len(batch) for batch in analyzer.batches], [4, 4, 2])
+
+
+class BatchExtractionTests(SimpleTestCase):
+    """Réponse groupée (JSON) de l'ImageAnalyzer et repli frame par frame"""
+
+    def caption(self, batch_reply, count=3):
+        def responder(contents, generation_config=None, **kwargs):
+            if (generation_config or {}).get('response_mime_type') == 'application/json':
+                return batch_reply
+            return "Description seule"
+
+        model = FakeGenerativeModel(responder=responder)
+        captioner = FrameCaptioner(ImageAnalyzer(model=model), batch_size=count, retry_backoff=0)
+        frames = [np.full((8, 8, 3), 40 * i, dtype=np.uint8) for i in range(count)]
+        return captioner.caption_frames(frames), model.calls
+
+    def batch(self, *numbers):
+        return json.dumps([{"frame": number, "content": f"Frame {number}"} for number in numbers])
+
+    def test_valid_response_in_any_order(self):
+        self.assertEqual(self.caption(self.batch(3, 1, 2)), (["Frame 1", "Frame 2", "Frame 3"], 1))
+
+    def test_json_code_block_accepted(self):
+        self.assertEqual(self.caption(f"```json\n{self.batch(1, 2, 3)}\n```")[1], 1)
+
+    def test_fallback_one_call_per_frame(self):
+        replies = {
+            'malformed': "Voici les descriptions: [",
+            'wrong_count': self.batch(1, 2),
+            'missing_index': self.batch(1, 1, 3),
+            'out_of_range': self.batch(1, 2, 4),
+            'no_content': json.dumps([{"frame": 1}, {"frame": 2}, {"frame": 3}]),
+        }
+        for case, reply in replies.items():
+            with self.subTest(case):
+                captions, calls = self.caption(reply)
+                self.assertEqual(captions, ["Description seule"] * 3)
+                self.assertEqual(calls, 1 + 3)
+
+    def test_parser_errors(self):
+        for text in ("pas du json", self.batch(1, 2), self.batch(2, 2, 3), '{"frames": 3}'):
+            with self.subTest(text):
+                with self.assertRaises(BatchResponseError):
+                    ImageAnalyzer._parse_batch_response(text, 3)
+
+
+@override_settings(UPLOAD_SPOOL_THRESHOLD=4096, UPLOAD_MAX_REQUEST_SIZE=64 * 1024)
+class UploadTests(TestCase):
+
+    def upload(self, data, name='photo.jpg'):
+        """request.FILES d'un POST multipart, parsé par FILE_UPLOAD_HANDLERS"""
+        request = RequestFactory().post('/send/', {'images': SimpleUploadedFile(name, data, 'image/jpeg')})
+        return request, request.FILES['images']
+
+    def test_oversized_upload_rejected(self):
+        response = self.client.post('/send/', {
+            'message': 'Regarde',
+            'images': SimpleUploadedFile('grande.jpg', b'x' * (65 * 1024), 'image/jpeg'),
+        })
+
+        self.assertEqual(response.status_code, 413)
+
+    def test_small_file_stays_in_memory(self):
+        _, uploaded = self.upload(b'a' * 1000)
+
+        self.assertIsInstance(uploaded, SpooledUploadedFile)
+        self.assertFalse(uploaded.on_disk)
+        self.assertEqual(uploaded.read(), b'a' * 1000)
+
+    def test_large_file_spilled_to_disk(self):
+        data = os.urandom(20 * 1024)
+        _, uploaded = self.upload(data)
+
+        self.assertTrue(uploaded.on_disk)
+        with open(uploaded.temporary_file_path(), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_digest_independent_of_chunking(self):
+        data = os.urandom(20 * 1024)
+        whole = xxhash.xxh3_128_hexdigest(data)
+
+        request, uploaded = self.upload(data)
+        self.assertEqual(request.upload_digests['images'], [whole])
+        self.assertEqual(file_digest(uploaded), whole)
+
+        # Morceaux de 1000 octets, sans rapport avec les bornes de la requête
+        with mock.patch.object(DigestUploadHandler, 'chunk_size', 1000), \
+                mock.patch.object(SpooledUploadHandler, 'chunk_size', 1000):
+            request, uploaded = self.upload(data)
+        self.assertEqual(request.upload_digests['images'], [whole])
+        self.assertEqual(file_digest(uploaded), whole)
+
+
+class ConcurrencyLimiterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.limiter = ConcurrencyLimiter(3)
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def hold(self):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def leave(self):
+        with self.lock:
+            self.active -= 1
+
+    def sync_caller(self, rounds):
+        for _ in range(rounds):
+            self.limiter.acquire()
+            self.hold()
+            time.sleep(0.001)
+            self.leave()
+            self.limiter.release()
+
+    async def async_caller(self, rounds):
+        for _ in range(rounds):
+            await self.limiter.acquire_async()
+            self.hold()
+            await asyncio.sleep(0.001)
+            self.leave()
+            self.limiter.release()
+
+    def test_mixed_callers_within_limit(self):
+        async def coroutines():
+            await asyncio.gather(*[self.async_caller(20) for _ in range(6)])
+
+        workers = [threading.Thread(target=self.sync_caller, args=(20,)) for _ in range(4)]
+        # Deux boucles d'événements, chacune dans son thread
+        workers += [threading.Thread(target=asyncio.run, args=(coroutines(),)) for _ in range(2)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(timeout=30)
+
+        self.assertFalse(any(worker.is_alive() for worker in workers))
+        self.assertEqual(self.peak, 3)
+        self.assertEqual(self.limiter.max_in_use, 3)
+        self.assertEqual(self.limiter.in_use, 0)
+
+    def test_cancelled_waiter_does_not_leak_slot(self):
+        async def scenario():
+            for _ in range(3):
+                await self.limiter.acquire_async()
+
+            waiter = asyncio.ensure_future(self.limiter.acquire_async())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+
+            # Créneau rendu puis attente annulée après le réveil: le créneau passe au suivant
+            late = asyncio.ensure_future(self.limiter.acquire_async())
+            next_waiter = asyncio.ensure_future(self.limiter.acquire_async())
+            await asyncio.sleep(0)
+            self.limiter.release()
+            late.cancel()
+            await asyncio.wait_for(next_waiter, 1)
+            self.assertTrue(late.cancelled())
+
+            for _ in range(3):
+                self.limiter.release()
+
+        asyncio.run(scenario())
+        self.assertEqual(self.limiter.in_use, 0)
+        self.assertTrue(self.limiter.try_acquire())
+
+    def test_release_wakes_async_waiter_from_thread(self):
+        self.limiter = ConcurrencyLimiter(1)
+        self.limiter.acquire()
+
+        async def wait():
+            start = time.perf_counter()
+            await self.limiter.acquire_async()
+            return time.perf_counter() - start
+
+        threading.Timer(0.05, self.limiter.release).start()
+        waited = asyncio.run(asyncio.wait_for(wait(), 1))
+        self.assertLess(waited, 0.5)
+        self.assertEqual(self.limiter.in_use, 1)
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.calls = 0
+        self.started = threading.Event()
+
+    def slow(self, result='sync', error=None):
+        self.calls += 1
+        self.started.set()
+        time.sleep(0.1)
+        if error is not None:
+            raise error
+        return result
+
+    async def aslow(self, result='async', error=None):
+        self.calls += 1
+        self.started.set()
+        await asyncio.sleep(0.1)
+        if error is not None:
+            raise error
+        return result
+
+    def in_thread(self, fn):
+        """Lance fn dans un thread; retourne (thread, [résultat ou exception])"""
+        outcome = []
+
+        def run():
+            try:
+                outcome.append(fn())
+            except Exception as e:
+                outcome.append(e)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread, outcome
+
+    def test_async_callers_join_sync_leader(self):
+        thread, outcome = self.in_thread(lambda: self.flight.do('k', self.slow))
+        self.started.wait(1)
+
+        async def followers():
+            return await asyncio.gather(self.flight.ado('k', self.aslow), self.flight.ado('k', self.aslow))
+
+        self.assertEqual(asyncio.run(followers()), ['sync', 'sync'])
+        thread.join()
+        self.assertEqual(outcome, ['sync'])
+        self.assertEqual(self.calls, 1)
+
+    def test_sync_caller_joins_async_leader(self):
+        async def leader():
+            task = asyncio.ensure_future(self.flight.ado('k', self.aslow))
+            await asyncio.sleep(0.02)
+            thread, outcome = self.in_thread(lambda: self.flight.do('k', self.slow))
+            result = await task
+            await asyncio.to_thread(thread.join)
+            return result, outcome
+
+        self.assertEqual(asyncio.run(leader()), ('async', ['async']))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.flight.stats(), {'leaders': 1, 'coalesced': 1, 'in_flight': 0})
+
+    def test_error_reaches_every_waiter(self):
+        error = KeyError('boom')
+        thread, outcome = self.in_thread(lambda: self.flight.do('k', lambda: self.slow(error=error)))
+        self.started.wait(1)
+        others = [self.in_thread(lambda: self.flight.do('k', self.slow)) for _ in range(2)]
+
+        async def follower():
+            with self.assertRaises(KeyError):
+                await self.flight.ado('k', self.aslow)
+
+        asyncio.run(follower())
+        for other, _ in [(thread, outcome)] + others:
+            other.join()
+        self.assertEqual([result for _, results in others for result in results] + outcome, [error] * 3)
+        self.assertEqual(self.calls, 1)
+
+    def test_async_error_reaches_every_waiter(self):
+        async def callers():
+            return await asyncio.gather(
+                *[self.flight.ado('k', lambda: self.aslow(error=ValueError('x'))) for _ in range(3)],
+                return_exceptions=True,
+            )
+
+        results = asyncio.run(callers())
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertEqual(self.calls, 1)
+
+    def test_cancelled_follower_leaves_leader_running(self):
+        async def scenario():
+            leader = asyncio.ensure_future(self.flight.ado('k', self.aslow))
+            await asyncio.sleep(0.01)
+            follower = asyncio.ensure_future(self.flight.ado('k', self.aslow))
+            await asyncio.sleep(0.01)
+            follower.cancel()
+            return await leader
+
+        self.assertEqual(asyncio.run(scenario()), 'async')
+
+    def test_leader_task_referenced_until_done(self):
+        async def scenario():
+            task = asyncio.ensure_future(self.flight.ado('k', self.aslow))
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(self.flight._tasks), 1)
+            await task
+            self.assertEqual(len(self.flight._tasks), 0)
+
+        asyncio.run(scenario())
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker('m', failure_threshold=2, reset_timeout=30, clock=self.clock)
+
+    def fail(self):
+        self.breaker.before_call()
+        self.breaker.record(ConnectionError("réseau"))
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        self.clock.now += 10
+        with self.assertRaises(CircuitOpenError) as raised:
+            self.breaker.before_call()
+        self.assertEqual(raised.exception.retry_after, 20)
+        self.assertEqual(self.breaker.stats()['rejected'], 1)
+
+    def test_success_resets_failure_count(self):
+        self.fail()
+        self.breaker.before_call()
+        self.breaker.record()
+        self.fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_non_transient_errors_do_not_count(self):
+        for _ in range(3):
+            self.breaker.before_call()
+            self.breaker.record(ValueError("requête invalide"))
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_probe_closes(self):
+        self.fail()
+        self.fail()
+        self.clock.now += 30
+
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        # Un seul appel d'essai à la fois
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+        self.breaker.record()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.before_call()
+
+    def test_half_open_probe_failure_reopens(self):
+        self.fail()
+        self.fail()
+        self.clock.now += 30
+
+        self.fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.stats()['opened'], 2)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+        # Nouveau délai compté depuis l'échec de l'essai
+        self.clock.now += 30
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+
+    def test_released_probe_allows_next(self):
+        self.fail()
+        self.fail()
+        self.clock.now += 30
+
+        self.breaker.before_call()
+        self.breaker.release()
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+
+
+class SlowFirstModel:
+    """Le premier essai d'un message "lent" met une seconde; tout le reste répond aussitôt"""
+
+    def __init__(self):
+        self.slow_calls = 0
+        self._lock = threading.Lock()
+
+    def _first_slow(self, contents):
+        if contents != "lent":
+            return False
+        with self._lock:
+            self.slow_calls += 1
+            return self.slow_calls == 1
+
+    def generate_content(self, contents, **kwargs):
+        if self._first_slow(contents):
+            time.sleep(1.0)
+            return FakeResponse("primaire")
+        return FakeResponse("rapide")
+
+    async def generate_content_async(self, contents, **kwargs):
+        if self._first_slow(contents):
+            await asyncio.sleep(1.0)
+            return FakeResponse("primaire")
+        return FakeResponse("rapide")
+
+
+class HedgingTests(SimpleTestCase):
+    """Appel plus lent que le p95 récent doublé, la réponse la plus rapide gagne"""
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.addCleanup(self.executor.shutdown)
+        self.model = PooledModel(
+            SlowFirstModel(), ConcurrencyLimiter(4),
+            hedge=HedgePolicy(min_samples=5, min_delay=0.05, max_ratio=0.5), executor=self.executor,
+        )
+
+    def warm_up(self):
+        for _ in range(5):
+            self.model.generate_content("x")
+
+    def test_no_hedge_before_min_samples(self):
+        self.assertIsNone(self.model._hedge_delay())
+        self.warm_up()
+        self.assertEqual(self.model._hedge_delay(), 0.05)
+
+    def test_slow_call_hedged(self):
+        self.warm_up()
+        start = time.perf_counter()
+
+        self.assertEqual(self.model.generate_content("lent").text, "rapide")
+        self.assertLess(time.perf_counter() - start, 0.8)
+        self.assertEqual((self.model.hedges, self.model.hedge_wins), (1, 1))
+
+    def test_slow_async_call_hedged(self):
+        self.warm_up()
+
+        start = time.perf_counter()
+
+        response = asyncio.run(self.model.generate_content_async("lent"))
+        self.assertEqual(response.text, "rapide")
+        self.assertLess(time.perf_counter() - start, 0.8)
+        self.assertEqual((self.model.hedges, self.model.hedge_wins), (1, 1))
+        # Le perdant annulé rend son créneau
+        self.assertEqual(self.model.limiter.in_use, 0)
+
+    def test_budget(self):
+        policy = HedgePolicy(max_ratio=0.1)
+        self.assertTrue(policy.allows(requests=20, hedges=1))
+        self.assertFalse(policy.allows(requests=20, hedges=2))
+
+
+class JobErrorTests(TransactionTestCase):
+    """Un job en échec ne stocke ni ne montre le texte de l'exception"""
+
+    def run_job(self, error):
+        def fail():
+            raise error
+
+        runner = JobRunner(max_workers=1)
+        job_id = runner.submit('s', fail, describe_error=views.job_error_message)
+        future = runner.future(job_id)
+        # None: job déjà terminé
+        if future is not None:
+            future.result(timeout=5)
+        return AnalysisJob.objects.get(job_id=job_id)
+
+    def test_public_messages(self):
+        cases = [
+            (RuntimeError("no such table: analyzer_secret"), JOB_FAILED_ERROR),
+            (ModelUnavailableError("503 quota projet 1234"), views.MODEL_UNAVAILABLE_ERROR),
+            (ModelRefusalError("finish_reason SAFETY"), views.MODEL_REFUSAL_ERROR),
+        ]
+        for error, message in cases:
+            with self.subTest(error=error):
+                job = self.run_job(error)
+                self.assertEqual((job.status, job.error), ('failed', message))
+
+    def test_job_status_response(self):
+        job = self.run_job(RuntimeError("clé API invalide: AIza..."))
+        session = self.client.session
+        session.save()
+        AnalysisJob.objects.filter(job_id=job.job_id).update(session_id=session.session_key)
+
+        response = self.client.get(f'/jobs/{job.job_id}/')
+        self.assertEqual(response.json(), {'job_id': job.job_id, 'status': 'failed', 'error': JOB_FAILED_ERROR})
@@ -0,0 +1,239 @@
+"""
+Gestion des fichiers envoyés au chatbot.
+
+DigestUploadHandler calcule une empreinte xxhash de chaque fichier pendant
+que Django le reçoit (chunk par chunk), sans relire le fichier ensuite.
+Il doit être placé en tête de FILE_UPLOAD_HANDLERS: il laisse passer les
+données vers les handlers suivants qui construisent l'UploadedFile.
+
+SpooledUploadHandler remplace les handlers mémoire / fichier temporaire de
+Django: chaque fichier reste en mémoire jusqu'à UPLOAD_SPOOL_THRESHOLD
+octets puis bascule sur disque, a toujours un chemin local
+(temporary_file_path) et peut être lu par mmap. Il refuse les requêtes
+dont les fichiers dépassent UPLOAD_MAX_REQUEST_SIZE (UploadTooLarge).
+"""
+import io
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import xxhash
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers, StopUpload
+
+logger = logging.getLogger(__name__)
+
+
+def new_hasher():
+
+    return xxhash.xxh3_128()
+
+
+class DigestUploadHandler(FileUploadHandler):
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+
+        if self.request is not None:
+            self.request.upload_digests = {}
+
+    def new_file(self, *args, **kwargs):
+
+        super().new_file(*args, **kwargs)
+        self._hasher = new_hasher()
+
+    def receive_data_chunk(self, raw_data, start):
+
+        self._hasher.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+
+        if self.request is not None:
+            digests = getattr(self.request, 'upload_digests', None)
+            if digests is None:
+                digests = self.request.upload_digests = {}
+            digests.setdefault(self.field_name, []).append(self._hasher.hexdigest())
+
+        # Laisser le handler suivant construire le fichier
+        return None
+
+
+class UploadTooLarge(Exception):
+    """Fichiers de la requête au-delà de UPLOAD_MAX_REQUEST_SIZE (HTTP 413)"""
+
+
+class SpooledUploadedFile(UploadedFile):
+    """Fichier envoyé en mémoire jusqu'à threshold octets, puis sur disque"""
+
+    def __init__(self, name, content_type, charset, content_type_extra=None, threshold=1024 * 1024, temp_dir=None):
+
+        super().__init__(io.BytesIO(), name, content_type, 0, charset, content_type_extra)
+        self.threshold = threshold
+        self.temp_dir = temp_dir
+
+    @property
+    def on_disk(self):
+
+        return not isinstance(self.file, io.BytesIO)
+
+    def write(self, data):
+
+        if not self.on_disk and self.file.tell() + len(data) > self.threshold:
+            self._spill()
+        self.file.write(data)
+
+    def _spill(self):
+
+        # Même extension que l'original: certains décodeurs vidéo s'y fient
+        suffix = os.path.splitext(self.name or '')[1]
+        disk = tempfile.NamedTemporaryFile(suffix=f".upload{suffix}", dir=self.temp_dir)
+        position = self.file.tell()
+        disk.write(self.file.getbuffer())
+        disk.seek(position)
+        self.file.close()
+        self.file = disk
+
+    def temporary_file_path(self):
+        """Chemin local du fichier (écrit sur disque s'il était en mémoire)"""
+        if not self.on_disk:
+            self._spill()
+        self.file.flush()
+        return self.file.name
+
+    @contextmanager
+    def mapped(self):
+        """Contenu en lecture seule sans copie: tampon mémoire ou mmap du fichier"""
+        if not self.on_disk:
+            with self.file.getbuffer() as buffer:
+                yield buffer
+            return
+
+        self.file.flush()
+        if os.fstat(self.file.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+    def close(self):
+
+        try:
+            return self.file.close()
+        except FileNotFoundError:
+            # Fichier temporaire déjà déplacé ou supprimé
+            pass
+
+
+class SpooledUploadHandler(FileUploadHandler):
+
+    def __init__(self, request=None):
+
+        super().__init__(request)
+        self.threshold = getattr(settings, 'UPLOAD_SPOOL_THRESHOLD', 1024 * 1024)
+        self.max_request_size = getattr(settings, 'UPLOAD_MAX_REQUEST_SIZE', 200 * 1024 * 1024)
+        self.received = 0
+        self.too_large = False
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+
+        # Taille annoncée: refuser avant de lire le moindre fichier
+        self.too_large = content_length > self.max_request_size
+
+    def new_file(self, *args, **kwargs):
+
+        super().new_file(*args, **kwargs)
+        if self.too_large:
+            self._reject()
+        self.file = SpooledUploadedFile(
+            self.file_name, self.content_type, self.charset, self.content_type_extra,
+            threshold=self.threshold, temp_dir=settings.FILE_UPLOAD_TEMP_DIR,
+        )
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+
+        self.received += len(raw_data)
+        if self.received > self.max_request_size:
+            self._reject()
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+
+        self.file.seek(0)
+        self.file.size = file_size
+        return self.file
+
+    def upload_interrupted(self):
+
+        if hasattr(self, 'file'):
+            self.file.close()
+
+    def _reject(self):
+
+        if self.request is not None:
+            self.request.upload_too_large = True
+        logger.warning(f"Upload rejected: more than {self.max_request_size} bytes")
+        raise StopUpload(connection_reset=True)
+
+
+def check_upload_size(request):
+    """Lever UploadTooLarge si le handler a interrompu la réception"""
+    if getattr(request, 'upload_too_large', False):
+        limit = getattr(settings, 'UPLOAD_MAX_REQUEST_SIZE', 200 * 1024 * 1024)
+        raise UploadTooLarge(f"Fichiers trop volumineux (maximum {limit // (1024 * 1024)} Mo par message)")
+
+
+def copy_to_tempfile(uploaded_file):
+    """Copie sur disque d'un fichier envoyé, qui survit à la requête; retourne le chemin.
+
+    Un fichier déjà sur disque est lié (hard link) plutôt que recopié.
+    """
+    suffix = os.path.splitext(uploaded_file.name or '')[1]
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=settings.FILE_UPLOAD_TEMP_DIR)
+    os.close(fd)
+
+    if isinstance(uploaded_file, SpooledUploadedFile) and uploaded_file.on_disk:
+        os.remove(path)
+        try:
+            os.link(uploaded_file.temporary_file_path(), path)
+            return path
+        except OSError:
+            # Autre système de fichiers, ou liens non supportés
+            pass
+
+    with open(path, 'wb') as copy:
+        uploaded_file.seek(0)
+        shutil.copyfileobj(uploaded_file, copy, 1024 * 1024)
+    uploaded_file.seek(0)
+    return path
+
+
+def file_digest(uploaded_file):
+    """Empreinte d'un fichier déjà reçu (mmap si possible, sinon lecture par chunks)"""
+    hasher = new_hasher()
+    if isinstance(uploaded_file, SpooledUploadedFile):
+        with uploaded_file.mapped() as content:
+            hasher.update(content)
+        return hasher.hexdigest()
+
+    for chunk in uploaded_file.chunks():
+        hasher.update(chunk)
+    uploaded_file.seek(0)
+    return hasher.hexdigest()
+
+
+def get_upload_digest(request, field_name, index):
+    """Empreinte du index-ième fichier du champ, calculée à la réception si possible"""
+    files = request.FILES.getlist(field_name)
+    digests = getattr(request, 'upload_digests', {}).get(field_name, [])
+
+    if len(digests) == len(files):
+        return digests[index]
+
+    # Handler absent ou fichier ignoré par le parser: recalcul
+    logger.debug(f"No streamed digest for {field_name}[{index}], hashing file")
+    return file_digest(files[index])
@@ -9,9 +9,13 @@ urlpatterns = [
     
     path('send/', views.send_message, name='send_message'), 
     path('send-message/', views.send_message, name='send_message_alt'), 
+    path('send-async/', views.send_message_async, name='send_message_async'),
+    path('send-stream/', views.send_message_stream, name='send_message_stream'),
+    path('jobs/<str:job_id>/', views.job_status, name='job_status'),
     path('history/', views.get_history, name='get_history'),
     path('clear/', views.clear_history, name='clear_history'),  
     path('clear-history/', views.clear_history, name='clear_history_alt'), 
+    path('stats/', views.service_stats, name='service_stats'),
     
     # Test endpoint (optionnel)
     path('test-chatbot/', views.test_chatbot, name='test_chatbot'),
@@ -1,18 +1,37 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
+from django.urls import reverse
+from asgiref.sync import sync_to_async
+import asyncio
 import json
 import logging
+import os
 from moviepy import VideoFileClip
-from PIL import Image
 from .services.video_processor import VideoProcessor
-from .services.chatbot_orchestrator import ImageAnalyzer
+from .services.chatbot_orchestrator import ImageAnalyzer, model_error
+from .services.frame_captioning import FrameCaptioner
+from .services.frame_encoding import FrameEncoder
+from .services.caption_cache import get_caption_cache
+from .services.media_cache import get_media_cache
+from .services.jobs import JOB_FAILED_ERROR, get_job_runner
+from .services.chat_store import get_chat_store
+from .services.model_client import get_model_client_pool
+from .services.single_flight import get_single_flight
+from .services.response_cache import get_response_cache
+from .services.resilience import ModelRefusalError, ModelUnavailableError
+from .uploads import UploadTooLarge, check_upload_size, copy_to_tempfile, get_upload_digest
+from .models import AnalysisJob
 
 from .services.chatbot_orchestrator import MultimodalChatbot
+from .services.session_registry import get_session_registry
 
 logger = logging.getLogger(__name__)
 
+# Intervalle de relecture d'un job lancé par un autre processus
+JOB_POLL_INTERVAL = 0.5
+
 _video_processor = None
 
 def get_video_processor():
@@ -20,109 +39,532 @@ def get_video_processor():
     global _video_processor
     if _video_processor is None:
         from .services.video_processor import VideoProcessor
-        _video_processor = VideoProcessor(interval=10, max_frames=30)
+        from .services.scene_detection import get_scene_detector
+        _video_processor = VideoProcessor(
+            interval=10,
+            max_frames=30,
+            sampling=settings.VIDEO_SAMPLING,
+            scene_detector=get_scene_detector(settings.VIDEO_SCENE_DETECTOR, settings.VIDEO_SCENE_THRESHOLD),
+        )
         logger.info("📥 VideoProcessor chargé")
     return _video_processor
 
 
-@csrf_exempt
-def send_message(request):
+def get_vision_captioner():
+    
+    from .services.vision_model import VisionCaptioner
+    return VisionCaptioner(
+        cache=get_caption_cache(),
+        model_name=settings.BLIP_MODEL_NAME,
+        batch_size=settings.BLIP_BATCH_SIZE,
+        num_threads=settings.BLIP_NUM_THREADS,
+        max_length=settings.BLIP_MAX_LENGTH,
+        precision=settings.BLIP_PRECISION,
+    )
+
+
+_frame_captioner = None
+
+def get_frame_captioner():
+    
+    global _frame_captioner
+    if _frame_captioner is None:
+        if settings.FRAME_CAPTION_BACKEND == 'blip':
+            # Backend local: un seul lot à la fois, torch parallélise en interne
+            _frame_captioner = FrameCaptioner(
+                get_vision_captioner(),
+                max_in_flight=1,
+                max_retries=0,
+                batch_size=settings.BLIP_BATCH_SIZE,
+            )
+        else:
+            hybrid = settings.FRAME_CAPTION_BACKEND == 'hybrid'
+            # BLIP local quand le disjoncteur de Gemini est ouvert
+            local = get_vision_captioner() if hybrid or settings.GEMINI_FALLBACK_CAPTIONER else None
+            analyzer = ImageAnalyzer(cache=get_caption_cache(), fallback=local)
+            if hybrid:
+                # BLIP pour les frames sans texte, Gemini pour les autres
+                from .services.caption_router import CaptionRouter
+                analyzer = CaptionRouter(
+                    local,
+                    analyzer,
+                    cache=get_caption_cache(),
+                    text_threshold=settings.CAPTION_ROUTER_TEXT_THRESHOLD,
+                    min_confidence=settings.CAPTION_ROUTER_MIN_CONFIDENCE,
+                )
+            _frame_captioner = FrameCaptioner(
+                analyzer,
+                max_in_flight=settings.FRAME_CAPTION_MAX_IN_FLIGHT,
+                max_retries=settings.FRAME_CAPTION_MAX_RETRIES,
+                retry_backoff=settings.FRAME_CAPTION_RETRY_BACKOFF,
+                batch_size=settings.FRAME_CAPTION_BATCH_SIZE,
+                encoder=FrameEncoder(
+                    max_long_edge=settings.FRAME_ENCODE_MAX_LONG_EDGE,
+                    quality=settings.FRAME_ENCODE_QUALITY,
+                    image_format=settings.FRAME_ENCODE_FORMAT,
+                ),
+            )
+        logger.info(f"📥 FrameCaptioner chargé (backend {settings.FRAME_CAPTION_BACKEND})")
+    return _frame_captioner
+
+
+def extract_uploaded_image(analyzer, uploaded_file, digest):
+    """Contenu d'une image envoyée, sans décodage ni appel modèle si déjà vue"""
+    media_cache = get_media_cache()
+    content = media_cache.get('image', digest)
+    
+    if content is None:
+        # Décodage depuis le fichier (mémoire ou disque) ou son chemin, sans copie en bytes
+        source = uploaded_file if isinstance(uploaded_file, str) else uploaded_file.open()
+        try:
+            content = analyzer.extract_image_content(source, raise_errors=True, digest=digest)
+        except Exception as e:
+            raise model_error(e)
+        media_cache.put('image', digest, content)
+    
+    return content
+
+
+def extract_uploaded_images(analyzer, images):
+    
+    return [extract_uploaded_image(analyzer, image, digest) for image, digest in images]
+
+
+def caption_uploaded_video(video_path, digest):
+    """(descriptions des frames, horodatages, métadonnées) d'une vidéo envoyée"""
+    media_cache = get_media_cache()
+    cached = media_cache.get('video', digest)
+    
+    if cached is not None:
+        return cached['captions'], cached.get('timestamps'), cached['metadata']
+    
+    processor = get_video_processor()
+    # Les frames sont décrites au fil du décodage (mémoire bornée)
+    metadata, frame_stream = processor.stream_video(video_path)
+    captioner = get_frame_captioner()
+    timestamps, frame_captions = captioner.caption_stream(frame_stream)
+    
+    if hasattr(captioner.analyzer, 'stats'):
+        logger.info(f"🔀 Routage des frames: {captioner.analyzer.stats()}")
     
+    # Frames en échec (None): absentes de la chronologie, vidéo incomplète non mise en cache
+    described = [(timestamp, caption) for timestamp, caption in zip(timestamps, frame_captions) if caption is not None]
+    if frame_captions and not described:
+        raise ModelUnavailableError("Aucune frame de la vidéo n'a pu être décrite")
+    if len(described) < len(frame_captions):
+        logger.warning(f"⚠️ {len(frame_captions) - len(described)} frame(s) sans description ignorée(s)")
+    elif frame_captions:
+        media_cache.put('video', digest, {'captions': frame_captions, 'timestamps': timestamps, 'metadata': metadata})
+    
+    timestamps = [timestamp for timestamp, _ in described]
+    frame_captions = [caption for _, caption in described]
+    return frame_captions, timestamps, metadata
+
+
+def read_message_request(request):
+    """(texte, [(image, digest)], [(vidéo, digest)], session_id, use_cache) d'un POST send"""
+    text_message = request.POST.get('message', '').strip()
+    images = request.FILES.getlist('images')
+    videos = request.FILES.getlist('videos')
+    check_upload_size(request)
+    session_id = request.session.session_key
+    
+    if not session_id:
+        request.session.create()
+        session_id = request.session.session_key
+    
+    images = [(img, get_upload_digest(request, 'images', i)) for i, img in enumerate(images)]
+    videos = [(video, get_upload_digest(request, 'videos', i)) for i, video in enumerate(videos)]
+    
+    # Cache de réponses contourné pour la session avec cache=off (rétabli par cache=on)
+    cache_choice = request.POST.get('cache')
+    if cache_choice in ('on', 'off'):
+        request.session['response_cache'] = cache_choice == 'on'
+    use_cache = request.session.get('response_cache', True)
+    
+    return text_message, images, videos, session_id, use_cache
+
+
+def answer_message(chatbot, text_message, images, videos, use_cache=True):
+    """Réponse du chatbot à un message (vue synchrone et jobs).
+    
+    images et videos: listes de (fichier, digest); une vidéo peut aussi
+    être donnée par son chemin. Seule la première vidéo est analysée.
+    use_cache: cache de réponses des messages texte seul (s'il est activé).
+    """
+    if text_message and not images and not videos:
+        logger.info("💬 Mode: Texte seul")
+        return chatbot.chat_text_only(text_message, use_cache=use_cache)
+    
+    if images:
+        logger.info(f"🖼️ Mode: Texte + {len(images)} image(s)")
+        
+        image_contents = extract_uploaded_images(chatbot.image_analyzer, images)
+        
+        if len(images) == 1:
+            return chatbot.chat_with_image(
+                user_message=text_message or "Analyse cette image",
+                image_content=image_contents[0]
+            )
+        
+        return chatbot.chat_with_mixed_media(
+            user_message=text_message or "Analyse ces images",
+            image_contents=image_contents,
+            videos=None
+        )
+    
+    if videos:
+        logger.info(f"🎥 Mode: Texte + {len(videos)} vidéo(s)")
+        
+        video, digest = videos[0]
+        video_path = video if isinstance(video, str) else video.temporary_file_path()
+        frame_captions, timestamps, metadata = caption_uploaded_video(video_path, digest)
+        
+        return chatbot.chat_with_video(
+            user_message=text_message or "Analyse cette vidéo",
+            frame_captions=frame_captions,
+            video_metadata=metadata,
+            timestamps=timestamps,
+            digest=digest
+        )
+    
+    return None
+
+
+def persist_uploads(images, videos):
+    """Copier les fichiers envoyés pour qu'ils survivent à la requête (jobs).
+    
+    Retourne (images, videos, cleanup) avec images et videos en (chemin, digest).
+    """
+    image_paths = [(copy_to_tempfile(image), digest) for image, digest in images]
+    video_paths = [(copy_to_tempfile(video), digest) for video, digest in videos[:1]]
+    
+    def cleanup():
+        for path, _ in image_paths + video_paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    
+    return image_paths, video_paths, cleanup
+
+
+def submit_message_job(chatbot, session_id, text_message, images, videos, use_cache=True):
+    
+    images, video_paths, cleanup = persist_uploads(images, videos)
+    return get_job_runner().submit(
+        session_id, answer_message, chatbot, text_message, images, video_paths, use_cache,
+        cleanup=cleanup, describe_error=job_error_message
+    )
+
+
+def job_response(job_id, session_id, status=202):
+    
+    return JsonResponse({
+        'success': True,
+        'job_id': job_id,
+        'status': 'pending',
+        'status_url': reverse('job_status', args=[job_id]),
+        'session_id': session_id
+    }, status=status)
+
+
+def message_response(response_text, session_id):
+    
+    if not response_text:
+        return JsonResponse({
+            'error': 'Impossible de générer une réponse'
+        }, status=500)
+    
+    logger.info(f"✅ Réponse générée: {len(response_text)} caractères")
+    
+    return JsonResponse({
+        'success': True,
+        'response': response_text,
+        'session_id': session_id
+    })
+
+
+def wants_job(request, videos):
+    
+    return request.POST.get('mode') == 'job' or bool(videos and settings.CHAT_VIDEO_JOBS)
+
+
+EMPTY_MESSAGE_ERROR = 'Message vide. Envoyez du texte, une image ou une vidéo.'
+MODEL_UNAVAILABLE_ERROR = "Le service d'analyse est momentanément indisponible. Réessayez dans quelques instants."
+MODEL_REFUSAL_ERROR = "Le modèle n'a pas pu répondre à ce message (contenu bloqué). Reformulez votre demande."
+
+
+def job_error_message(error):
+    """Message d'échec d'un job montré au client, sans le texte de l'exception"""
+    if isinstance(error, ModelUnavailableError):
+        return MODEL_UNAVAILABLE_ERROR
+    if isinstance(error, ModelRefusalError):
+        return MODEL_REFUSAL_ERROR
+    return JOB_FAILED_ERROR
+
+
+def model_unavailable_response(error):
+    
+    logger.warning(f"⚠️ Modèle indisponible: {error}")
+    response = JsonResponse({'error': MODEL_UNAVAILABLE_ERROR}, status=503)
+    if error.retry_after:
+        response['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def model_refusal_response(error):
+    
+    logger.warning(f"⚠️ Réponse refusée par le modèle: {error}")
+    return JsonResponse({'error': MODEL_REFUSAL_ERROR}, status=422)
+
+
+@csrf_exempt
+async def send_message(request):
+    """Réponse complète en une requête; la génération tourne dans un thread"""
     if request.method != 'POST':
         return JsonResponse({'error': 'Method not allowed'}, status=405)
     
     try:
-        text_message = request.POST.get('message', '').strip()
-        images = request.FILES.getlist('images')
-        videos = request.FILES.getlist('videos')
-        session_id = request.session.session_key
-        
-        if not session_id:
-            request.session.create()
-            session_id = request.session.session_key
+        text_message, images, videos, session_id, use_cache = await sync_to_async(read_message_request)(request)
         
         logger.info(f"📨 Traitement du message: texte={bool(text_message)}, "
                    f"images={len(images)}, vidéos={len(videos)}")
         
         if not text_message and not images and not videos:
-            return JsonResponse({
-                'error': 'Message vide. Envoyez du texte, une image ou une vidéo.'
-            }, status=400)
+            return JsonResponse({'error': EMPTY_MESSAGE_ERROR}, status=400)
+        
+        chatbot = await sync_to_async(get_session_registry().get)(session_id)
+        
+        if request.POST.get('mode') == 'job':
+            job_id = await sync_to_async(submit_message_job)(
+                chatbot, session_id, text_message, images, videos, use_cache
+            )
+            return job_response(job_id, session_id)
         
-        chatbot = MultimodalChatbot(session_id=session_id)
+        response_text = await sync_to_async(answer_message, thread_sensitive=False)(
+            chatbot, text_message, images, videos, use_cache
+        )
+        
+        return message_response(response_text, session_id)
+    
+    except UploadTooLarge as e:
+        return JsonResponse({'error': str(e)}, status=413)
+    
+    except ModelUnavailableError as e:
+        return model_unavailable_response(e)
+    
+    except ModelRefusalError as e:
+        return model_refusal_response(e)
+    
+    except Exception as e:
+        logger.error(f"❌ Erreur lors du traitement du message: {str(e)}", exc_info=True)
+        return JsonResponse({
+            'error': f'Erreur serveur: {str(e)}'
+        }, status=500)
+
+
+@csrf_exempt
+async def send_message_async(request):
+    """Variante ASGI de send_message.
+    
+    L'appel final au modèle est attendu sur la boucle d'événements; la
+    lecture du formulaire, l'extraction des images et la description des
+    vidéos tournent dans des threads. Avec mode=job (et par défaut pour les
+    vidéos, CHAT_VIDEO_JOBS), la vue répond 202 avec un job_id à suivre
+    sur jobs/<job_id>/.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    
+    try:
+        text_message, images, videos, session_id, use_cache = await sync_to_async(read_message_request)(request)
+        
+        logger.info(f"📨 Traitement du message (async): texte={bool(text_message)}, "
+                   f"images={len(images)}, vidéos={len(videos)}")
+        
+        if not text_message and not images and not videos:
+            return JsonResponse({'error': EMPTY_MESSAGE_ERROR}, status=400)
+        
+        chatbot = await sync_to_async(get_session_registry().get)(session_id)
+        
+        if wants_job(request, videos):
+            job_id = await sync_to_async(submit_message_job)(
+                chatbot, session_id, text_message, images, videos, use_cache
+            )
+            return job_response(job_id, session_id)
         
         response_text = None
         
         if text_message and not images and not videos:
-            logger.info("💬 Mode: Texte seul")
-            response_text = chatbot.chat_text_only(text_message)
+            response_text = await chatbot.achat_text_only(text_message, use_cache=use_cache)
         
         elif images:
-            logger.info(f"🖼️ Mode: Texte + {len(images)} image(s)")
+            image_contents = await sync_to_async(extract_uploaded_images, thread_sensitive=False)(
+                chatbot.image_analyzer, images
+            )
             
             if len(images) == 1:
-                
-                image_data = images[0].read()
-                response_text = chatbot.chat_with_image(
-                    user_message=text_message or "Analyse cette image",
-                    image_data=image_data
+                response_text = await chatbot.achat_with_image(
+                    text_message or "Analyse cette image", image_contents[0]
                 )
             else:
-                
-                image_data_list = [img.read() for img in images]
-                response_text = chatbot.chat_with_mixed_media(
-                    user_message=text_message or "Analyse ces images",
-                    images=image_data_list,
-                    videos=None
+                response_text = await chatbot.achat_with_mixed_media(
+                    text_message or "Analyse ces images", image_contents
                 )
         
         elif videos:
-            logger.info(f"🎥 Mode: Texte + {len(videos)} vidéo(s)")
-            
-            video_file = videos[0]
-            video_path = video_file.temporary_file_path()
-            processor = get_video_processor() 
-            frames = processor.extract_frames(video_path)
-            metadata = processor.get_video_metadata(video_path)
-            
-            analyzer = ImageAnalyzer()
-            frame_captions = []
-            
-            for i, frame_array in enumerate(frames):
-                
-                frame_pil = Image.fromarray(frame_array)
-                
-                
-                caption = analyzer.extract_image_content(frame_pil)
-                frame_captions.append(caption)
-                logger.info(f"Frame {i+1}/{len(frames)} analyzed")
-    
-            
-            response_text = chatbot.chat_with_video(
-                user_message=text_message or "Analyse cette vidéo",
-                frame_captions=frame_captions,
-                video_metadata=metadata
+            video_file, digest = videos[0]
+            frame_captions, timestamps, metadata = await sync_to_async(caption_uploaded_video, thread_sensitive=False)(
+                video_file.temporary_file_path(), digest
+            )
+            response_text = await chatbot.achat_with_video(
+                text_message or "Analyse cette vidéo", frame_captions, metadata, timestamps, digest
             )
         
+        return message_response(response_text, session_id)
+    
+    except UploadTooLarge as e:
+        return JsonResponse({'error': str(e)}, status=413)
+    
+    except ModelUnavailableError as e:
+        return model_unavailable_response(e)
+    
+    except ModelRefusalError as e:
+        return model_refusal_response(e)
+    
+    except Exception as e:
+        logger.error(f"❌ Erreur lors du traitement du message: {str(e)}", exc_info=True)
+        return JsonResponse({
+            'error': f'Erreur serveur: {str(e)}'
+        }, status=500)
+
+
+def sse_event(data, event=None):
+    
+    prefix = f"event: {event}\n" if event else ''
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@csrf_exempt
+async def send_message_stream(request):
+    """Variante de send-async qui envoie la réponse en flux (Server-Sent Events).
+    
+    Événements: data {"delta"} pour chaque morceau, puis "done" avec la
+    réponse complète, ou "error".
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    
+    try:
+        text_message, images, videos, session_id, use_cache = await sync_to_async(read_message_request)(request)
         
-        if not response_text:
-            return JsonResponse({
-                'error': 'Impossible de générer une réponse'
-            }, status=500)
+        logger.info(f"📨 Traitement du message (flux): texte={bool(text_message)}, "
+                   f"images={len(images)}, vidéos={len(videos)}")
         
-        logger.info(f"✅ Réponse générée: {len(response_text)} caractères")
+        if not text_message and not images and not videos:
+            return JsonResponse({'error': EMPTY_MESSAGE_ERROR}, status=400)
         
-        return JsonResponse({
-            'success': True,
-            'response': response_text,
-            'session_id': session_id
-        })
+        chatbot = await sync_to_async(get_session_registry().get)(session_id)
+    
+    except UploadTooLarge as e:
+        return JsonResponse({'error': str(e)}, status=413)
     
     except Exception as e:
         logger.error(f"❌ Erreur lors du traitement du message: {str(e)}", exc_info=True)
         return JsonResponse({
             'error': f'Erreur serveur: {str(e)}'
         }, status=500)
+    
+    response = StreamingHttpResponse(
+        stream_message_events(chatbot, text_message, images, videos, session_id, use_cache),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Pas de mise en tampon par un éventuel proxy nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def stream_message_events(chatbot, text_message, images, videos, session_id, use_cache=True):
+    
+    try:
+        image_contents = frame_captions = timestamps = metadata = digest = None
+        user_message = text_message
+        
+        if images:
+            image_contents = await sync_to_async(extract_uploaded_images, thread_sensitive=False)(
+                chatbot.image_analyzer, images
+            )
+            user_message = text_message or ("Analyse cette image" if len(images) == 1 else "Analyse ces images")
+        
+        elif videos:
+            video_file, digest = videos[0]
+            frame_captions, timestamps, metadata = await sync_to_async(caption_uploaded_video, thread_sensitive=False)(
+                video_file.temporary_file_path(), digest
+            )
+            user_message = text_message or "Analyse cette vidéo"
+        
+        parts = []
+        async for delta in chatbot.astream_reply(user_message, image_contents, frame_captions, metadata,
+                                                 use_cache=use_cache, timestamps=timestamps, digest=digest):
+            parts.append(delta)
+            yield sse_event({'delta': delta})
+        
+        response_text = ''.join(parts)
+        logger.info(f"✅ Réponse envoyée en flux: {len(response_text)} caractères")
+        yield sse_event({'success': True, 'response': response_text, 'session_id': session_id}, event='done')
+    
+    except ModelUnavailableError as e:
+        logger.warning(f"⚠️ Modèle indisponible: {e}")
+        yield sse_event({'error': MODEL_UNAVAILABLE_ERROR, 'retry_after': e.retry_after}, event='error')
+    
+    except ModelRefusalError as e:
+        logger.warning(f"⚠️ Réponse refusée par le modèle: {e}")
+        yield sse_event({'error': MODEL_REFUSAL_ERROR}, event='error')
+    
+    except Exception as e:
+        logger.error(f"❌ Erreur lors du traitement du message: {str(e)}", exc_info=True)
+        yield sse_event({'error': f'Erreur serveur: {str(e)}'}, event='error')
+
+
+async def job_status(request, job_id):
+    """État d'un job; ?wait=N attend jusqu'à N secondes qu'il se termine"""
+    try:
+        wait = min(float(request.GET.get('wait') or 0), settings.CHAT_JOB_MAX_WAIT)
+    except ValueError:
+        return JsonResponse({'error': 'Paramètre wait invalide'}, status=400)
+    
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    jobs = AnalysisJob.objects.filter(job_id=job_id, session_id=request.session.session_key)
+    
+    while True:
+        job = await jobs.afirst()
+        if job is None:
+            return JsonResponse({'error': 'Job introuvable'}, status=404)
+        
+        remaining = deadline - loop.time()
+        if job.finished or remaining <= 0:
+            break
+        
+        future = get_job_runner().future(job_id)
+        if future is not None:
+            # Job lancé par ce processus: réveil dès la fin du traitement
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), remaining)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            await asyncio.sleep(min(JOB_POLL_INTERVAL, remaining))
+    
+    payload = {'job_id': job.job_id, 'status': job.status}
+    if job.status == 'done':
+        payload.update(success=True, response=job.response)
+    elif job.status == 'failed':
+        payload['error'] = job.error or JOB_FAILED_ERROR
+    
+    return JsonResponse(payload)
 
 
 def chat_view(request):
@@ -130,20 +572,31 @@ def chat_view(request):
     return render(request, 'analyzer/chatbot.html')
 
 
-def get_history(request):
+async def get_history(request):
+    """Historique persisté, du plus récent au plus ancien par pages.
     
+    ?limit= taille de page, ?before= curseur next_before de la page
+    précédente pour remonter dans la conversation.
+    """
     try:
         session_id = request.session.session_key
         
         if not session_id:
-            return JsonResponse({'messages': []})
-        
-        chatbot = MultimodalChatbot(session_id=session_id)
+            return JsonResponse({'messages': [], 'next_before': None})
         
-        messages = chatbot.memory.messages
+        try:
+            limit = int(request.GET.get('limit', settings.CHAT_HISTORY_PAGE_SIZE))
+            messages, next_before = await sync_to_async(get_chat_store().history_page)(
+                session_id,
+                before=request.GET.get('before') or None,
+                limit=min(max(1, limit), settings.CHAT_HISTORY_MAX_PAGE_SIZE),
+            )
+        except ValueError:
+            return JsonResponse({'error': 'Paramètre limit ou before invalide'}, status=400)
         
         return JsonResponse({
             'messages': messages,
+            'next_before': next_before,
             'session_id': session_id
         })
     
@@ -153,7 +606,7 @@ def get_history(request):
 
 
 @csrf_exempt
-def clear_history(request):
+async def clear_history(request):
     """Effacer l'historique de conversation"""
     if request.method != 'POST':
         return JsonResponse({'error': 'Method not allowed'}, status=405)
@@ -162,8 +615,8 @@ def clear_history(request):
         session_id = request.session.session_key
         
         if session_id:
-            chatbot = MultimodalChatbot(session_id=session_id)
-            chatbot.clear_history()
+            chatbot = await sync_to_async(get_session_registry().get)(session_id)
+            await sync_to_async(chatbot.clear_history)()
             logger.info(f"🗑️ Historique effacé pour session: {session_id}")
         
         return JsonResponse({'success': True})
@@ -173,12 +626,40 @@ def clear_history(request):
         return JsonResponse({'error': str(e)}, status=500)
 
 
-def test_chatbot(request):
+def service_stats(request):
+    """Compteurs des services du processus (clients Gemini, caches, sessions, jobs)"""
+    if not settings.SERVICE_STATS_ENABLED:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    
+    caption_cache = get_caption_cache()
+    response_cache = get_response_cache()
+    stats = {
+        'model_clients': get_model_client_pool().stats(),
+        'sessions': get_session_registry().stats(),
+        'jobs': get_job_runner().stats(),
+        'chat_store': get_chat_store().stats(),
+        'media_cache': get_media_cache().stats(),
+        'caption_cache': caption_cache.stats() if caption_cache is not None else None,
+        'single_flight': get_single_flight().stats(),
+        'response_cache': response_cache.stats() if response_cache is not None else None,
+    }
+    # Routage des frames (backend 'hybrid'), si le captioner a déjà servi
+    if _frame_captioner is not None and hasattr(_frame_captioner.analyzer, 'stats'):
+        stats['caption_router'] = _frame_captioner.analyzer.stats()
+    # Frames décrites localement faute de modèle distant (disjoncteur ouvert)
+    if _frame_captioner is not None:
+        remote = getattr(_frame_captioner.analyzer, 'remote', _frame_captioner.analyzer)
+        stats['caption_fallbacks'] = getattr(remote, 'fallbacks', 0)
+    
+    return JsonResponse(stats)
+
+
+async def test_chatbot(request):
     
     try:
         
-        chatbot = MultimodalChatbot(session_id="test-session")
-        response = chatbot.chat_text_only("Bonjour, test de connexion!")
+        chatbot = await sync_to_async(MultimodalChatbot)(session_id="test-session")
+        response = await chatbot.achat_text_only("Bonjour, test de connexion!")
         
         return JsonResponse({
             'success': True,
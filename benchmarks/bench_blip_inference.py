@@ -0,0 +1,147 @@
+"""
+Benchmark CPU du backend BLIP local selon le mode d'inférence.
+
+Chaque mode (précision x max_length) tourne dans un processus séparé pour
+mesurer sa mémoire résidente propre, sur le même jeu de frames fixe
+(synthétique, ou échantillonné depuis --video). Rapporte captions/s,
+latence p50/p95 par lot, RSS, et l'accord avec les descriptions du premier
+mode (recouvrement de mots), pour choisir un compromis vitesse / qualité.
+
+    python benchmarks/bench_blip_inference.py --modes fp32 int8 bf16 --max-lengths 50 30
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('GOOGLE_API_KEY', 'offline-benchmark')
+
+import cv2
+import numpy as np
+
+
+def make_frames(count, width=640, height=360):
+    """Frames fixes: formes colorées et texte sur fond uni"""
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(count):
+        frame = np.full((height, width, 3), rng.integers(0, 255, 3), dtype=np.uint8)
+        for _ in range(3):
+            color = tuple(int(c) for c in rng.integers(0, 255, 3))
+            x, y = int(rng.integers(0, width - 100)), int(rng.integers(0, height - 100))
+            if rng.random() < 0.5:
+                cv2.rectangle(frame, (x, y), (x + 100, y + 80), color, -1)
+            else:
+                cv2.circle(frame, (x + 50, y + 50), 45, color, -1)
+        cv2.putText(frame, f"Slide {i + 1}", (30, height - 30), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (255, 255, 255), 3)
+        frames.append(frame)
+    return frames
+
+
+def load_frames(video, count):
+
+    if not video:
+        return make_frames(count)
+
+    from analyzer.services.video_processor import VideoProcessor
+
+    return VideoProcessor(interval=1, max_frames=count, sampling='seek').process_video(video).frames
+
+
+def run_mode(args, precision, max_length, results):
+    """Processus enfant: charge le modèle dans ce mode et mesure"""
+    from analyzer.services.model_registry import resident_memory_mb
+    from analyzer.services.vision_model import VisionCaptioner
+
+    frames = load_frames(args.video, args.frames)
+    captioner = VisionCaptioner(
+        model_name=args.model,
+        batch_size=args.batch_size,
+        num_threads=args.threads or None,
+        max_length=max_length,
+        precision=precision,
+    )
+    # Lot à blanc: allocations et pages des poids hors mesure
+    captioner.caption_batch(frames[:args.batch_size])
+
+    latencies = []
+    captions = []
+    start = time.perf_counter()
+    for offset in range(0, len(frames), args.batch_size):
+        batch_start = time.perf_counter()
+        captions.extend(captioner.caption_batch(frames[offset:offset + args.batch_size]))
+        latencies.append(time.perf_counter() - batch_start)
+    elapsed = time.perf_counter() - start
+
+    results.put({
+        'mode': f"{captioner.precision}/{max_length}",
+        'captions_per_s': len(frames) / elapsed,
+        'p50': float(np.percentile(latencies, 50)),
+        'p95': float(np.percentile(latencies, 95)),
+        'rss_mb': resident_memory_mb(),
+        'captions': captions,
+    })
+
+
+def collect(process, results):
+
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                return None
+
+
+def word_overlap(a, b):
+
+    a, b = set(a.lower().split()), set(b.lower().split())
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='Salesforce/blip-image-captioning-base')
+    parser.add_argument('--modes', nargs='+', default=['fp32', 'int8', 'bf16'])
+    parser.add_argument('--max-lengths', type=int, nargs='+', default=[50, 30])
+    parser.add_argument('--frames', type=int, default=24)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=0, help="0 = un thread par cœur disponible")
+    parser.add_argument('--video', help="échantillonner les frames depuis cette vidéo")
+    args = parser.parse_args()
+
+    # spawn: chaque mode repart d'un processus vierge (RSS comparables)
+    context = multiprocessing.get_context('spawn')
+    reference = None
+
+    print(f"{args.frames} frames, batch_size={args.batch_size}, latence par lot")
+    print(f"{'mode':>10} | {'captions/s':>10} | {'p50':>7} | {'p95':>7} | {'RSS':>8} | accord")
+    for precision in args.modes:
+        for max_length in args.max_lengths:
+            results = context.Queue()
+            process = context.Process(target=run_mode, args=(args, precision, max_length, results))
+            process.start()
+            result = collect(process, results)
+            process.join()
+
+            if result is None:
+                print(f"{precision}/{max_length:<5} | échec (code {process.exitcode})")
+                continue
+
+            if reference is None:
+                reference = result['captions']
+            agreement = np.mean([word_overlap(a, b) for a, b in zip(reference, result['captions'])])
+
+            print(f"{result['mode']:>10} | {result['captions_per_s']:10.2f} | {result['p50']:6.2f}s | "
+                  f"{result['p95']:6.2f}s | {result['rss_mb']:5.0f} MB | {agreement:5.0%}")
+
+    if reference:
+        print(f"exemple (référence): {reference[0]!r}")
+
+
+if __name__ == '__main__':
+    main()
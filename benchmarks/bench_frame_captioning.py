@@ -0,0 +1,71 @@
+"""
+Benchmark hors-ligne: description séquentielle vs parallèle des frames vidéo.
+
+Utilise FakeGenerativeModel (aucun appel réseau) avec une latence simulée
+par appel, pour mesurer le gain de FrameCaptioner selon max_in_flight et
+la taille des lots (batch_size).
+
+    python benchmarks/bench_frame_captioning.py --frames 30 --latency 0.3
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('GOOGLE_API_KEY', 'offline-benchmark')
+
+import numpy as np
+
+from analyzer.services.chatbot_orchestrator import ImageAnalyzer
+from analyzer.services.fake_gemini import FakeGenerativeModel
+from analyzer.services.frame_captioning import FrameCaptioner
+
+
+def make_frames(count, width, height):
+
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 255, (height, width, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def run_serial(analyzer, frames):
+
+    return [analyzer.extract_image_content(frame) for frame in frames]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.3, help="latence simulée par appel (s)")
+    parser.add_argument('--jitter', type=float, default=0.1)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--in-flight', type=int, nargs='+', default=[2, 4, 8])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 5])
+    args = parser.parse_args()
+
+    frames = make_frames(args.frames, 320, 180)
+    model = FakeGenerativeModel(latency=args.latency, jitter=args.jitter,
+                                failure_rate=args.failure_rate, seed=42)
+    analyzer = ImageAnalyzer(model_name=model.model_name, model=model)
+
+    start = time.perf_counter()
+    run_serial(analyzer, frames)
+    serial = time.perf_counter() - start
+    print(f"serial                : {serial:6.2f}s  calls={model.calls}")
+
+    for batch_size in args.batch_sizes:
+        for in_flight in args.in_flight:
+            model.reset()
+            captioner = FrameCaptioner(analyzer, max_in_flight=in_flight,
+                                       retry_backoff=0.05, batch_size=batch_size)
+            start = time.perf_counter()
+            captions = captioner.caption_frames(frames)
+            elapsed = time.perf_counter() - start
+            assert len(captions) == len(frames)
+            print(f"batch={batch_size:<2} in_flight={in_flight:<2}: {elapsed:6.2f}s  calls={model.calls:<3} "
+                  f"peak={model.max_in_flight}  speedup={serial / elapsed:4.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Test de charge SQLite: sessions et historique du chat depuis plusieurs processus.
+
+Chaque processus simule des requêtes comme un worker gunicorn: lecture de
+la session Django (et écriture une fois sur deux), lecture d'une page
+d'historique, écriture d'un échange (transaction ChatStore). Chaque profil
+(SQLITE_PROFILE de settings.py) tourne sur une base neuve; le script
+rapporte requêtes/s, latence p50/p95 et erreurs "database is locked".
+
+    python benchmarks/bench_sqlite_sessions.py --processes 4 --duration 10
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+
+def setup_django(profile, db_path):
+
+    os.environ.setdefault('GOOGLE_API_KEY', 'offline-benchmark')
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'multimodal_ai.settings'
+    os.environ['SQLITE_PROFILE'] = profile
+    os.environ['SQLITE_PATH'] = db_path
+
+    import django
+    django.setup()
+    # Les échecs sont comptés par le benchmark, pas journalisés à chaque requête
+    logging.disable(logging.CRITICAL)
+
+
+def migrate(profile, db_path):
+
+    setup_django(profile, db_path)
+    from django.core.management import call_command
+
+    call_command('migrate', verbosity=0)
+
+
+def run_worker(profile, db_path, worker, sessions, start_at, duration, results):
+    """Processus enfant: boucle de requêtes jusqu'à start_at + duration"""
+    setup_django(profile, db_path)
+
+    from django.contrib.sessions.backends.db import SessionStore
+    from django.db import OperationalError, close_old_connections
+
+    from analyzer.services.chat_store import ChatStore
+
+    # Pas de thread d'écriture: chaque échange est écrit dans la requête (pire cas)
+    store = ChatStore(flush_interval=3600)
+    keys = []
+    for i in range(sessions):
+        session = SessionStore()
+        session['worker'] = worker
+        session.create()
+        keys.append(session.session_key)
+    close_old_connections()
+
+    rng = np.random.default_rng(worker)
+    latencies = []
+    errors = 0
+    time.sleep(max(0.0, start_at - time.time()))
+
+    while time.time() < start_at + duration:
+        key = keys[rng.integers(len(keys))]
+        start = time.perf_counter()
+        try:
+            session = SessionStore(session_key=key)
+            session['turns'] = session.get('turns', 0) + 1
+            if rng.random() < 0.5:
+                session.save()
+            store.history_page(key, before=None, limit=20)
+            store.record_turn(key, "question de charge", "réponse de charge " * 20)
+            # Échec d'écriture: ChatStore journalise et compte le lot perdu
+            if store.flush():
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+        except OperationalError as e:
+            errors += 1
+            if 'locked' not in str(e):
+                raise
+        finally:
+            # Fin de requête: respecte CONN_MAX_AGE comme le fait Django
+            close_old_connections()
+
+    results.put({'requests': len(latencies), 'errors': errors, 'latencies': latencies})
+
+
+def run_profile(context, profile, args):
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'bench.sqlite3')
+        process = context.Process(target=migrate, args=(profile, db_path))
+        process.start()
+        process.join()
+
+        results = context.Queue()
+        # Départ commun une fois tous les processus démarrés
+        start_at = time.time() + 2 + 0.2 * args.processes
+        workers = [
+            context.Process(target=run_worker,
+                            args=(profile, db_path, i, args.sessions, start_at, args.duration, results))
+            for i in range(args.processes)
+        ]
+        for worker in workers:
+            worker.start()
+        collected = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+
+    latencies = [latency for result in collected for latency in result['latencies']]
+    requests = sum(result['requests'] for result in collected)
+    return {
+        'requests_per_s': requests / args.duration,
+        'p50': float(np.percentile(latencies, 50)) if latencies else 0.0,
+        'p95': float(np.percentile(latencies, 95)) if latencies else 0.0,
+        'errors': sum(result['errors'] for result in collected),
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', nargs='+', default=['default', 'production'])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--sessions', type=int, default=20, help="sessions par processus")
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+
+    print(f"{args.processes} processus, {args.duration:.0f}s par profil")
+    print(f"{'profil':>10} | {'req/s':>8} | {'p50':>8} | {'p95':>8} | erreurs 'locked'")
+    for profile in args.profiles:
+        result = run_profile(context, profile, args)
+        print(f"{profile:>10} | {result['requests_per_s']:8.1f} | {result['p50'] * 1000:6.1f}ms | "
+              f"{result['p95'] * 1000:6.1f}ms | {result['errors']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark: échantillonnage séquentiel vs par seek sur des vidéos synthétiques.
+
+Génère des vidéos de différentes durées (mp4v, 640x360) puis mesure le temps
+d'extraction de VideoProcessor pour chaque stratégie.
+
+    python benchmarks/bench_video_sampling.py --durations 60 600 1800
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+
+from analyzer.services.video_processor import VideoProcessor
+
+
+def make_video(path, seconds, fps, size=(640, 360)):
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    rng = np.random.default_rng(0)
+    noise = rng.integers(0, 40, (size[1], size[0], 3), dtype=np.uint8)
+
+    for i in range(int(seconds * fps)):
+        # Nouvelle "scène" toutes les 5 secondes pour passer le détecteur de changement
+        scene = (i // int(5 * fps)) * 53 % 200
+        frame = noise + np.uint8(scene)
+        cv2.putText(frame, f"{i / fps:7.2f}s", (40, 200), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+        writer.write(frame)
+
+    writer.release()
+
+
+def time_sampling(path, sampling, interval, max_frames):
+
+    processor = VideoProcessor(interval=interval, max_frames=max_frames, sampling=sampling)
+    start = time.perf_counter()
+    sample = processor.process_video(path)
+    return time.perf_counter() - start, len(sample.frames)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--durations', type=float, nargs='+', default=[60, 600])
+    parser.add_argument('--fps', type=float, default=25)
+    parser.add_argument('--interval', type=float, default=10)
+    parser.add_argument('--max-frames', type=int, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for duration in args.durations:
+            path = os.path.join(tmp, f"synthetic_{int(duration)}s.mp4")
+            make_video(path, duration, args.fps)
+
+            results = {
+                sampling: time_sampling(path, sampling, args.interval, args.max_frames)
+                for sampling in ('sequential', 'seek')
+            }
+            (seq_time, seq_frames), (seek_time, seek_frames) = results['sequential'], results['seek']
+            print(f"{int(duration):>6}s video: sequential {seq_time:6.2f}s ({seq_frames} frames) | "
+                  f"seek {seek_time:6.2f}s ({seek_frames} frames) | speedup {seq_time / seek_time:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
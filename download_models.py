@@ -1,14 +1,16 @@
 import os
-os.environ['TRANSFORMERS_CACHE'] = './model_cache'
 
 from transformers import BlipProcessor, BlipForConditionalGeneration
-import torch
+
+# Mêmes valeurs par défaut que BLIP_MODEL_NAME / BLIP_CACHE_DIR (settings.py):
+# une fois le cache rempli, BLIP_OFFLINE=true charge le modèle sans réseau
+model_name = os.getenv('BLIP_MODEL_NAME', "Salesforce/blip-image-captioning-base")
+cache_dir = os.getenv('BLIP_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_cache'))
 
 print("📥 Téléchargement du modèle BLIP...")
-model_name = "Salesforce/blip-image-captioning-base"
 
-processor = BlipProcessor.from_pretrained(model_name)
-model = BlipForConditionalGeneration.from_pretrained(model_name)
+processor = BlipProcessor.from_pretrained(model_name, cache_dir=cache_dir)
+model = BlipForConditionalGeneration.from_pretrained(model_name, cache_dir=cache_dir)
 
 print("✅ Modèle téléchargé avec succès!")
-print(f"📁 Cache location: {os.environ.get('TRANSFORMERS_CACHE')}")
\ No newline at end of file
+print(f"📁 Cache location: {cache_dir}")
@@ -0,0 +1,35 @@
+"""
+Configuration gunicorn (lue automatiquement depuis le répertoire courant).
+
+Avec BLIP_PRELOAD=true et le backend 'blip' ou 'hybrid', l'application et
+les poids du modèle sont chargés dans le processus maître avant le fork: les
+workers partagent ces pages en lecture seule (copy-on-write).
+"""
+import gc
+import os
+
+preload_app = os.getenv('BLIP_PRELOAD', 'false').lower() == 'true'
+
+
+def when_ready(server):
+    # Maître, après le chargement de l'application et avant le fork des workers
+    if not preload_app:
+        return
+
+    from analyzer.services.model_registry import preload_models
+
+    preload_models()
+    # Sortir les objets existants du suivi du GC: ses passages ne réécrivent
+    # plus leurs en-têtes dans les workers (pages partagées préservées)
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # Inférence à blanc dans chaque worker (jamais dans le maître: torch et
+    # OpenMP ne supportent pas un fork après usage du pool de threads)
+    from django.conf import settings
+
+    if settings.BLIP_WARMUP:
+        from analyzer.services.model_registry import preload_models
+
+        preload_models(warm_up=True)
@@ -77,10 +77,34 @@ WSGI_APPLICATION = 'multimodal_ai.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.getenv('SQLITE_PATH', str(BASE_DIR / 'db.sqlite3')),
     }
 }
 
+# Profil SQLite: 'production' (WAL, lecteurs non bloqués par l'écrivain,
+# attente du verrou au lieu de "database is locked", connexions réutilisées)
+# ou 'default' (réglages Django par défaut). Comparaison sous charge:
+# python benchmarks/bench_sqlite_sessions.py
+SQLITE_PROFILE = os.getenv('SQLITE_PROFILE', 'production')
+if SQLITE_PROFILE == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Attente max (secondes) du verrou d'écriture
+            'timeout': float(os.getenv('SQLITE_BUSY_TIMEOUT', 20)),
+            # Verrou d'écriture pris dès BEGIN: pas d'échec de promotion lecture -> écriture
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                f"PRAGMA mmap_size={int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))};"
+                'PRAGMA cache_size=-16000;'
+                'PRAGMA temp_store=MEMORY;'
+            ),
+        },
+    })
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -135,6 +159,136 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
+# Pool de sessions chatbot (analyzer.services.session_registry)
+CHATBOT_SESSION_MAX = int(os.getenv('CHATBOT_SESSION_MAX', 256))
+CHATBOT_SESSION_TTL = int(os.getenv('CHATBOT_SESSION_TTL', 1800))
+CHATBOT_SESSION_MEMORY_BUDGET = int(os.getenv('CHATBOT_SESSION_MEMORY_BUDGET', 16 * 1024 * 1024))
+# Historique injecté dans le prompt, en tokens estimés (~4 caractères):
+# budget total, longueur max d'un message, résumé des questions plus
+# anciennes (0 = pas de résumé)
+CHATBOT_HISTORY_TOKENS = int(os.getenv('CHATBOT_HISTORY_TOKENS', 800))
+CHATBOT_HISTORY_MESSAGE_TOKENS = int(os.getenv('CHATBOT_HISTORY_MESSAGE_TOKENS', 200))
+CHATBOT_HISTORY_SUMMARY_TOKENS = int(os.getenv('CHATBOT_HISTORY_SUMMARY_TOKENS', 120))
+# Chronologie des vidéos déjà décrites, gardée par session pour les questions
+# suivantes: durée de vie (s), taille max par session et part du prompt en
+# tokens estimés (frames liées à la question d'abord, 0 = chronologie complète)
+CHATBOT_MEDIA_TTL = int(os.getenv('CHATBOT_MEDIA_TTL', 3600))
+CHATBOT_MEDIA_MAX_BYTES = int(os.getenv('CHATBOT_MEDIA_MAX_BYTES', 256 * 1024))
+CHATBOT_MEDIA_TIMELINE_TOKENS = int(os.getenv('CHATBOT_MEDIA_TIMELINE_TOKENS', 1200))
+
+# Persistance des échanges (analyzer.services.chat_store): écritures par lots
+# en arrière-plan, historique paginé par curseur
+CHAT_PERSIST_FLUSH_INTERVAL = float(os.getenv('CHAT_PERSIST_FLUSH_INTERVAL', 0.5))
+CHAT_PERSIST_BATCH_SIZE = int(os.getenv('CHAT_PERSIST_BATCH_SIZE', 200))
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv('CHAT_HISTORY_PAGE_SIZE', 50))
+CHAT_HISTORY_MAX_PAGE_SIZE = int(os.getenv('CHAT_HISTORY_MAX_PAGE_SIZE', 200))
+
+# Clients Gemini partagés (analyzer.services.model_client): appels simultanés
+# max pour tout le processus; GEMINI_FAKE=true pour un transport factice
+# hors-ligne (analyzer.services.fake_gemini)
+GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', 8))
+GEMINI_FAKE = os.getenv('GEMINI_FAKE', 'false').lower() == 'true'
+GEMINI_FAKE_LATENCY = float(os.getenv('GEMINI_FAKE_LATENCY', 0.0))
+# Appels lents doublés (analyzer.services.resilience) après le p95 des
+# latences récentes, au plus GEMINI_HEDGE_MAX_RATIO des requêtes. Désactivé
+# par défaut: chaque doublement est un appel facturé, et un appel synchrone
+# perdant va tout de même jusqu'au bout
+GEMINI_HEDGE_ENABLED = os.getenv('GEMINI_HEDGE_ENABLED', 'false').lower() == 'true'
+GEMINI_HEDGE_PERCENTILE = float(os.getenv('GEMINI_HEDGE_PERCENTILE', 95))
+GEMINI_HEDGE_MIN_SAMPLES = int(os.getenv('GEMINI_HEDGE_MIN_SAMPLES', 20))
+GEMINI_HEDGE_MIN_DELAY = float(os.getenv('GEMINI_HEDGE_MIN_DELAY', 0.2))
+GEMINI_HEDGE_MAX_RATIO = float(os.getenv('GEMINI_HEDGE_MAX_RATIO', 0.1))
+# Disjoncteur par modèle: ouvert après N échecs transitoires consécutifs,
+# un appel d'essai après GEMINI_BREAKER_RESET_TIMEOUT secondes
+GEMINI_BREAKER_ENABLED = os.getenv('GEMINI_BREAKER_ENABLED', 'true').lower() == 'true'
+GEMINI_BREAKER_FAILURES = int(os.getenv('GEMINI_BREAKER_FAILURES', 5))
+GEMINI_BREAKER_RESET_TIMEOUT = float(os.getenv('GEMINI_BREAKER_RESET_TIMEOUT', 30))
+# Description des frames par BLIP local quand Gemini est indisponible
+# (backend 'gemini'; le backend 'hybrid' se rabat toujours sur BLIP)
+GEMINI_FALLBACK_CAPTIONER = os.getenv('GEMINI_FALLBACK_CAPTIONER', 'false').lower() == 'true'
+# Endpoint stats/ (compteurs des services), activé par défaut en DEBUG seulement
+SERVICE_STATS_ENABLED = os.getenv('SERVICE_STATS_ENABLED', str(DEBUG)).lower() == 'true'
+
+# Description parallèle des frames vidéo (analyzer.services.frame_captioning)
+FRAME_CAPTION_MAX_IN_FLIGHT = int(os.getenv('FRAME_CAPTION_MAX_IN_FLIGHT', 4))
+FRAME_CAPTION_MAX_RETRIES = int(os.getenv('FRAME_CAPTION_MAX_RETRIES', 2))
+FRAME_CAPTION_RETRY_BACKOFF = float(os.getenv('FRAME_CAPTION_RETRY_BACKOFF', 0.5))
+# Nombre de frames envoyées par appel Gemini (1 = un appel par frame)
+FRAME_CAPTION_BATCH_SIZE = int(os.getenv('FRAME_CAPTION_BATCH_SIZE', 1))
+# Réduction/encodage des frames avant envoi (analyzer.services.frame_encoding)
+FRAME_ENCODE_MAX_LONG_EDGE = int(os.getenv('FRAME_ENCODE_MAX_LONG_EDGE', 1024))
+FRAME_ENCODE_QUALITY = int(os.getenv('FRAME_ENCODE_QUALITY', 80))
+FRAME_ENCODE_FORMAT = os.getenv('FRAME_ENCODE_FORMAT', 'JPEG')
+# Backend de description des frames: 'gemini' (API), 'blip' (modèle local,
+# analyzer.services.vision_model, nécessite torch et transformers) ou
+# 'hybrid' (BLIP d'abord, Gemini pour les frames avec du texte ou dont la
+# description locale est peu sûre, analyzer.services.caption_router)
+FRAME_CAPTION_BACKEND = os.getenv('FRAME_CAPTION_BACKEND', 'gemini')
+# Part minimale de la frame couverte de lignes de texte pour passer par Gemini
+CAPTION_ROUTER_TEXT_THRESHOLD = float(os.getenv('CAPTION_ROUTER_TEXT_THRESHOLD', 0.02))
+# Confiance BLIP (probabilité moyenne des tokens) en dessous de laquelle on passe par Gemini
+CAPTION_ROUTER_MIN_CONFIDENCE = float(os.getenv('CAPTION_ROUTER_MIN_CONFIDENCE', 0.3))
+BLIP_BATCH_SIZE = int(os.getenv('BLIP_BATCH_SIZE', 8))
+# 0 = un thread par cœur disponible
+BLIP_NUM_THREADS = int(os.getenv('BLIP_NUM_THREADS', 0))
+# Mode d'inférence CPU: 'fp32', 'int8' (quantification dynamique) ou 'bf16';
+# voir benchmarks/bench_blip_inference.py pour choisir vitesse / qualité
+BLIP_PRECISION = os.getenv('BLIP_PRECISION', 'fp32')
+BLIP_MAX_LENGTH = int(os.getenv('BLIP_MAX_LENGTH', 50))
+# Chargement du modèle local (analyzer.services.model_registry): python
+# download_models.py remplit BLIP_CACHE_DIR, BLIP_OFFLINE interdit le réseau.
+# BLIP_PRELOAD charge les poids dans le maître gunicorn (partagés après fork),
+# BLIP_WARMUP fait une inférence à blanc au démarrage de chaque worker.
+BLIP_MODEL_NAME = os.getenv('BLIP_MODEL_NAME', 'Salesforce/blip-image-captioning-base')
+BLIP_CACHE_DIR = os.getenv('BLIP_CACHE_DIR', str(BASE_DIR / 'model_cache'))
+BLIP_OFFLINE = os.getenv('BLIP_OFFLINE', 'false').lower() == 'true'
+BLIP_PRELOAD = os.getenv('BLIP_PRELOAD', 'false').lower() == 'true'
+BLIP_WARMUP = os.getenv('BLIP_WARMUP', 'false').lower() == 'true'
+
+# Cache des descriptions par empreinte perceptuelle (analyzer.services.caption_cache)
+CAPTION_CACHE_ENABLED = os.getenv('CAPTION_CACHE_ENABLED', 'true').lower() == 'true'
+CAPTION_CACHE_MAX_ENTRIES = int(os.getenv('CAPTION_CACHE_MAX_ENTRIES', 2048))
+CAPTION_CACHE_MAX_DISTANCE = int(os.getenv('CAPTION_CACHE_MAX_DISTANCE', 3))
+CAPTION_CACHE_DB_PATH = os.getenv('CAPTION_CACHE_DB_PATH', os.path.join(BASE_DIR, 'cache', 'captions.sqlite3'))
+CAPTION_CACHE_DB_MAX_BYTES = int(os.getenv('CAPTION_CACHE_DB_MAX_BYTES', 64 * 1024 * 1024))
+
+# Empreinte xxhash des fichiers calculée pendant la réception, puis fichiers
+# gardés en mémoire jusqu'au seuil et écrits sur disque au-delà (analyzer.uploads)
+FILE_UPLOAD_HANDLERS = [
+    'analyzer.uploads.DigestUploadHandler',
+    'analyzer.uploads.SpooledUploadHandler',
+]
+UPLOAD_SPOOL_THRESHOLD = int(os.getenv('UPLOAD_SPOOL_THRESHOLD', 1024 * 1024))
+# Corps de requête ASGI mis sur disque au même seuil
+FILE_UPLOAD_MAX_MEMORY_SIZE = UPLOAD_SPOOL_THRESHOLD
+# Taille totale max des fichiers d'un message (HTTP 413 au-delà)
+UPLOAD_MAX_REQUEST_SIZE = int(os.getenv('UPLOAD_MAX_REQUEST_SIZE', 200 * 1024 * 1024))
+
+# Résultats d'analyse par empreinte de fichier (analyzer.services.media_cache)
+MEDIA_CACHE_MAX_ENTRIES = int(os.getenv('MEDIA_CACHE_MAX_ENTRIES', 512))
+MEDIA_CACHE_TTL = int(os.getenv('MEDIA_CACHE_TTL', 3600))
+
+# Cache des réponses aux messages texte seul (analyzer.services.response_cache),
+# désactivé par défaut; une session peut le contourner (champ cache=off).
+# Clé: la question et l'historique rendu (premiers messages d'une conversation)
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1024))
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 6 * 3600))
+RESPONSE_CACHE_DB_PATH = os.getenv('RESPONSE_CACHE_DB_PATH', os.path.join(BASE_DIR, 'cache', 'responses.sqlite3'))
+RESPONSE_CACHE_DB_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_DB_MAX_BYTES', 32 * 1024 * 1024))
+
+# Échantillonnage des vidéos: 'seek' (saut direct aux horodatages), 'sequential'
+# ou 'shots' (une frame représentative par plan, analyse de toute la vidéo)
+VIDEO_SAMPLING = os.getenv('VIDEO_SAMPLING', 'seek')
+# Détecteur de changement de scène: 'mean_diff', 'histogram' ou 'ssim'
+VIDEO_SCENE_DETECTOR = os.getenv('VIDEO_SCENE_DETECTOR', 'mean_diff')
+VIDEO_SCENE_THRESHOLD = float(os.environ['VIDEO_SCENE_THRESHOLD']) if os.getenv('VIDEO_SCENE_THRESHOLD') else None
+
+# Mode job (send-async): messages traités sur un pool de threads, suivis via jobs/<id>/
+CHAT_JOB_WORKERS = int(os.getenv('CHAT_JOB_WORKERS', 2))
+CHAT_VIDEO_JOBS = os.getenv('CHAT_VIDEO_JOBS', 'true').lower() == 'true'
+CHAT_JOB_MAX_WAIT = float(os.getenv('CHAT_JOB_MAX_WAIT', 25))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,